@@ -0,0 +1,97 @@
+"""
+So sánh 2 backend đặc trưng (features.py): 'tfidf' (TF-IDF + One-Hot) và 'hashing' (băm cố định số chiều).
+- Tốc độ: thời gian fit trên dữ liệu train, thông lượng transform (dòng/giây) trên dữ liệu nhân bản.
+- Bộ nhớ: số chiều ma trận, kích thước artifact phải lưu (preprocessor + vectorizer).
+- Chất lượng phát hiện: precision/recall/F1/ROC-AUC theo K-fold (fit bộ biến đổi riêng trong từng fold).
+
+Chạy: python bench_features.py [--data wazuh_data.feather] [--rows 50000] [--model xgboost]
+"""
+import argparse
+import json
+import pickle
+import time
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold
+from sklearn.metrics import precision_score, recall_score, f1_score, roc_auc_score
+from config import RANDOM_STATE, CV_FOLDS
+from utils import logger, ensure_binary_labels
+from preprocess import load_dataset, auto_label, feature_engineer
+from feature_store import FeatureStore
+from features import FEATURE_BACKENDS, fit_transform_features, transform_features
+from train import get_model
+
+def _tile(obj, n_rows):
+    """Nhân bản dữ liệu tới n_rows dòng để đo thông lượng transform"""
+    reps = -(-n_rows // len(obj))
+    return pd.concat([obj] * reps, ignore_index=True).iloc[:n_rows]
+
+def bench_backend(backend, X_num, X_cat, X_text, y, big, model_backend, repeat=3):
+    result = {'backend': backend}
+
+    t0 = time.perf_counter()
+    X_full, artifacts, vectorizer = fit_transform_features(X_num, X_cat, X_text, backend=backend)
+    result['fit_seconds'] = time.perf_counter() - t0
+    result['n_features'] = X_full.shape[1]
+    result['artifact_bytes'] = len(pickle.dumps((artifacts['preprocessor'], vectorizer)))
+
+    # Thông lượng transform: lấy lần nhanh nhất trong `repeat` lần
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        transform_features(*big, artifacts, vectorizer)
+        best = min(best, time.perf_counter() - t0)
+    result['transform_rows_per_sec'] = len(big[0]) / best
+
+    # Chất lượng phát hiện: K-fold, bộ biến đổi fit lại trong từng fold (không rò rỉ từ vựng sang tập test)
+    if len(np.unique(y)) < 2:
+        logger.warning("⚠️ Dữ liệu chỉ có 1 lớp, bỏ qua đánh giá chất lượng.")
+        return result
+    cv = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=RANDOM_STATE)
+    probs = np.zeros(len(y))
+    for train_idx, test_idx in cv.split(X_num, y):
+        X_tr, fold_artifacts, fold_vec = fit_transform_features(
+            X_num.iloc[train_idx], X_cat.iloc[train_idx], X_text.iloc[train_idx], backend=backend)
+        X_te = transform_features(X_num.iloc[test_idx], X_cat.iloc[test_idx], X_text.iloc[test_idx],
+                                  fold_artifacts, fold_vec)
+        model = get_model(model_backend)
+        model.fit(X_tr, y.iloc[train_idx])
+        probs[test_idx] = model.predict_proba(X_te)[:, 1]
+    preds = (probs >= 0.5).astype(int)
+    result.update({
+        'precision': precision_score(y, preds, zero_division=0),
+        'recall': recall_score(y, preds, zero_division=0),
+        'f1': f1_score(y, preds, zero_division=0),
+        'roc_auc': roc_auc_score(y, probs),
+    })
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark backend đặc trưng tfidf vs hashing')
+    parser.add_argument('--data', default=None, help='File .feather hoặc .csv (mặc định: spool/CSV mới nhất)')
+    parser.add_argument('--rows', type=int, default=50000, help='Số dòng (nhân bản) để đo thông lượng transform')
+    parser.add_argument('--model', default='xgboost', help='Backend model dùng để đánh giá chất lượng')
+    parser.add_argument('--backends', nargs='+', default=list(FEATURE_BACKENDS), choices=FEATURE_BACKENDS)
+    parser.add_argument('--output', default=None, help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    df = auto_label(load_dataset(args.data))
+    df = df.join(FeatureStore(path=None).annotate(df))
+    X_num, X_cat, X_text, y = feature_engineer(df, is_training=True)
+    y = pd.Series(ensure_binary_labels(y), index=X_num.index)
+    big = (_tile(X_num, args.rows), _tile(X_cat, args.rows), _tile(X_text, args.rows))
+    logger.info(f"📊 Benchmark trên {len(df)} dòng (transform: {args.rows} dòng), model={args.model}")
+
+    results = [bench_backend(b, X_num, X_cat, X_text, y, big, args.model) for b in args.backends]
+
+    cols = ['backend', 'n_features', 'artifact_bytes', 'fit_seconds', 'transform_rows_per_sec',
+            'precision', 'recall', 'f1', 'roc_auc']
+    table = pd.DataFrame(results).reindex(columns=cols)
+    print("\n" + table.to_string(index=False, float_format=lambda v: f"{v:,.4f}"))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Đã ghi kết quả: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+So sánh bộ chấm điểm cây NumPy (tree_scorer.py) với model.predict_proba của wrapper sklearn.
+- Kiểm tra điểm số khớp nhau (sai lệch tuyệt đối lớn nhất).
+- Đo độ trễ p50/p99 mỗi lần gọi ở các kích thước batch 1, 32, 1024.
+
+Chạy: python bench_scorer.py [--data wazuh_data.feather] [--iterations 200] [--batch-sizes 1 32 1024]
+"""
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import vstack
+from utils import logger
+from inference import load_all
+from preprocess import load_dataset, feature_engineer
+from feature_store import FeatureStore
+from features import transform_features
+from tree_scorer import TreeScorer, load_scorer
+
+SCORE_TOLERANCE = 1e-5
+
+def _latencies(fn, X, batch_size, iterations, rng):
+    """Gọi fn trên các batch liên tiếp bắt đầu ngẫu nhiên, trả về mảng độ trễ (ms)"""
+    starts = rng.integers(0, X.shape[0] - batch_size + 1, size=iterations)
+    fn(X[:batch_size])  # làm nóng
+    out = np.empty(iterations)
+    for i, s in enumerate(starts):
+        Xb = X[s:s + batch_size]
+        t0 = time.perf_counter()
+        fn(Xb)
+        out[i] = (time.perf_counter() - t0) * 1000
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bộ chấm điểm cây NumPy vs predict_proba')
+    parser.add_argument('--data', default=None, help='File .feather hoặc .csv (mặc định: spool/CSV mới nhất)')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32, 1024])
+    parser.add_argument('--output', default=None, help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    model, artifacts, vectorizer, version = load_all()
+    if model is None:
+        raise SystemExit("❌ Chưa có model. Hãy chạy train.py trước.")
+    scorer = load_scorer()
+    if scorer is None:
+        logger.info("ℹ️ Chưa có file cây đã export, export tạm từ model đang nạp.")
+        scorer = TreeScorer.from_model(model)
+
+    df = load_dataset(args.data)
+    df = df.join(FeatureStore(path=None).annotate(df))
+    X_num, X_cat, X_text, _ = feature_engineer(df)
+    X = transform_features(X_num, X_cat, X_text, artifacts, vectorizer)
+
+    # 1. Điểm số phải khớp
+    diff = np.abs(model.predict_proba(X)[:, 1] - scorer.predict_proba(X)[:, 1]).max()
+    status = '✅ khớp' if diff <= SCORE_TOLERANCE else '❌ LỆCH'
+    print(f"\nModel {version}: {len(scorer.roots)} cây, sâu {scorer.max_depth}, "
+          f"{len(scorer.used_features)}/{scorer.n_features} cột được dùng")
+    print(f"Sai lệch điểm lớn nhất trên {X.shape[0]} dòng: {diff:.2e} ({status})\n")
+
+    # 2. Độ trễ
+    max_batch = max(args.batch_sizes)
+    if X.shape[0] < max_batch:
+        X = vstack([X] * (-(-max_batch // X.shape[0]))).tocsr()
+    rng = np.random.default_rng(0)
+    rows = []
+    for b in args.batch_sizes:
+        base = _latencies(model.predict_proba, X, b, args.iterations, rng)
+        fast = _latencies(scorer.predict_proba, X, b, args.iterations, rng)
+        rows.append({
+            'batch': b,
+            'predict_proba_p50_ms': np.percentile(base, 50), 'predict_proba_p99_ms': np.percentile(base, 99),
+            'scorer_p50_ms': np.percentile(fast, 50), 'scorer_p99_ms': np.percentile(fast, 99),
+            'speedup_p50': np.percentile(base, 50) / np.percentile(fast, 50),
+        })
+    print(pd.DataFrame(rows).to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'max_abs_diff': float(diff), 'latency': rows}, f, indent=2)
+        print(f"💾 Đã ghi kết quả: {args.output}")
+    if diff > SCORE_TOLERANCE:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Đo thông lượng (dòng/giây) và RAM đỉnh của từng bước trong pipeline trên dữ liệu giả lập (synthetic_data.py):
+  flatten           schema.flatten_alerts (theo từng trang như daemon)
+  auto_label        preprocess.auto_label
+  feature_engineer  preprocess.feature_engineer
+  predict           inference.predict_from_dataframe (feature store + transform + chấm điểm; cần model đã train)
+  report            report_generator.create_pro_report (PDF ghi xong bị xóa ngay)
+
+Kết quả ghi ra JSON; so với 1 file kết quả cũ (--baseline) để đánh dấu bước bị chậm đi / tốn RAM hơn.
+RAM đỉnh đo bằng tracemalloc (heap Python + NumPy) ở 1 lượt chạy riêng để không làm sai số đo tốc độ;
+bộ nhớ cấp phát trong C++ của XGBoost/LightGBM không nằm trong con số này.
+
+Chạy: python benchmark.py [--sizes 10000 100000 1000000] [--stages flatten predict] [--baseline benchmarks/old.json]
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from config import BENCHMARK_DIR
+from utils import logger
+from schema import flatten_alerts
+from preprocess import auto_label, feature_engineer
+from feature_store import FeatureStore
+from inference import load_all, predict_from_dataframe
+from report_generator import create_pro_report
+from synthetic_data import generate_alerts
+
+STAGES = ('flatten', 'auto_label', 'feature_engineer', 'predict', 'report')
+DEFAULT_SIZES = (10000, 100000, 1000000)
+FLATTEN_PAGE_SIZE = 10000       # Số alert mỗi lần flatten (bằng kích thước trang fetch của daemon)
+MAX_SLOWDOWN = 0.10             # Chậm hơn baseline quá 10% -> regression
+MAX_MEMORY_GROWTH = 0.20        # RAM đỉnh tăng quá 20% -> regression
+
+def _measure(fn, memory=True):
+    """Chạy fn 1 lần để đo thời gian, thêm 1 lần dưới tracemalloc để đo RAM đỉnh. Trả về (kết quả, giây, MB)."""
+    gc.collect()
+    t0 = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - t0
+    peak_mb = None
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak_mb
+
+def _bench_flatten(alerts, memory):
+    """
+    Flatten theo từng trang lấy dần từ generator alerts (chỉ 1 trang dict thô nằm trong RAM);
+    thời gian cộng dồn (không tính thời gian sinh dữ liệu), RAM đỉnh lấy trang lớn nhất.
+    """
+    frames, seconds, peak = [], 0.0, None
+    while True:
+        page = list(itertools.islice(alerts, FLATTEN_PAGE_SIZE))
+        if not page:
+            break
+        frame, dt, mb = _measure(lambda: flatten_alerts(page), memory)
+        frames.append(frame)
+        seconds += dt
+        if mb is not None:
+            peak = max(peak or 0.0, mb)
+    return pd.concat(frames, ignore_index=True), seconds, peak
+
+def run_size(n, stages, snapshot, memory=True, **gen_opts):
+    """Chạy các bước đã chọn trên n alert giả lập, trả về list kết quả từng bước"""
+    logger.info(f"🧪 Sinh {n:,} alert giả lập (theo từng trang {FLATTEN_PAGE_SIZE:,})...")
+    results = []
+
+    def record(stage, seconds, peak_mb):
+        row = {'stage': stage, 'rows': n, 'seconds': seconds,
+               'rows_per_sec': n / max(seconds, 1e-9), 'peak_mb': peak_mb}
+        results.append(row)
+        mem = f", peak {peak_mb:,.0f} MB" if peak_mb is not None else ""
+        logger.info(f"   {stage:<17} {n:>9,} rows: {seconds:8.2f}s ({row['rows_per_sec']:>12,.0f} rows/s{mem})")
+
+    # Các bước sau cần DataFrame đã flatten nên luôn flatten; chỉ ghi kết quả khi được chọn
+    df, seconds, peak = _bench_flatten(generate_alerts(n, **gen_opts), memory and 'flatten' in stages)
+    if 'flatten' in stages:
+        record('flatten', seconds, peak)
+
+    labeled = None
+    if {'auto_label', 'report'} & set(stages):
+        labeled, seconds, peak = _measure(lambda: auto_label(df), memory and 'auto_label' in stages)
+        if 'auto_label' in stages:
+            record('auto_label', seconds, peak)
+
+    if 'feature_engineer' in stages:
+        _, seconds, peak = _measure(lambda: feature_engineer(df, is_training=False), memory)
+        record('feature_engineer', seconds, peak)
+
+    scored = labeled if labeled is not None else df
+    if 'predict' in stages:
+        if snapshot is None or snapshot.model is None:
+            logger.warning("⚠️ Chưa có model, bỏ qua bước predict (chạy train.py trước).")
+        else:
+            def predict():
+                # Mỗi lượt dùng bản sao + feature store rỗng trong RAM: các lượt đo như nhau, không ghi trạng thái daemon
+                batch = scored.copy()
+                preds, probs = predict_from_dataframe(batch, loaded=snapshot, feature_store=FeatureStore(path=None))
+                if preds is None:
+                    raise RuntimeError("Dự đoán thất bại")
+                batch['ai_pred'], batch['ai_score'] = preds, probs
+                return batch
+            scored, seconds, peak = _measure(predict, memory)
+            record('predict', seconds, peak)
+
+    if 'report' in stages:
+        paths = []
+
+        def report():
+            path = create_pro_report(scored)
+            if path is None:
+                raise RuntimeError("Tạo báo cáo thất bại")
+            paths.append(path)
+            return path
+        try:
+            _, seconds, peak = _measure(report, memory)
+            record('report', seconds, peak)
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+    return results
+
+def compare_results(current, baseline, max_slowdown=MAX_SLOWDOWN, max_memory_growth=MAX_MEMORY_GROWTH):
+    """
+    So khớp từng (stage, rows) với baseline. Trả về list regression dạng
+    {'stage', 'rows', 'metric', 'baseline', 'current', 'change'}.
+    """
+    base = {(r['stage'], r['rows']): r for r in baseline.get('results', [])}
+    regressions = []
+    for r in current['results']:
+        old = base.get((r['stage'], r['rows']))
+        if old is None:
+            continue
+        r['baseline_rows_per_sec'] = old['rows_per_sec']
+        r['speed_change'] = r['rows_per_sec'] / old['rows_per_sec'] - 1
+        if r['speed_change'] < -max_slowdown:
+            regressions.append({'stage': r['stage'], 'rows': r['rows'], 'metric': 'rows_per_sec',
+                                'baseline': old['rows_per_sec'], 'current': r['rows_per_sec'],
+                                'change': r['speed_change']})
+        if r.get('peak_mb') and old.get('peak_mb'):
+            r['baseline_peak_mb'] = old['peak_mb']
+            r['memory_change'] = r['peak_mb'] / old['peak_mb'] - 1
+            if r['memory_change'] > max_memory_growth:
+                regressions.append({'stage': r['stage'], 'rows': r['rows'], 'metric': 'peak_mb',
+                                    'baseline': old['peak_mb'], 'current': r['peak_mb'],
+                                    'change': r['memory_change']})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark thông lượng / RAM từng bước pipeline trên dữ liệu giả lập')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--threat-ratio', type=float, default=0.05)
+    parser.add_argument('--agents', type=int, default=50)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--ips', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-memory', action='store_true', help='Bỏ lượt đo RAM (nhanh gấp đôi)')
+    parser.add_argument('--output', default=None, help='File JSON kết quả (mặc định: benchmarks/bench_<thời gian>.json)')
+    parser.add_argument('--baseline', default=None, help='File JSON kết quả cũ để so sánh')
+    parser.add_argument('--max-slowdown', type=float, default=MAX_SLOWDOWN)
+    parser.add_argument('--max-memory-growth', type=float, default=MAX_MEMORY_GROWTH)
+    args = parser.parse_args()
+
+    snapshot = None
+    if 'predict' in args.stages:
+        snapshot = load_all()
+
+    gen_opts = dict(n_agents=args.agents, n_users=args.users, n_ips=args.ips,
+                    threat_ratio=args.threat_ratio, seed=args.seed)
+    results = []
+    for n in args.sizes:
+        results += run_size(n, args.stages, snapshot, memory=not args.no_memory, **gen_opts)
+
+    current = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'model_version': getattr(snapshot, 'version', None),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'generator': gen_opts,
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(current, baseline, args.max_slowdown, args.max_memory_growth)
+        current['baseline'] = args.baseline
+        current['regressions'] = regressions
+
+    table = pd.DataFrame(results)
+    print("\n" + table.to_string(index=False, float_format=lambda v: f"{v:,.3f}"))
+
+    if args.output:
+        output = args.output
+    else:
+        BENCHMARK_DIR.mkdir(parents=True, exist_ok=True)
+        output = BENCHMARK_DIR / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, indent=2)
+    print(f"💾 Đã ghi kết quả: {output}")
+
+    if regressions:
+        for r in regressions:
+            print(f"❌ REGRESSION {r['stage']} @ {r['rows']:,} rows: {r['metric']} "
+                  f"{r['baseline']:,.1f} -> {r['current']:,.1f} ({r['change']:+.1%})")
+        raise SystemExit(1)
+    if args.baseline:
+        print("✅ Không có regression so với baseline.")
+
+if __name__ == '__main__':
+    main()
@@ -11,21 +11,133 @@ BASE_DIR = Path(__file__).resolve().parent
 # Đường dẫn đến file dữ liệu log (nằm ở thư mục gốc SIEM-PROJECT)
 DATA_PATH = BASE_DIR.parent / 'wazuh_data.csv'
 
+# Spool nhị phân dạng cột (Arrow IPC / Feather) do fetch_alerts ghi ra.
+# Inference/train/report đọc file này (memory-map, giữ nguyên kiểu dữ liệu) thay vì parse lại CSV.
+# CSV ở DATA_PATH chỉ còn là bản export tùy chọn.
+SPOOL_PATH = BASE_DIR.parent / 'wazuh_data.feather'
+
 # Thư mục để lưu các model đã huấn luyện
 MODEL_DIR = BASE_DIR / 'models'
 # Tự động tạo thư mục models nếu chưa có
 MODEL_DIR.mkdir(parents=True, exist_ok=True)
 
+# Thư mục lưu trạng thái chạy (cursor fetch, cache...) giữa các lần chạy
+STATE_DIR = BASE_DIR / 'state'
+STATE_DIR.mkdir(parents=True, exist_ok=True)
+
 # Đường dẫn chi tiết cho từng file thành phần của model
 MODEL_PATH = MODEL_DIR / 'ai_model_v3.joblib'       # File chứa model chính (XGBoost/LightGBM)
 VECTORIZER_PATH = MODEL_DIR / 'tfidf_v3.joblib'     # File chứa bộ xử lý NLP (TF-IDF)
 ENCODERS_PATH = MODEL_DIR / 'encoders_v3.joblib'    # File chứa bộ mã hóa số (LabelEncoders)
+MANIFEST_PATH = MODEL_DIR / 'manifest_v3.json'      # Ghi sau cùng khi lưu model: version + hash từng file
+SCORER_PATH = MODEL_DIR / 'trees_v3.npz'            # Cây quyết định đã "phẳng hóa" cho bộ chấm điểm NumPy (tree_scorer.py)
+
+# Chu kỳ (giây) kiểm tra file model trên đĩa để tự nạp lại khi train.py ghi bản mới
+ARTIFACT_CHECK_INTERVAL = 5
+
+# --- CACHE KẾT QUẢ THREAT INTEL (AbuseIPDB / VirusTotal) ---
+TI_CACHE_PATH = STATE_DIR / 'ti_cache.sqlite'   # Lưu trên đĩa, dùng lại giữa các lần chạy
+TI_CACHE_MAX_ITEMS = 10000                      # Số verdict tối đa giữ trong RAM (LRU)
+# TTL (giây) theo nhà cung cấp và theo kết quả: kết quả sạch (negative) hết hạn sớm hơn kết quả độc hại
+TI_CACHE_TTL = {
+    'abuseipdb': {'positive': 24 * 3600, 'negative': 6 * 3600},
+    'virustotal': {'positive': 7 * 24 * 3600, 'negative': 24 * 3600},
+}
+
+# --- CHỐNG TRÙNG CẢNH BÁO GIỮA CÁC CHU KỲ (DEDUP / SUPPRESSION) ---
+DEDUP_TTL = 3600                 # Nhớ 1 alert đã xử lý trong bao lâu (giây)
+DEDUP_BUCKET_SECONDS = 300       # Độ rộng mỗi "ngăn" thời gian; cũng là time bucket của fingerprint dự phòng
+DEDUP_MAX_ENTRIES = 200000       # Trần số fingerprint giữ trong RAM (bỏ ngăn cũ nhất khi vượt)
+DEDUP_STATE_PATH = STATE_DIR / 'dedup_store.pkl'   # None = chỉ giữ trong RAM
+
+# --- FEATURE STORE HÀNH VI (CỬA SỔ TRƯỢT THEO srcip / agent / user) ---
+FEATURE_WINDOWS = {'1m': 60, '5m': 300, '1h': 3600}   # Các cửa sổ đếm (tên -> giây)
+FEATURE_SLICE_SECONDS = 60       # Độ mịn của cửa sổ đếm (count-min sketch theo từng ngăn 60s)
+DISTINCT_SLICE_SECONDS = 300     # Độ mịn của đếm phân biệt (HyperLogLog theo từng ngăn 5 phút)
+CMS_WIDTH = 2048                 # Count-min sketch: số ô mỗi hàng (lũy thừa của 2)
+CMS_DEPTH = 4                    # Count-min sketch: số hàng (hàm băm)
+HLL_PRECISION = 6                # HyperLogLog: 2^6 = 64 thanh ghi/khóa (sai số ~13%)
+FEATURE_STORE_MAX_KEYS = 50000   # Trần số khóa HLL mỗi ngăn (bỏ bớt khi vượt để chặn RAM)
+FEATURE_STORE_STATE_PATH = STATE_DIR / 'feature_store.pkl'   # None = chỉ giữ trong RAM
+
+# --- DỊCH VỤ CHẤM ĐIỂM THỜI GIAN THỰC (serve.py) ---
+SERVE_HOST = os.getenv('SERVE_HOST', '127.0.0.1')
+SERVE_PORT = int(os.getenv('SERVE_PORT', '8088'))
+SERVE_MAX_BATCH = 256            # Gom tối đa bấy nhiêu alert vào 1 micro-batch
+SERVE_MAX_WAIT_MS = 20           # Alert chờ gom batch tối đa bấy nhiêu ms (tính từ request đến sớm nhất)
+SERVE_QUEUE_MAX = 10000          # Quá số alert đang chờ này thì trả 503 (chống quá tải)
+SERVE_REQUEST_TIMEOUT = 10.0     # Thời gian tối đa 1 request chờ có kết quả (giây)
+
+# --- ĐO ĐẠC PIPELINE (metrics.py) ---
+METRICS_PROM_PATH = STATE_DIR / 'metrics.prom'       # Prometheus text, ghi đè mỗi chu kỳ (node_exporter textfile collector)
+METRICS_JSONL_PATH = STATE_DIR / 'metrics.jsonl'     # 1 dòng JSON mỗi chu kỳ (thời gian, số dòng từng bước, cache, RAM)
+METRICS_JSONL_MAX_BYTES = 50 * 2 ** 20              # Quá cỡ này thì đổi tên thành .1 rồi ghi file mới
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+PROFILE_DIR = STATE_DIR / 'profiles'                 # Kết quả cProfile (.prof) / tracemalloc (.txt)
+PROFILE_TRIGGER_PATH = STATE_DIR / 'profile.trigger' # Tạo file này ("<số chu kỳ> [cprofile|tracemalloc]") để bật profiler khi đang chạy
+PROFILE_CYCLES = 3                                   # Số chu kỳ profile mặc định khi file trigger rỗng
+
+# Thư mục chứa kết quả benchmark.py (JSON, dùng làm baseline để so sánh giữa các lần chạy)
+BENCHMARK_DIR = BASE_DIR / 'benchmarks'
+
+# --- SỐ LIỆU TỔNG HỢP CHO BÁO CÁO (rollup_store.py) ---
+# Mỗi chu kỳ daemon cộng dồn số đếm theo giờ (tổng / agent / rule / process / MITRE) vào SQLite,
+# báo cáo theo khoảng thời gian chỉ đọc các dòng tổng hợp, không quét lại log thô
+ROLLUP_DB_PATH = STATE_DIR / 'rollups.sqlite'   # None = tắt
+ROLLUP_RETENTION_DAYS = 90       # Xóa số liệu theo giờ cũ hơn bấy nhiêu ngày
+REPORT_RANGE = '24h'             # Khoảng thời gian mặc định của báo cáo daemon ('24h', '7d', '30d'...)
+REPORT_TOP_N = 5                 # Số dòng của các bảng Top trong báo cáo
 
 # --- THAM SỐ HUẤN LUYỆN (TRAINING PARAMS) ---
 RANDOM_STATE = 42           # Hạt giống ngẫu nhiên để kết quả nhất quán
 CV_FOLDS = 5                # Số lần kiểm tra chéo (Cross-validation folds)
 TFIDF_MAX_FEATURES = 1000   # Số lượng từ vựng tối đa cho NLP (tăng lên nếu máy mạnh)
 
+# --- BACKEND ĐẶC TRƯNG (FEATURE BACKEND) ---
+# 'tfidf'  : TF-IDF + One-Hot (học từ vựng khi train, phải lưu và nạp lại từ vựng)
+# 'hashing': băm cố định số chiều cho text và category -> không cần fit, RAM cố định,
+#            không có file từ vựng, chia cho nhiều worker thoải mái (IP/agent mới không làm phình model)
+FEATURE_BACKEND = 'tfidf'
+HASH_TEXT_FEATURES = 2 ** 16     # Số chiều băm cho văn bản (unigram + bigram)
+HASH_CAT_FEATURES = 2 ** 12      # Số chiều băm cho các cột category (rule.id, agent.name, srcip...)
+
+# --- ĐẶC TRƯNG SONG SONG (parallel_features.py) ---
+# Batch lớn (backfill, burst) được chia thành khối dòng, feature_engineer + transform chạy trên nhiều tiến trình
+FEATURIZE_WORKERS = 0                # Số tiến trình (0 = số core; 1 = tắt song song)
+FEATURIZE_PARALLEL_MIN_ROWS = 20000  # Batch nhỏ hơn chạy tuần tự (chi phí gửi dữ liệu sang tiến trình khác không đáng)
+FEATURIZE_SHARD_ROWS = 10000         # Số dòng mỗi khối gửi cho 1 tiến trình
+
+# --- CACHE MA TRẬN ĐẶC TRƯNG KHI TRAIN (feature_cache.py) ---
+# Khóa = hash(dữ liệu đầu vào + LABEL_RULES + cấu hình/mã nguồn đặc trưng): dữ liệu/quy tắc đổi thì tự tính lại
+FEATURE_CACHE_DIR = STATE_DIR / 'feature_cache'
+FEATURE_CACHE_MAX_ENTRIES = 5    # Giữ tối đa bấy nhiêu bộ ma trận (xóa bộ dùng lâu nhất)
+
+# --- DÒ SIÊU THAM SỐ (train.py --tune, xem tune.py) ---
+TUNE_BUDGET_SECONDS = 600        # Ngân sách thời gian thực cho cả lượt dò (giây)
+TUNE_CANDIDATES = 9              # Số cấu hình ngẫu nhiên mỗi backend ở vòng đầu
+TUNE_MIN_ROUNDS = 50             # Số cây của vòng đầu (successive halving)
+TUNE_MAX_ROUNDS = 1000           # Trần số cây
+TUNE_ETA = 3                     # Mỗi vòng giữ 1/ETA cấu hình tốt nhất, số cây nhân ETA
+TUNE_EARLY_STOPPING = 30         # Dừng sớm khi logloss tập validation không giảm sau bấy nhiêu cây
+TUNE_VALID_FRACTION = 0.2        # Tỉ lệ dữ liệu giữ lại để chấm các cấu hình
+TUNE_DIR = STATE_DIR / 'tuning'  # Báo cáo JSON của từng lượt dò
+
+# --- HUẤN LUYỆN TĂNG DẦN (train.py --incremental, xem incremental.py) ---
+# Boost thêm cây lên model đang chạy bằng cửa sổ dữ liệu mới, giữ nguyên preprocessor / vectorizer
+INCREMENTAL_ROUNDS = 100             # Số cây thêm mỗi lần cập nhật
+INCREMENTAL_VALID_FRACTION = 0.2     # Phần cửa sổ mới giữ lại để kiểm tra (model cũ vs model mới)
+INCREMENTAL_MAX_METRIC_DROP = 0.01   # AP / F1 giảm quá mức này trên bất kỳ tập kiểm tra nào -> từ chối cập nhật
+INCREMENTAL_MAX_TREES = 3000         # Vượt số cây này thì cảnh báo nên train lại từ đầu (độ trễ chấm tăng theo số cây)
+INCREMENTAL_HISTORY_PATH = STATE_DIR / 'incremental_history.jsonl'  # Nhật ký các lần cập nhật (chấp nhận / từ chối)
+
+# --- TRAIN TỪ KHO LƯU TRỮ PHÂN VÙNG THEO NGÀY (train.py --data-dir, xem data_loader.py) ---
+# Thư mục chứa các file theo ngày (vd: archive/2026-10-01.feather, archive/date=2026-10-01/part-0.csv)
+ARCHIVE_DIR = BASE_DIR.parent / 'archive'
+PARTITION_CHUNKSIZE = 50000        # Số dòng mỗi khối đọc (RAM đỉnh tỉ lệ với số này, không với tổng dữ liệu)
+NEG_SAMPLE_RATE = 0.05             # Tỉ lệ giữ mẫu an toàn (sau khi mỗi nhóm đã đủ NEG_STRATUM_MIN_KEEP dòng)
+NEG_STRATUM_MIN_KEEP = 2000        # Mỗi nhóm mẫu an toàn luôn giữ nguyên bấy nhiêu dòng đầu (nhóm hiếm không bị mất)
+NEG_STRATUM_COLUMN = 'rule.id'     # Cột chia nhóm khi lấy mẫu (Software Protection, agent disconnect... là các rule riêng)
+
 # --- CẤU HÌNH GÁN NHÃN TỰ ĐỘNG (AUTO-LABELING RULES) ---
 # Đây là nơi bạn dạy cho AI biết thế nào là "Nguy hiểm" bước đầu
 LABEL_RULES = {
@@ -49,6 +161,9 @@ LABEL_RULES = {
     }
 }
 
+# Tiến trình/công cụ hệ thống hay bị lạm dụng kiểu 'Living off the Land' (dùng trong report)
+LOTL_INDICATORS = ['powershell', 'cmd']
+
 # --- CHỌN THUẬT TOÁN (BACKEND) ---
 # Các lựa chọn: 'xgboost', 'lightgbm', 'catboost'
 # Mặc định dùng XGBoost vì nó mạnh và phổ biến nhất
@@ -0,0 +1,177 @@
+"""
+Nạp dữ liệu train ngoài RAM từ kho lưu trữ phân vùng theo ngày
+(chạy: python train.py --data-dir archive/ [--since 2026-09-01] [--until 2026-10-01]).
+
+- Đọc lần lượt từng file trong ARCHIVE_DIR (Feather / CSV / NDJSON, ngày lấy từ tên file hoặc thư mục)
+  theo thứ tự ngày, mỗi file theo khối PARTITION_CHUNKSIZE dòng: auto_label / feature_engineer chỉ copy 1 khối.
+- Giữ mọi mẫu threat. Mẫu an toàn (>99% là nhiễu: Software Protection, agent disconnect...) được lấy mẫu
+  phân tầng theo NEG_STRATUM_COLUMN: mỗi nhóm giữ nguyên NEG_STRATUM_MIN_KEEP dòng đầu, sau đó giữ với xác suất
+  NEG_SAMPLE_RATE và trọng số 1/NEG_SAMPLE_RATE -> tổng trọng số xấp xỉ số dòng thật của mỗi nhóm.
+- Đặc trưng hành vi (FeatureStore) được phát lại liên tục qua mọi phân vùng trước khi lấy mẫu, nên đếm theo
+  cửa sổ vẫn tính cả các dòng bị bỏ.
+- Backend 'hashing': text vector hóa ngay trong từng khối, chỉ giữ ma trận thưa. Backend 'tfidf' cần học từ vựng
+  nên giữ chuỗi text của các dòng đã chọn rồi fit ở cuối.
+- Quy tắc "IP hiếm" của auto_label cần tần suất IP trên cả tập dữ liệu: lượt đọc đầu chỉ đọc cột data.srcip
+  của mọi phân vùng để đếm, nên nhãn giống hệt khi train bằng --data trên cùng dữ liệu.
+"""
+import re
+from datetime import date
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.sparse import vstack
+from config import (RANDOM_STATE, FEATURE_BACKEND, ARCHIVE_DIR, PARTITION_CHUNKSIZE, NEG_SAMPLE_RATE,
+                    NEG_STRATUM_MIN_KEEP, NEG_STRATUM_COLUMN)
+from utils import logger, ensure_binary_labels
+from preprocess import iter_dataset, auto_label, feature_engineer, srcip_keys
+from feature_store import FeatureStore
+from features import build_vectorizer, fit_transform_features
+from spool import SPOOL_SUFFIXES
+
+PARTITION_SUFFIXES = SPOOL_SUFFIXES + ('.csv', '.ndjson', '.jsonl')
+_DATE_RE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})')
+
+def partition_date(path):
+    """Ngày của phân vùng: chuỗi YYYY-MM-DD / YYYYMMDD cuối cùng trong đường dẫn, không có thì None"""
+    for match in reversed(list(_DATE_RE.finditer(str(path)))):
+        try:
+            return date(*map(int, match.groups()))
+        except ValueError:
+            continue
+    return None
+
+def list_partitions(root=ARCHIVE_DIR, since=None, until=None):
+    """
+    Các file dữ liệu trong root (đệ quy), sắp theo (ngày, đường dẫn).
+    since / until (date, tính cả 2 đầu): lọc theo ngày; khi có lọc thì file không xác định được ngày bị bỏ qua.
+    """
+    root = Path(root)
+    if not root.is_dir():
+        raise FileNotFoundError(f"Thư mục dữ liệu {root} không tồn tại.")
+    found = []
+    for path in root.rglob('*'):
+        if not path.is_file() or path.suffix.lower() not in PARTITION_SUFFIXES:
+            continue
+        day = partition_date(path.relative_to(root))
+        if since or until:
+            if day is None or (since and day < since) or (until and day > until):
+                continue
+        found.append((day or date.min, str(path), path))
+    return [path for _, _, path in sorted(found)]
+
+class NegativeSampler:
+    """
+    Lấy mẫu phân tầng các dòng an toàn khi đọc theo luồng (không cần biết trước kích thước mỗi nhóm).
+    Dòng threat luôn được giữ với trọng số 1.
+    """
+
+    def __init__(self, rate=NEG_SAMPLE_RATE, min_keep=NEG_STRATUM_MIN_KEEP, seed=RANDOM_STATE):
+        if not 0 < rate <= 1:
+            raise ValueError("rate phải trong (0, 1].")
+        self.rate = rate
+        self.min_keep = min_keep
+        self.rng = np.random.default_rng(seed)
+        self.seen = {}      # nhóm -> số dòng an toàn đã gặp
+        self.kept = {}      # nhóm -> số dòng an toàn đã giữ
+
+    def sample(self, strata, y):
+        """strata: mảng nhóm từng dòng, y: nhãn 0/1. Trả về (mask giữ, trọng số từng dòng)."""
+        y = np.asarray(y)
+        keep = np.ones(len(y), dtype=bool)
+        weight = np.ones(len(y), dtype=np.float32)
+        neg = y == 0
+        if not neg.any():
+            return keep, weight
+        groups = pd.Series(np.asarray(strata)[neg])
+        # Thứ tự của dòng trong nhóm tính từ đầu luồng dữ liệu
+        ordinal = groups.groupby(groups).cumcount().to_numpy() + groups.map(self.seen).fillna(0).to_numpy()
+        exact = ordinal < self.min_keep
+        keep_neg = exact | (self.rng.random(len(groups)) < self.rate)
+        keep[neg] = keep_neg
+        weight[neg] = np.where(exact, 1.0, 1.0 / self.rate)
+        for name, count in groups.value_counts().items():
+            self.seen[name] = self.seen.get(name, 0) + int(count)
+        for name, count in groups[keep_neg].value_counts().items():
+            self.kept[name] = self.kept.get(name, 0) + int(count)
+        return keep, weight
+
+def srcip_frequencies(files, chunksize=PARTITION_CHUNKSIZE):
+    """Tần suất (tỉ lệ) từng IP nguồn trên mọi phân vùng, chỉ đọc cột data.srcip. None nếu dữ liệu không có cột này."""
+    counts, total = None, 0
+    for path in files:
+        for chunk in iter_dataset(path, chunksize, columns=['data.srcip']):
+            if 'data.srcip' not in chunk.columns:
+                continue
+            part = srcip_keys(chunk).value_counts()
+            counts = part if counts is None else counts.add(part, fill_value=0)
+            total += len(chunk)
+    if counts is None:
+        return None
+    return counts / max(total, 1)
+
+def load_partitioned_matrix(data_dir=None, feature_backend=FEATURE_BACKEND, since=None, until=None,
+                            chunksize=PARTITION_CHUNKSIZE, rate=NEG_SAMPLE_RATE, min_keep=NEG_STRATUM_MIN_KEEP):
+    """
+    Dựng ma trận train từ kho phân vùng theo từng khối.
+    Trả về (X_full, y, artifacts, vectorizer, sample_weight).
+    """
+    data_dir = Path(data_dir) if data_dir is not None else ARCHIVE_DIR
+    files = list_partitions(data_dir, since, until)
+    if not files:
+        raise FileNotFoundError(f"Không có file dữ liệu nào trong {data_dir} (lọc {since} -> {until}).")
+    logger.info(f"🗄️  Streaming {len(files)} partitions from {data_dir} "
+                f"(negatives: first {min_keep}/stratum, then {rate:.1%} by '{NEG_STRATUM_COLUMN}')")
+
+    srcip_freqs = srcip_frequencies(files, chunksize)
+    store = FeatureStore(path=None)
+    sampler = NegativeSampler(rate, min_keep)
+    # hashing: vector hóa text ngay trong khối (không trạng thái), tfidf: giữ chuỗi để fit từ vựng ở cuối
+    hasher = build_vectorizer('hashing') if feature_backend == 'hashing' else None
+    nums, cats, texts, ys, weights = [], [], [], [], []
+    total_rows = 0
+    for path in files:
+        file_rows = file_kept = 0
+        for chunk in iter_dataset(path, chunksize, consumer='train'):
+            if chunk.empty:
+                continue
+            chunk = auto_label(chunk, srcip_freqs)
+            chunk = chunk.join(store.annotate(chunk))
+            X_num, X_cat, X_text, y = feature_engineer(chunk, is_training=True)
+            y = ensure_binary_labels(y)
+            if NEG_STRATUM_COLUMN in chunk.columns:
+                strata = chunk[NEG_STRATUM_COLUMN].astype(object).fillna('unknown').astype(str).to_numpy()
+            else:
+                strata = np.full(len(chunk), 'unknown', dtype=object)
+            keep, weight = sampler.sample(strata, y)
+            nums.append(X_num[keep].astype(np.float32))
+            cats.append(X_cat[keep])
+            texts.append(hasher.transform(X_text[keep]) if hasher is not None else X_text[keep])
+            ys.append(y[keep])
+            weights.append(weight[keep])
+            file_rows += len(y)
+            file_kept += int(keep.sum())
+        total_rows += file_rows
+        logger.info(f"   📅 {path.relative_to(data_dir)}: {file_rows} rows -> {file_kept} kept")
+
+    if not ys:
+        raise ValueError(f"Các file trong {data_dir} không có dòng dữ liệu nào.")
+    y = np.concatenate(ys)
+    sample_weight = np.concatenate(weights)
+    X_num = pd.concat(nums, ignore_index=True).fillna(0)
+    X_cat = pd.concat(cats, ignore_index=True)
+    del nums, cats, ys, weights
+
+    logger.info(f"🎯 Kept {len(y)}/{total_rows} rows ({len(y) / max(total_rows, 1):.2%}): "
+                f"{int(y.sum())} threats, weighted total {sample_weight.sum():,.0f}")
+    top = sorted(sampler.seen.items(), key=lambda kv: -kv[1])[:5]
+    for name, seen in top:
+        logger.info(f"   {NEG_STRATUM_COLUMN}={name}: {seen} benign -> {sampler.kept.get(name, 0)} kept")
+
+    logger.info("⚙️  Transforming features...")
+    if hasher is not None:
+        X_full, artifacts, vectorizer = fit_transform_features(X_num, X_cat, None, backend=feature_backend,
+                                                               text_matrix=vstack(texts).tocsr())
+    else:
+        X_full, artifacts, vectorizer = fit_transform_features(X_num, X_cat, pd.concat(texts, ignore_index=True),
+                                                               backend=feature_backend)
+    return X_full, y, artifacts, vectorizer, sample_weight
@@ -0,0 +1,115 @@
+import os
+import pickle
+import time
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from config import DEDUP_TTL, DEDUP_BUCKET_SECONDS, DEDUP_MAX_ENTRIES, DEDUP_STATE_PATH
+from utils import logger
+
+# Các trường ghép thành fingerprint khi alert không có 'id'
+FALLBACK_KEY_FIELDS = ['rule.id', 'agent.id', 'data.srcip']
+
+def alert_fingerprints(df, bucket_seconds=DEDUP_BUCKET_SECONDS):
+    """
+    Fingerprint 64-bit (ổn định giữa các tiến trình) cho từng alert.
+    Ưu tiên trường 'id' của Wazuh; thiếu thì dùng rule.id + agent.id + srcip + time bucket của timestamp.
+    """
+    n = len(df)
+    parts = []
+    for col in FALLBACK_KEY_FIELDS:
+        parts.append(df[col].astype(str) if col in df.columns else pd.Series(['-'] * n, index=df.index))
+    if 'timestamp' in df.columns:
+        ts = pd.to_datetime(df['timestamp'], errors='coerce', utc=True)
+        bucket = ((ts - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=bucket_seconds))
+        bucket = bucket.fillna(-1).astype('int64').astype(str)
+    else:
+        bucket = pd.Series(['-'] * n, index=df.index)
+    key = parts[0] + '|' + parts[1] + '|' + parts[2] + '|' + bucket
+
+    if 'id' in df.columns:
+        ids = df['id']
+        key = key.where(ids.isna(), 'id:' + ids.astype(str))
+    return pd.util.hash_pandas_object(key, index=False).to_numpy(dtype=np.uint64)
+
+class SuppressionStore:
+    """
+    Bộ nhớ chống trùng có giới hạn: các "ngăn" thời gian (theo thời điểm thấy alert), mỗi ngăn là
+    hash set fingerprint -> số lần lặp. Ngăn quá DEDUP_TTL bị bỏ nguyên khối nên RAM luôn bị chặn trên.
+    Có thể lưu xuống đĩa để chế độ chạy từng script (subprocess) vẫn nhớ được giữa các chu kỳ.
+    """
+
+    def __init__(self, ttl=DEDUP_TTL, bucket_seconds=DEDUP_BUCKET_SECONDS,
+                 max_entries=DEDUP_MAX_ENTRIES, path=DEDUP_STATE_PATH):
+        self.ttl = ttl
+        self.bucket_seconds = bucket_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self._buckets = OrderedDict()   # bucket_start -> {fingerprint: count}
+        self.stats = {'seen': 0, 'new': 0, 'suppressed': 0}
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                self._buckets = pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Không đọc được dedup store ({e}), bắt đầu lại từ đầu.")
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self._buckets, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return sum(len(b) for b in self._buckets.values())
+
+    def _evict(self, now):
+        oldest_allowed = now - self.ttl
+        while self._buckets and next(iter(self._buckets)) + self.bucket_seconds <= oldest_allowed:
+            self._buckets.popitem(last=False)
+        while len(self._buckets) > 1 and len(self) > self.max_entries:
+            self._buckets.popitem(last=False)
+
+    def filter_new(self, df, now=None):
+        """
+        Đánh dấu alert mới và gộp các bản lặp.
+        Trả về (is_new, repeat_count):
+          - is_new[i]: True nếu alert i chưa từng thấy (và là lần xuất hiện đầu tiên trong batch)
+          - repeat_count[i]: với alert mới = số lần fingerprint đó xuất hiện trong batch
+        Alert đã thấy chỉ được cộng dồn bộ đếm, không đi tiếp sang tra cứu TI / gửi cảnh báo.
+        """
+        now = time.time() if now is None else now
+        self._evict(now)
+        current = int(now // self.bucket_seconds) * self.bucket_seconds
+        bucket = self._buckets.setdefault(current, {})
+
+        fps = alert_fingerprints(df, self.bucket_seconds)
+        uniq, first_idx, counts = np.unique(fps, return_index=True, return_counts=True)
+
+        is_new = np.zeros(len(fps), dtype=bool)
+        repeat_count = np.zeros(len(fps), dtype=np.int64)
+        for fp, idx, cnt in zip(uniq.tolist(), first_idx.tolist(), counts.tolist()):
+            owner = next((b for b in self._buckets.values() if fp in b), None)
+            if owner is not None:
+                owner[fp] += cnt
+                continue
+            bucket[fp] = cnt
+            is_new[idx] = True
+            repeat_count[idx] = cnt
+
+        n_new = int(is_new.sum())
+        self.stats['seen'] += len(fps)
+        self.stats['new'] += n_new
+        self.stats['suppressed'] += len(fps) - n_new
+        return is_new, repeat_count
+
+    def count(self, fingerprint):
+        """Tổng số lần đã thấy 1 fingerprint (0 nếu đã quên/chưa thấy)"""
+        return sum(b.get(fingerprint, 0) for b in self._buckets.values())
@@ -0,0 +1,103 @@
+"""
+Cache ma trận đặc trưng đã gán nhãn + biến đổi cho train.py (đánh địa chỉ theo nội dung).
+Khóa = sha256 của: nội dung file dữ liệu, LABEL_RULES, backend + tham số đặc trưng / feature store,
+mã nguồn các module tạo đặc trưng và phiên bản scikit-learn. Đổi bất kỳ thứ gì trong đó -> khóa mới -> tính lại.
+
+Mỗi mục gồm 3 file trong FEATURE_CACHE_DIR:
+  <khóa>.npz     ma trận CSR (data/indices/indptr/shape) + nhãn y, không nén để nạp nhanh
+  <khóa>.joblib  (artifacts, vectorizer) đã fit, để train.py lưu kèm model như khi tính mới
+  <khóa>.json    metadata; ghi SAU CÙNG nên chỉ mục nào có .json mới được coi là hoàn chỉnh
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+import joblib
+import numpy as np
+import sklearn
+from scipy.sparse import csr_matrix
+import config
+from config import FEATURE_CACHE_DIR, FEATURE_CACHE_MAX_ENTRIES, LABEL_RULES
+from utils import logger, file_sha256, atomic_dump
+
+# Module quyết định giá trị ma trận: sửa code ở đây thì cache cũ tự mất hiệu lực
+_SOURCE_MODULES = ('preprocess.py', 'schema.py', 'features.py', 'feature_store.py', 'keyword_matcher.py',
+                   'parallel_features.py', 'train.py')
+# Tham số cấu hình ảnh hưởng tới ma trận
+_CONFIG_KEYS = ('TFIDF_MAX_FEATURES', 'HASH_TEXT_FEATURES', 'HASH_CAT_FEATURES', 'FEATURE_WINDOWS',
+                'FEATURE_SLICE_SECONDS', 'DISTINCT_SLICE_SECONDS', 'CMS_WIDTH', 'CMS_DEPTH', 'HLL_PRECISION',
+                'FEATURE_STORE_MAX_KEYS')
+
+def feature_cache_key(data_path, feature_backend):
+    """Khóa cache cho 1 lần train. Trả về (khóa, dict thành phần đã băm) để ghi vào metadata."""
+    base = Path(__file__).resolve().parent
+    parts = {
+        'data_sha256': file_sha256(data_path),
+        'label_rules': LABEL_RULES,
+        'feature_backend': feature_backend,
+        'config': {k: getattr(config, k) for k in _CONFIG_KEYS},
+        'source': {name: file_sha256(base / name) for name in _SOURCE_MODULES},
+        'sklearn': sklearn.__version__,
+    }
+    blob = json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(blob).hexdigest()[:32], parts
+
+class FeatureCache:
+    def __init__(self, cache_dir=FEATURE_CACHE_DIR, max_entries=FEATURE_CACHE_MAX_ENTRIES):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+
+    def _paths(self, key):
+        return (self.cache_dir / f'{key}.npz', self.cache_dir / f'{key}.joblib', self.cache_dir / f'{key}.json')
+
+    def load(self, key):
+        """Trả về (X_full, y, artifacts, vectorizer) hoặc None nếu chưa có / hỏng"""
+        npz_path, joblib_path, meta_path = self._paths(key)
+        if not meta_path.exists():
+            return None
+        t0 = time.perf_counter()
+        try:
+            with np.load(npz_path, allow_pickle=False) as f:
+                X = csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+                y = f['y']
+            artifacts, vectorizer = joblib.load(joblib_path)
+        except Exception as e:
+            logger.warning(f"⚠️ Cache đặc trưng {key} hỏng, tính lại: {e}")
+            self.delete(key)
+            return None
+        # Đánh dấu vừa dùng để dọn theo LRU
+        os.utime(meta_path)
+        logger.info(f"⚡ Nạp ma trận đặc trưng từ cache {key[:12]}: {X.shape[0]} x {X.shape[1]} "
+                    f"trong {(time.perf_counter() - t0) * 1000:.0f}ms")
+        return X, y, artifacts, vectorizer
+
+    def save(self, key, X, y, artifacts, vectorizer, meta=None):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        npz_path, joblib_path, meta_path = self._paths(key)
+        X = X.tocsr()
+        tmp_npz = npz_path.with_name(npz_path.name + '.tmp.npz')
+        np.savez(tmp_npz, data=X.data, indices=X.indices, indptr=X.indptr,
+                 shape=np.array(X.shape, dtype=np.int64), y=np.asarray(y))
+        os.replace(tmp_npz, npz_path)
+        atomic_dump((artifacts, vectorizer), joblib_path)
+        record = {'key': key, 'created': datetime.now().isoformat(timespec='seconds'),
+                  'rows': X.shape[0], 'cols': X.shape[1], 'nnz': int(X.nnz),
+                  'threats': int(np.sum(y)), **(meta or {})}
+        tmp_meta = meta_path.with_name(meta_path.name + '.tmp')
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(record, f, indent=2, default=str)
+        os.replace(tmp_meta, meta_path)
+        logger.info(f"💾 Đã cache ma trận đặc trưng {key[:12]} ({npz_path.stat().st_size / 2 ** 20:.1f} MB)")
+        self.prune()
+
+    def delete(self, key):
+        for p in self._paths(key):
+            p.unlink(missing_ok=True)
+
+    def prune(self):
+        """Giữ tối đa max_entries mục, xóa mục dùng lâu nhất"""
+        metas = sorted(self.cache_dir.glob('*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
+        for meta_path in metas[self.max_entries:]:
+            self.delete(meta_path.stem)
@@ -0,0 +1,303 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from config import (FEATURE_WINDOWS, FEATURE_SLICE_SECONDS, DISTINCT_SLICE_SECONDS, CMS_WIDTH, CMS_DEPTH,
+                    HLL_PRECISION, FEATURE_STORE_MAX_KEYS, FEATURE_STORE_STATE_PATH)
+from utils import logger
+
+# Event ID Windows / group Wazuh của đăng nhập thất bại
+FAILED_LOGON_EVENT_IDS = {'4625', '4771', '4776'}
+FAILED_LOGON_GROUPS = ('authentication_failed', 'authentication_failures', 'invalid_login')
+
+# Bộ đếm theo cửa sổ trượt: tên -> (khóa, bộ lọc). Sinh cột '<tên>_<cửa sổ>', vd: srcip_failed_logons_5m
+COUNTERS = {
+    'srcip_events': ('srcip', None),
+    'srcip_failed_logons': ('srcip', 'failed_logon'),
+    'agent_events': ('agent', None),
+    'user_failed_logons': ('user', 'failed_logon'),
+}
+# Đếm phân biệt (HyperLogLog): tên -> (khóa, giá trị cần đếm, bộ lọc, các cửa sổ)
+DISTINCT_COUNTERS = {
+    'srcip_distinct_users': ('srcip', 'user', None, ('5m', '1h')),
+}
+
+# Các hằng số lẻ 64-bit cho hàm băm nhân-dịch (multiply-shift) của từng hàng count-min
+_CMS_SEEDS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                       0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9],
+                      dtype=np.uint64)
+
+def feature_columns():
+    """Tên các cột hành vi mà feature store sinh ra (theo thứ tự cố định)"""
+    cols = [f'{name}_{w}' for name in COUNTERS for w in FEATURE_WINDOWS]
+    cols += [f'{name}_{w}' for name, (_, _, _, windows) in DISTINCT_COUNTERS.items() for w in windows]
+    return cols
+
+def _first_present(df, columns):
+    """Ghép các cột theo thứ tự ưu tiên: lấy giá trị khác rỗng đầu tiên"""
+    out = pd.Series(np.nan, index=df.index, dtype=object)
+    for col in columns:
+        if col in df.columns:
+            vals = df[col].astype(object).where(df[col].notna() & (df[col].astype(str) != ''))
+            out = out.fillna(vals)
+    return out
+
+def _extract_keys(df):
+    """Lấy các khóa dùng cho feature store từ DataFrame alert đã làm phẳng"""
+    keys = {
+        'srcip': _first_present(df, ['data.srcip', 'data.win.eventdata.ipAddress']),
+        'agent': _first_present(df, ['agent.id', 'agent.name']),
+        'user': _first_present(df, ['data.win.eventdata.targetUserName', 'data.dstuser', 'data.srcuser']),
+    }
+    # Windows ghi '-' / '::1' / '127.0.0.1' cho đăng nhập cục bộ: không coi là IP nguồn
+    keys['srcip'] = keys['srcip'].where(~keys['srcip'].isin(['-', '::1', '127.0.0.1']))
+
+    failed = np.zeros(len(df), dtype=bool)
+    if 'data.win.system.eventID' in df.columns:
+        failed |= df['data.win.system.eventID'].astype(str).isin(FAILED_LOGON_EVENT_IDS).to_numpy()
+    if 'rule.groups' in df.columns:
+        groups = df['rule.groups'].fillna('').astype(str)
+        for g in FAILED_LOGON_GROUPS:
+            failed |= groups.str.contains(g, regex=False).to_numpy()
+    return keys, {'failed_logon': failed}
+
+def _hash(values):
+    """Băm 64-bit ổn định cho mảng chuỗi"""
+    return pd.util.hash_array(np.asarray(values, dtype=object).astype(str))
+
+class CountMinSketch:
+    """Count-min sketch (numpy): cộng/tra cứu cả mảng khóa băm 1 lần. Có thể cộng/trừ 2 sketch cùng kích thước."""
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int32)
+        self._shift = np.uint64(64 - int(np.log2(width)))
+
+    def _slots(self, hashes):
+        # (depth, n): vị trí của từng khóa trên từng hàng
+        return (hashes[None, :] * _CMS_SEEDS[:self.depth, None]) >> self._shift
+
+    def add(self, hashes, counts=None):
+        if len(hashes) == 0:
+            return
+        counts = np.ones(len(hashes), dtype=np.int32) if counts is None else counts
+        slots = self._slots(hashes)
+        for row in range(self.depth):
+            np.add.at(self.table[row], slots[row], counts)
+
+    def query(self, hashes):
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        slots = self._slots(hashes)
+        return self.table[np.arange(self.depth)[:, None], slots].min(axis=0).astype(np.int64)
+
+def _hll_observe(hashes, precision=HLL_PRECISION):
+    """Từ hash 64-bit -> (chỉ số thanh ghi, rho) của HyperLogLog"""
+    p = np.uint64(precision)
+    idx = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    # Lấy 32 bit ngay sau p bit chỉ số (float64 biểu diễn chính xác) để tính vị trí bit 1 đầu tiên
+    rest = ((hashes << p) >> np.uint64(32)).astype(np.float64)
+    bit_length = np.where(rest > 0, np.frexp(rest)[1], 0)
+    rho = (33 - bit_length).astype(np.uint8)
+    return idx, rho
+
+def hll_estimate(registers):
+    """Ước lượng số phần tử phân biệt cho ma trận thanh ghi (n_keys, m)"""
+    m = registers.shape[1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    raw = alpha * m * m / np.power(2.0, -registers.astype(np.float64)).sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    # Hiệu chỉnh vùng nhỏ (linear counting)
+    small = (raw <= 2.5 * m) & (zeros > 0)
+    est = np.where(small, m * np.log(m / np.maximum(zeros, 1)), raw)
+    return np.where(zeros == m, 0.0, est)
+
+class FeatureStore:
+    """
+    Feature store hành vi cập nhật dần theo từng batch alert.
+    - Bộ đếm cửa sổ trượt (1m/5m/1h...) cho từng khóa (IP nguồn, agent, user) bằng count-min sketch
+      theo ngăn FEATURE_SLICE_SECONDS; tổng của mỗi cửa sổ được giữ sẵn (cộng ngăn mới, trừ ngăn rơi ra).
+    - Đếm phân biệt (vd: số user bị thử từ 1 IP) bằng HyperLogLog theo ngăn DISTINCT_SLICE_SECONDS.
+    RAM bị chặn trên bởi kích thước sketch x số ngăn, không phụ thuộc số alert hay số IP.
+    Thời gian tính theo timestamp của alert; alert đến muộn (cũ hơn ngăn hiện tại) được tính vào ngăn hiện tại.
+    """
+
+    def __init__(self, windows=FEATURE_WINDOWS, slice_seconds=FEATURE_SLICE_SECONDS,
+                 distinct_slice_seconds=DISTINCT_SLICE_SECONDS, width=CMS_WIDTH, depth=CMS_DEPTH,
+                 precision=HLL_PRECISION, max_keys=FEATURE_STORE_MAX_KEYS, path=FEATURE_STORE_STATE_PATH):
+        self.windows = dict(windows)
+        self.slice_seconds = slice_seconds
+        self.distinct_slice_seconds = distinct_slice_seconds
+        self.width, self.depth, self.precision = width, depth, precision
+        self.max_keys = max_keys
+        self.path = path
+        # Số ngăn của mỗi cửa sổ (làm tròn lên, tối thiểu 1)
+        self._window_slices = {w: max(1, -(-sec // slice_seconds)) for w, sec in self.windows.items()}
+        self._distinct_slices = {w: max(1, -(-sec // distinct_slice_seconds)) for w, sec in self.windows.items()}
+        self._head = None            # ngăn mới nhất đã thấy
+        self._slices = {}            # counter -> {slice: CountMinSketch}
+        self._totals = {}            # counter -> {window: CountMinSketch tổng các ngăn trong cửa sổ}
+        self._hll = {}               # distinct counter -> {distinct_slice: {key_hash: registers}}
+        self.source = None           # dấu vết file dữ liệu đã cộng gần nhất (người gọi đặt), tránh cộng 1 batch 2 lần
+        for name in COUNTERS:
+            self._slices[name] = {}
+            self._totals[name] = {w: CountMinSketch(width, depth) for w in self.windows}
+        for name in DISTINCT_COUNTERS:
+            self._hll[name] = {}
+        if path is not None:
+            self._load()
+
+    # --- Lưu trạng thái ---
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            if state.get('config') != self._config():
+                logger.info("ℹ️ Cấu hình feature store đã đổi, bắt đầu đếm lại từ đầu.")
+                return
+            self._head, self._slices, self._totals, self._hll = (
+                state['head'], state['slices'], state['totals'], state['hll'])
+            self.source = state.get('source')
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Không đọc được feature store ({e}), bắt đầu lại từ đầu.")
+
+    def _config(self):
+        return (tuple(self.windows.items()), self.slice_seconds, self.distinct_slice_seconds,
+                self.width, self.depth, self.precision, tuple(COUNTERS), tuple(DISTINCT_COUNTERS))
+
+    def save(self):
+        if self.path is None:
+            return
+        state = {'config': self._config(), 'head': self._head, 'slices': self._slices,
+                 'totals': self._totals, 'hll': self._hll, 'source': self.source}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    # --- Cửa sổ trượt ---
+    def _advance(self, new_head):
+        """Dời ngăn hiện tại tới new_head: trừ các ngăn rơi khỏi từng cửa sổ, bỏ ngăn quá cửa sổ dài nhất"""
+        old_head = self._head
+        self._head = new_head
+        if old_head is None:
+            return
+        longest = max(self._window_slices.values())
+        for name, slices in self._slices.items():
+            for w, k in self._window_slices.items():
+                total = self._totals[name][w]
+                # Ngăn s thuộc cửa sổ khi s > head - k; các ngăn trong (old_head - k, new_head - k] vừa rơi ra
+                for s, sketch in slices.items():
+                    if old_head - k < s <= new_head - k:
+                        total.table -= sketch.table
+            for s in [s for s in slices if s <= new_head - longest]:
+                del slices[s]
+
+        distinct_head = new_head * self.slice_seconds // self.distinct_slice_seconds
+        longest = max(self._distinct_slices.values())
+        for per_slice in self._hll.values():
+            for s in [s for s in per_slice if s <= distinct_head - longest]:
+                del per_slice[s]
+
+    def _update_counters(self, keys, filters, rows, head):
+        out = {}
+        for name, (key_name, filter_name) in COUNTERS.items():
+            has_key, key_hashes = keys[key_name]
+            has_key, key_hashes = has_key[rows], key_hashes[rows]
+            valid = has_key.copy()
+            if filter_name:
+                valid &= filters[filter_name][rows]
+            hashes = key_hashes[valid]
+            if len(hashes):
+                sketch = self._slices[name].setdefault(head, CountMinSketch(self.width, self.depth))
+                sketch.add(hashes)
+                for total in self._totals[name].values():
+                    total.add(hashes)
+            # Tra cứu cho mọi dòng có khóa (kể cả dòng không qua bộ lọc: vd số lần login lỗi của IP đó)
+            all_hashes = key_hashes[has_key]
+            for w in self.windows:
+                col = np.zeros(len(rows), dtype=np.int64)
+                col[has_key] = self._totals[name][w].query(all_hashes)
+                out[f'{name}_{w}'] = col
+        return out
+
+    def _update_distinct(self, keys, filters, rows, head):
+        out = {}
+        distinct_head = head * self.slice_seconds // self.distinct_slice_seconds
+        m = 1 << self.precision
+        for name, (key_name, value_name, filter_name, windows) in DISTINCT_COUNTERS.items():
+            has_key, key_hashes = keys[key_name]
+            has_value, value_hashes = keys[value_name]
+            has_key, key_hashes = has_key[rows], key_hashes[rows]
+            valid = has_key & has_value[rows]
+            if filter_name:
+                valid &= filters[filter_name][rows]
+            per_slice = self._hll[name]
+            if valid.any():
+                current = per_slice.setdefault(distinct_head, {})
+                key_h = key_hashes[valid]
+                idx, rho = _hll_observe(value_hashes[rows][valid], self.precision)
+                for kh, i, r in zip(key_h.tolist(), idx.tolist(), rho.tolist()):
+                    regs = current.get(kh)
+                    if regs is None:
+                        if len(current) >= self.max_keys:
+                            continue
+                        regs = current[kh] = np.zeros(m, dtype=np.uint8)
+                    if r > regs[i]:
+                        regs[i] = r
+
+            uniq_keys, inverse = np.unique(key_hashes[has_key], return_inverse=True)
+            for w in windows:
+                k = self._distinct_slices[w]
+                merged = np.zeros((len(uniq_keys), m), dtype=np.uint8)
+                for s in range(distinct_head - k + 1, distinct_head + 1):
+                    regs_by_key = per_slice.get(s)
+                    if not regs_by_key:
+                        continue
+                    for j, kh in enumerate(uniq_keys.tolist()):
+                        regs = regs_by_key.get(kh)
+                        if regs is not None:
+                            np.maximum(merged[j], regs, out=merged[j])
+                col = np.zeros(len(rows), dtype=np.int64)
+                col[has_key] = np.rint(hll_estimate(merged)).astype(np.int64)[inverse]
+                out[f'{name}_{w}'] = col
+        return out
+
+    def annotate(self, df):
+        """
+        Cập nhật store bằng batch df rồi trả về DataFrame các cột hành vi (cùng index với df).
+        Batch được xử lý theo thứ tự thời gian từng ngăn, nên giá trị của 1 dòng chỉ tính các alert
+        tới ngăn của chính nó (dùng được cho cả dữ liệu train trải nhiều ngày).
+        """
+        cols = feature_columns()
+        if df.empty:
+            return pd.DataFrame({c: np.zeros(0, dtype=np.int64) for c in cols}, index=df.index)
+
+        keys, filters = _extract_keys(df)
+        # Băm mỗi cột khóa 1 lần cho cả batch: khóa -> (có giá trị?, hash)
+        keys = {k: (v.notna().to_numpy(), _hash(v.fillna('').to_numpy())) for k, v in keys.items()}
+        if 'timestamp' in df.columns:
+            ts = pd.to_datetime(df['timestamp'], errors='coerce', utc=True)
+            slices = ((ts - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=self.slice_seconds))
+            slices = slices.fillna(-1).astype('int64').to_numpy()
+        else:
+            slices = np.full(len(df), -1, dtype=np.int64)
+        # Không có timestamp hoặc đến muộn -> tính vào ngăn hiện tại
+        floor = self._head if self._head is not None else slices[slices >= 0].min(initial=0)
+        slices = np.where(slices < floor, floor, slices)
+
+        result = {c: np.zeros(len(df), dtype=np.int64) for c in cols}
+        order = np.argsort(slices, kind='stable')
+        bounds = np.flatnonzero(np.diff(slices[order])) + 1
+        for rows in np.split(order, bounds):
+            head = int(slices[rows[0]])
+            if self._head is None or head > self._head:
+                self._advance(head)
+            values = self._update_counters(keys, filters, rows, self._head)
+            values.update(self._update_distinct(keys, filters, rows, self._head))
+            for c, v in values.items():
+                result[c][rows] = v
+        return pd.DataFrame(result, index=df.index)
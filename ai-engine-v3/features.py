@@ -0,0 +1,109 @@
+from scipy.sparse import hstack, csr_matrix
+from sklearn.pipeline import Pipeline
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import StandardScaler, OneHotEncoder, FunctionTransformer
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from config import FEATURE_BACKEND, TFIDF_MAX_FEATURES, HASH_TEXT_FEATURES, HASH_CAT_FEATURES
+from utils import logger
+
+FEATURE_BACKENDS = ('tfidf', 'hashing')
+
+def hash_categorical(X, n_features=HASH_CAT_FEATURES):
+    """
+    Băm các cột category thành ma trận thưa n_features chiều (token 'cột=giá trị').
+    Hàm thuần (không trạng thái) ở cấp module để pickle được trong FunctionTransformer.
+    """
+    columns = list(X.columns)
+    values = X.astype(str).to_numpy()
+    rows = ([f'{c}={v}' for c, v in zip(columns, row)] for row in values)
+    hasher = FeatureHasher(n_features=n_features, input_type='string', alternate_sign=False)
+    return hasher.transform(rows)
+
+def build_preprocessor(numeric_features, categorical_features, backend=FEATURE_BACKEND):
+    """ColumnTransformer cho cột số (chuẩn hóa) + cột category (One-Hot hoặc băm)"""
+    if backend == 'hashing':
+        # Chốt số chiều lúc fit (lưu trong preprocessor đã pickle): đổi HASH_CAT_FEATURES sau khi train không làm lệch model
+        cat_transformer = FunctionTransformer(hash_categorical, accept_sparse=True,
+                                              kw_args={'n_features': HASH_CAT_FEATURES})
+    elif backend == 'tfidf':
+        # handle_unknown='ignore': Gặp giá trị lạ thì bỏ qua, không lỗi
+        cat_transformer = Pipeline(steps=[
+            ('onehot', OneHotEncoder(handle_unknown='ignore', sparse_output=True))
+        ])
+    else:
+        raise ValueError(f"Feature backend '{backend}' không hợp lệ (chọn: {', '.join(FEATURE_BACKENDS)}).")
+    return ColumnTransformer(
+        transformers=[
+            ('num', Pipeline(steps=[('scaler', StandardScaler())]), numeric_features),
+            ('cat', cat_transformer, categorical_features)
+        ], remainder='drop'
+    )
+
+def build_vectorizer(backend=FEATURE_BACKEND):
+    """Bộ vector hóa văn bản: TF-IDF (có từ vựng) hoặc HashingVectorizer (không trạng thái)"""
+    if backend == 'hashing':
+        return HashingVectorizer(n_features=HASH_TEXT_FEATURES, ngram_range=(1, 2), alternate_sign=False)
+    if backend == 'tfidf':
+        return TfidfVectorizer(max_features=TFIDF_MAX_FEATURES, ngram_range=(1, 2))
+    raise ValueError(f"Feature backend '{backend}' không hợp lệ (chọn: {', '.join(FEATURE_BACKENDS)}).")
+
+def _has_text(X_text):
+    return X_text is not None and not X_text.empty and not (X_text == '').all()
+
+def _vectorizer_ready(vectorizer):
+    # HashingVectorizer không cần fit; TF-IDF chỉ dùng được khi đã học từ vựng
+    return vectorizer is not None and (isinstance(vectorizer, HashingVectorizer) or hasattr(vectorizer, 'vocabulary_'))
+
+def fit_transform_features(X_num, X_cat, X_text, backend=FEATURE_BACKEND, text_matrix=None):
+    """
+    Dùng khi TRAIN: dựng + fit bộ biến đổi, trả về (X_full, artifacts, vectorizer).
+    artifacts ghi lại backend và danh sách cột để inference biến đổi y hệt.
+    text_matrix: phần text đã vector hóa sẵn theo từng khối (chỉ backend 'hashing', vectorizer không cần fit),
+    khi đó X_text được bỏ qua.
+    """
+    numeric_features = list(X_num.columns)
+    categorical_features = list(X_cat.columns)
+    preprocessor = build_preprocessor(numeric_features, categorical_features, backend)
+    vectorizer = build_vectorizer(backend)
+
+    # Biến đổi số & category
+    X_pre = preprocessor.fit_transform(X_num.join(X_cat))
+
+    # Biến đổi text. Nếu không có text thì tạo ma trận rỗng
+    if text_matrix is not None:
+        if backend != 'hashing':
+            raise ValueError("text_matrix chỉ dùng được với backend 'hashing'.")
+        X_text_vec = text_matrix
+    elif _has_text(X_text):
+        X_text_vec = vectorizer.fit_transform(X_text)
+    else:
+        X_text_vec = csr_matrix((X_pre.shape[0], 0))
+        logger.warning("⚠️ No text data found for text vectorizer.")
+
+    artifacts = {
+        'preprocessor': preprocessor,
+        'numeric_features': numeric_features,
+        'categorical_features': categorical_features,
+        'feature_backend': backend,
+        # Lúc train có vector hóa text không: inference phải ra đúng số cột text như lúc train
+        'text_vectorized': text_matrix is not None or _has_text(X_text),
+    }
+    return hstack([X_pre, X_text_vec]).tocsr(), artifacts, vectorizer
+
+def transform_features(X_num, X_cat, X_text, artifacts, vectorizer):
+    """
+    Dùng khi DỰ ĐOÁN: biến đổi bằng bộ đã fit, trả về ma trận thưa CSR.
+    Chỉ lấy đúng các cột model đã học (model cũ chưa có đặc trưng hành vi vẫn chạy được).
+    Với backend 'hashing' hàm này không phụ thuộc dữ liệu khác -> chia khối cho nhiều worker rồi ghép lại.
+    """
+    X_num = X_num.reindex(columns=artifacts.get('numeric_features', list(X_num.columns)), fill_value=0)
+    X_cat = X_cat.reindex(columns=artifacts.get('categorical_features', list(X_cat.columns)), fill_value='unknown')
+    X_pre = artifacts['preprocessor'].transform(X_num.join(X_cat))
+
+    # Model cũ chưa ghi 'text_vectorized' thì đoán theo trạng thái vectorizer như trước
+    if artifacts.get('text_vectorized', _vectorizer_ready(vectorizer)):
+        X_text_vec = vectorizer.transform(X_text)
+    else:
+        X_text_vec = csr_matrix((X_pre.shape[0], 0))
+    return hstack([X_pre, X_text_vec]).tocsr()
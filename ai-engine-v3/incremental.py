@@ -0,0 +1,150 @@
+"""
+Huấn luyện tăng dần (chạy: python train.py --incremental --data <cửa sổ mới> [--valid-data <tập tham chiếu>]).
+
+Thay vì train lại từ đầu trên toàn bộ lịch sử, boost thêm INCREMENTAL_ROUNDS cây lên model đang chạy
+chỉ bằng cửa sổ alert mới gán nhãn (XGBoost xgb_model / LightGBM init_model / CatBoost init_model).
+Preprocessor + vectorizer giữ nguyên (không fit lại) nên số chiều đặc trưng không đổi và model cũ vẫn dùng được.
+
+Chốt chặn: giữ INCREMENTAL_VALID_FRACTION của cửa sổ mới (+ tập --valid-data nếu có, vd dữ liệu cũ đã gán nhãn
+để phát hiện model "quên" hành vi cũ). Model mới chỉ được lưu khi AP / F1 trên mọi tập kiểm tra không giảm quá
+INCREMENTAL_MAX_METRIC_DROP so với model cũ; ngược lại giữ nguyên model đang chạy.
+Mỗi lần chạy ghi 1 dòng vào INCREMENTAL_HISTORY_PATH.
+"""
+import json
+from datetime import datetime
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import average_precision_score, f1_score
+from config import (RANDOM_STATE, INCREMENTAL_ROUNDS, INCREMENTAL_VALID_FRACTION, INCREMENTAL_MAX_METRIC_DROP,
+                    INCREMENTAL_MAX_TREES, INCREMENTAL_HISTORY_PATH)
+from utils import logger
+from preprocess import load_dataset, resolve_data_path
+from features import transform_features
+from model_registry import ArtifactRegistry
+from train import label_and_engineer, save_model
+
+GUARD_METRICS = ('average_precision', 'f1')
+
+def window_matrix(data_path, artifacts, vectorizer):
+    """Đọc + gán nhãn + biến đổi 1 file dữ liệu bằng bộ biến đổi đã fit (không fit lại). Trả về (X, y)."""
+    # Đặc trưng hành vi được phát lại trên store mới chỉ trong phạm vi file này (đầu cửa sổ đếm thấp hơn thực tế)
+    X_num, X_cat, X_text, y = label_and_engineer(load_dataset(data_path, consumer='train'))
+    return transform_features(X_num, X_cat, X_text, artifacts, vectorizer), y
+
+def tree_count(model):
+    """Số vòng boost hiện có của model"""
+    if hasattr(model, 'get_booster'):
+        return model.get_booster().num_boosted_rounds()
+    if hasattr(model, 'booster_'):
+        return model.booster_.current_iteration()
+    if hasattr(model, 'tree_count_'):
+        return model.tree_count_
+    raise ValueError(f"Model {type(model).__name__} không hỗ trợ huấn luyện tăng dần.")
+
+def continue_boosting(model, X, y, rounds=INCREMENTAL_ROUNDS):
+    """Model MỚI = model cũ + rounds cây học trên (X, y). Model cũ không bị sửa."""
+    name = type(model).__name__
+    # Cùng tham số với model cũ, chỉ đổi số cây thêm
+    params = model.get_params()
+    if name == 'XGBClassifier':
+        params.update(n_estimators=rounds, early_stopping_rounds=None)
+        updated = type(model)(**params)
+        updated.fit(X, y, xgb_model=model.get_booster(), verbose=False)
+    elif name == 'LGBMClassifier':
+        params.update(n_estimators=rounds)
+        updated = type(model)(**params)
+        updated.fit(X, y, init_model=model.booster_)
+    elif name == 'CatBoostClassifier':
+        params.update(iterations=rounds)
+        updated = type(model)(**params)
+        updated.fit(X, y, init_model=model)
+    else:
+        raise ValueError(f"Model {name} không hỗ trợ huấn luyện tăng dần, hãy train lại từ đầu.")
+    return updated
+
+def evaluate(model, X, y):
+    probs = model.predict_proba(X)[:, 1]
+    return {
+        'average_precision': float(average_precision_score(y, probs)),
+        'f1': float(f1_score(y, (probs >= 0.5).astype(int), zero_division=0)),
+        'rows': int(len(y)),
+        'threats': int(np.sum(y)),
+    }
+
+def guard(old_scores, new_scores, max_drop=INCREMENTAL_MAX_METRIC_DROP):
+    """So điểm model cũ / mới trên từng tập kiểm tra. Trả về list lý do từ chối (rỗng = chấp nhận)."""
+    reasons = []
+    for split, old in old_scores.items():
+        new = new_scores[split]
+        for metric in GUARD_METRICS:
+            if new[metric] < old[metric] - max_drop:
+                reasons.append(f"{split} {metric}: {old[metric]:.4f} -> {new[metric]:.4f}")
+    return reasons
+
+def _append_history(record):
+    INCREMENTAL_HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(INCREMENTAL_HISTORY_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+def incremental_pipeline(data_path=None, valid_path=None, rounds=INCREMENTAL_ROUNDS,
+                         max_drop=INCREMENTAL_MAX_METRIC_DROP, force=False):
+    """
+    Cập nhật model đang chạy bằng cửa sổ dữ liệu mới. Trả về True nếu đã lưu model mới.
+    force=True: vẫn lưu dù chốt chặn từ chối (chỉ dùng khi chắc chắn, vd nhãn cũ sai).
+    """
+    snapshot = ArtifactRegistry().reload(force=True)
+    if snapshot.model is None:
+        raise RuntimeError("Chưa có model để cập nhật, hãy chạy train.py (train đầy đủ) trước.")
+    model, artifacts, vectorizer = snapshot.model, snapshot.artifacts, snapshot.vectorizer
+    data_path = resolve_data_path(data_path)
+    base_trees = tree_count(model)
+    logger.info(f"🔁 Incremental update of model {snapshot.version} ({type(model).__name__}, {base_trees} trees) "
+                f"with {data_path}")
+
+    X, y = window_matrix(data_path, artifacts, vectorizer)
+    if X.shape[1] != model.n_features_in_:
+        raise RuntimeError(f"Số đặc trưng {X.shape[1]} khác model ({model.n_features_in_}): "
+                           f"cấu hình đặc trưng đã đổi, hãy train lại từ đầu.")
+    if len(np.unique(y)) < 2 or np.bincount(y).min() < 2:
+        logger.warning("⚠️ Cửa sổ mới không đủ mẫu của cả 2 lớp, bỏ qua cập nhật.")
+        return False
+    X_tr, X_va, y_tr, y_va = train_test_split(X, y, test_size=INCREMENTAL_VALID_FRACTION, stratify=y,
+                                              random_state=RANDOM_STATE)
+    valid_sets = {'window': (X_va, y_va)}
+    if valid_path is not None:
+        valid_sets['reference'] = window_matrix(valid_path, artifacts, vectorizer)
+    logger.info(f"   Window: {len(y_tr)} train / {len(y_va)} holdout rows, {int(np.sum(y))} threats")
+
+    # Lưu đúng model đã qua kiểm tra (học trên phần train của cửa sổ), không fit lại trên cả cửa sổ
+    logger.info(f"🧠 Boosting {rounds} more trees...")
+    updated = continue_boosting(model, X_tr, y_tr, rounds)
+    old_scores = {name: evaluate(model, Xv, yv) for name, (Xv, yv) in valid_sets.items()}
+    new_scores = {name: evaluate(updated, Xv, yv) for name, (Xv, yv) in valid_sets.items()}
+    for name in valid_sets:
+        logger.info(f"   {name:<9} AP {old_scores[name]['average_precision']:.4f} -> "
+                    f"{new_scores[name]['average_precision']:.4f}, "
+                    f"F1 {old_scores[name]['f1']:.4f} -> {new_scores[name]['f1']:.4f}")
+
+    reasons = guard(old_scores, new_scores, max_drop)
+    accepted = not reasons or force
+    record = {
+        'time': datetime.now().isoformat(timespec='seconds'), 'data_path': str(data_path),
+        'valid_path': str(valid_path) if valid_path else None, 'base_version': snapshot.version,
+        'base_trees': base_trees, 'rounds': rounds, 'old': old_scores, 'new': new_scores,
+        'rejected_reasons': reasons, 'accepted': accepted, 'version': None,
+    }
+    if not accepted:
+        logger.warning(f"⛔ Update rejected, keeping model {snapshot.version}: {'; '.join(reasons)}")
+        _append_history(record)
+        return False
+    if reasons:
+        logger.warning(f"⚠️ Chốt chặn từ chối nhưng --force: {'; '.join(reasons)}")
+
+    record['version'] = save_model(updated, artifacts, vectorizer)
+    _append_history(record)
+    total = tree_count(updated)
+    if total > INCREMENTAL_MAX_TREES:
+        logger.warning(f"⚠️ Model đã có {total} cây (> {INCREMENTAL_MAX_TREES}), độ trễ chấm điểm tăng dần: "
+                       f"nên train lại từ đầu.")
+    logger.info(f"🎉 Incremental update complete: {snapshot.version} -> {record['version']} ({total} trees)")
+    return True
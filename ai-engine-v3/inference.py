@@ -1,16 +1,23 @@
 import joblib
 import pandas as pd
-from scipy.sparse import hstack
+from features import transform_features
 from config import MODEL_PATH, ENCODERS_PATH, VECTORIZER_PATH, DATA_PATH
-from utils import logger, load_artifacts
-from preprocess import feature_engineer, read_csv_safe
+from utils import logger
+from model_registry import REGISTRY, ArtifactSnapshot
+from preprocess import feature_engineer, load_dataset, iter_dataset, resolve_data_path
+from rollup_store import get_rollup_store
+from dedup import SuppressionStore
+from feature_store import FeatureStore
+from metrics import METRICS, peak_rss_mb
+from parallel_features import use_parallel, get_featurizer
 import argparse
+import time
 import sys
 import os
 
 # --- 1. IMPORT MODULE TI LOOKUP ---
 try:
-    from ti_lookup import check_ip_abuseipdb, check_hash_virustotal
+    from ti_lookup import lookup_batch, cache_stats
     TI_ENABLED = True
 except ImportError:
     logger.warning("⚠️ Không tìm thấy ti_lookup.py. Tính năng kiểm tra IP/Hash sẽ tắt.")
@@ -19,79 +26,243 @@ except ImportError:
 # --- Import Telegram ---
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 try:
-    from scripts.send_telegram import send_alert
-    TELEGRAM_ENABLED = True
+    # Gửi qua dispatcher chạy nền: chấm điểm không bao giờ phải chờ Telegram
+    from scripts.alert_dispatcher import get_dispatcher
+    from scripts.send_telegram import BOT_TOKEN, CHAT_ID
+    # Thiếu token / chat id thì tắt hẳn Telegram (chỉ in ra màn hình), không xếp hàng alert không bao giờ gửi được
+    TELEGRAM_ENABLED = bool(BOT_TOKEN and CHAT_ID)
+    if not TELEGRAM_ENABLED:
+        logger.warning("⚠️ Chưa cấu hình TELEGRAM_BOT_TOKEN / TELEGRAM_CHAT_ID trong .env, cảnh báo chỉ in ra màn hình.")
 except ImportError:
     TELEGRAM_ENABLED = False
 
+# Số mối đe dọa (điểm cao nhất) được tra cứu Threat Intel mỗi lượt; tất cả đều được gửi cảnh báo
+TI_ENRICH_LIMIT = 20
+
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding='utf-8')
 
 def load_all():
-    try:
-        if not os.path.exists(MODEL_PATH):
-            return None, None, None
-        return load_artifacts(MODEL_PATH, ENCODERS_PATH, VECTORIZER_PATH)
-    except Exception:
-        return None, None, None
-
-def predict_from_dataframe(df):
-    model, artifacts, vectorizer = load_all()
+    """
+    Lấy bộ model hiện hành từ registry dùng chung của tiến trình
+    (nạp 1 lần, tự nạp lại khi train.py ghi bản mới).
+    Trả về ArtifactSnapshot(model, artifacts, vectorizer, version); chưa có model thì các trường là None.
+    """
+    return REGISTRY.get()
+
+_FEATURE_STORE = None
+
+def get_feature_store():
+    """
+    Feature store hành vi lưu trên đĩa (nạp trạng thái lần đầu). Chu kỳ giám sát (daemon và chạy CLI
+    mặc định) dùng store này và tự lưu sau mỗi batch; backfill, serve.py, benchmark dùng store riêng trong RAM.
+    """
+    global _FEATURE_STORE
+    if _FEATURE_STORE is None:
+        _FEATURE_STORE = FeatureStore()
+    return _FEATURE_STORE
+
+def data_signature(path=None):
+    """Dấu vết (đường dẫn, mtime, kích thước) của file dữ liệu: đổi khi fetch ghi spool mới"""
+    path = resolve_data_path(path)
+    stat = path.stat()
+    return (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+
+def predict_from_dataframe(df, loaded=None, feature_store=None):
+    """
+    Dự đoán cho một DataFrame.
+    loaded: snapshot (model, artifacts, vectorizer[, version, scorer]) cố định cho cả lượt chạy (vd: streaming).
+            Nếu None thì lấy bản hiện hành từ registry (không đọc lại ổ đĩa).
+    feature_store: FeatureStore cập nhật bằng batch này (hàm không lưu store, người gọi tự lưu nếu cần);
+                   None = store tạm trong RAM chỉ cho batch này.
+    Ghi version của model đã chấm điểm vào cột 'ai_model_version'.
+    """
+    snapshot = loaded if loaded is not None else load_all()
+    if not isinstance(snapshot, ArtifactSnapshot):
+        snapshot = ArtifactSnapshot(*snapshot[:3], version=None)
+    model, artifacts, vectorizer, version, scorer = snapshot
     if model is None: return None, None
 
-    X_num, X_cat, X_text, _ = feature_engineer(df, is_training=False)
-    df['full_text'] = X_text 
+    store = feature_store if feature_store is not None else FeatureStore(path=None)
+    # Batch lớn: feature_engineer + transform chạy theo khối trên pool tiến trình (tính vào stage 'vectorize')
+    parallel = use_parallel(len(df))
+    with METRICS.stage('feature_engineer', rows_in=len(df)) as st:
+        behavior = store.annotate(df)
+        df[list(behavior.columns)] = behavior
+
+        if not parallel:
+            X_num, X_cat, X_text, _ = feature_engineer(df, is_training=False)
+            df['full_text'] = X_text
+        st.rows_out = len(df)
 
     try:
-        preprocessor = artifacts['preprocessor']
-        X_pre = preprocessor.transform(X_num.join(X_cat))
-        
-        if vectorizer:
-            X_text_tfidf = vectorizer.transform(X_text)
-        else:
-            from scipy.sparse import csr_matrix
-            X_text_tfidf = csr_matrix((X_pre.shape[0], 0))
-        
-        X_full = hstack([X_pre, X_text_tfidf])
-        probs = model.predict_proba(X_full)[:, 1]
-        
-        threshold = 0.5
-        preds = (probs >= threshold).astype(int)
+        # Cùng hàm biến đổi với train.py (backend tfidf/hashing lấy theo artifacts đã lưu)
+        with METRICS.stage('vectorize', rows_in=len(df)) as st:
+            if parallel:
+                X_full, df['full_text'] = get_featurizer(snapshot).transform(df)
+            else:
+                X_full = transform_features(X_num, X_cat, X_text, artifacts, vectorizer)
+            st.rows_out = X_full.shape[0]
+        # Có cây đã export thì chấm bằng TreeScorer (cùng điểm số, ít chi phí mỗi lần gọi hơn)
+        with METRICS.stage('predict', rows_in=X_full.shape[0]) as st:
+            probs = (scorer or model).predict_proba(X_full)[:, 1]
+            df['ai_model_version'] = version or 'unknown'
+
+            threshold = 0.5
+            preds = (probs >= threshold).astype(int)
+            st.rows_out = int(preds.sum())
         return preds, probs
     except Exception as e:
         logger.error(f"Lỗi dự đoán: {e}")
         return None, None
 
+# Các cột ghi ra sink khi chấm điểm theo khối (giữ nhỏ để file kết quả không phình to)
+STREAM_OUTPUT_COLUMNS = ['id', 'timestamp', 'agent.name', 'rule.id', 'rule.level', 'rule.description',
+                         'ai_pred', 'ai_score', 'ai_model_version']
+
+def predict_stream(path=None, chunksize=50000, sink=None, loaded=None):
+    """
+    Chấm điểm dữ liệu lớn theo từng khối: đọc khối -> transform bằng preprocessor/vectorizer đã fit
+    -> predict -> đẩy kết quả ra sink. RAM đỉnh chỉ phụ thuộc chunksize.
+    sink: đường dẫn CSV (ghi nối tiếp) hoặc hàm callable(chunk_df) nhận từng khối đã chấm điểm.
+    Trả về dict thống kê: rows, threats, seconds, rows_per_sec.
+    """
+    # Cố định 1 snapshot cho cả lượt backfill để mọi khối được chấm bằng cùng 1 version model
+    loaded = loaded if loaded is not None else load_all()
+    if loaded[0] is None:
+        raise RuntimeError(f"Không nạp được model tại {MODEL_PATH}")
+    logger.info(f"📦 Streaming với model version {getattr(loaded, 'version', None) or 'unknown'}")
+    # Backfill dữ liệu lịch sử: đếm hành vi trên store riêng trong RAM, không làm bẩn store của daemon
+    feature_store = FeatureStore(path=None)
+
+    write_header = True
+    if sink is not None and not callable(sink) and os.path.exists(sink):
+        os.remove(sink)
+
+    total_rows, total_threats = 0, 0
+    start = time.perf_counter()
+    # Sink CSV chỉ ghi STREAM_OUTPUT_COLUMNS: đọc đúng các cột bước chấm điểm cần; sink callable nhận mọi cột
+    consumer = None if callable(sink) else 'inference'
+    for i, chunk in enumerate(iter_dataset(path, chunksize, consumer=consumer)):
+        t0 = time.perf_counter()
+        preds, probs = predict_from_dataframe(chunk, loaded=loaded, feature_store=feature_store)
+        if preds is None:
+            raise RuntimeError(f"Dự đoán thất bại ở khối #{i}")
+        chunk['ai_pred'] = preds
+        chunk['ai_score'] = probs
+
+        if callable(sink):
+            sink(chunk)
+        elif sink is not None:
+            cols = [c for c in STREAM_OUTPUT_COLUMNS if c in chunk.columns]
+            chunk[cols].to_csv(sink, mode='a', header=write_header, index=False)
+            write_header = False
+
+        total_rows += len(chunk)
+        total_threats += int(preds.sum())
+        dt = time.perf_counter() - t0
+        logger.info(f"   Khối #{i}: {len(chunk)} rows, {int(preds.sum())} threats, {len(chunk) / max(dt, 1e-9):,.0f} rows/s")
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'rows': total_rows,
+        'threats': total_threats,
+        'seconds': elapsed,
+        'rows_per_sec': total_rows / max(elapsed, 1e-9),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    rss = f", peak RSS {stats['peak_rss_mb']:.0f} MB" if stats['peak_rss_mb'] else ""
+    logger.info(f"📊 Streaming xong: {total_rows} rows, {total_threats} threats trong {elapsed:.2f}s "
+                f"({stats['rows_per_sec']:,.0f} rows/s{rss})")
+    return stats
+
+_SUPPRESSION = None
+
+def get_suppression_store():
+    """Bộ nhớ chống trùng dùng chung của tiến trình (nạp từ đĩa lần đầu)"""
+    global _SUPPRESSION
+    if _SUPPRESSION is None:
+        _SUPPRESSION = SuppressionStore()
+    return _SUPPRESSION
+
+def _row_indicators(row):
+    """Lấy (src_ip, file_hash, file_path) của 1 dòng log, giá trị trống/NaN -> None"""
+    # --- QUAN TRỌNG: KIỂM TRA TÊN CỘT CSV Ở ĐÂY ---
+    # Bạn có thể cần sửa 'data.srcip' thành tên cột IP trong file CSV của bạn
+    src_ip = row.get('data.srcip') or row.get('src_ip')
+    # Bạn có thể cần sửa 'syscheck.sha256_after' thành tên cột Hash trong CSV
+    file_hash = row.get('syscheck.sha256_after') or row.get('data.virustotal.sha256')
+    file_path = row.get('syscheck.path') or row.get('file_path')
+
+    def clean(v):
+        return None if v is None or str(v) == 'nan' else v
+    return clean(src_ip), clean(file_hash), clean(file_path)
+
 def alert_threats(df):
     threats = df[df['ai_pred'] == 1]
     if threats.empty: return
 
+    # Alert đã xử lý ở chu kỳ trước (hoặc lặp trong batch) thì bỏ qua TI + Telegram, chỉ cộng dồn bộ đếm
+    store = get_suppression_store()
+    with METRICS.stage('dedup', rows_in=len(threats)) as st:
+        is_new, repeats = store.filter_new(threats)
+        store.save()
+        st.rows_out = int(is_new.sum())
+    n_dup = len(threats) - int(is_new.sum())
+    METRICS.record_cache('dedup', store.stats['suppressed'], store.stats['new'])
+    threats = threats[is_new].assign(repeat_count=repeats[is_new])
+    if n_dup:
+        logger.info(f"🔁 Bỏ qua {n_dup} alert trùng (đã xử lý trước đó hoặc lặp trong batch).")
+    if threats.empty: return
+
     logger.info(f"🚀 Đang xử lý {len(threats)} mối đe dọa (Kiểm tra TI & Gửi Telegram)...")
-    
-    for _, row in threats.head(5).iterrows():
+
+    # Ưu tiên tra cứu TI cho các mối đe dọa điểm cao nhất
+    threats = threats.sort_values('ai_score', ascending=False)
+    top = threats.head(TI_ENRICH_LIMIT)
+    indicators = [_row_indicators(row) for _, row in top.iterrows()]
+
+    # Tra cứu TI cả lô 1 lần, song song (mỗi IP/hash chỉ tra 1 lần)
+    verdicts = {'ip': {}, 'hash': {}}
+    if TI_ENABLED:
+        with METRICS.stage('ti', rows_in=len(top)) as st:
+            verdicts = lookup_batch(
+                ips=[ip for ip, _, _ in indicators if ip],
+                hashes=[h for _, h, _ in indicators if h],
+                file_paths={h: p for _, h, p in indicators if h and p}
+            )
+            # rows_out = số chỉ báo bị đánh giá độc hại
+            st.rows_out = sum(1 for kind in verdicts.values() for v in kind.values() if v[0])
+        st = cache_stats()
+        METRICS.record_cache('ti', st['mem_hits'] + st['disk_hits'], st['misses'])
+        logger.info(f"🗃️ TI cache: hit rate {st['hit_rate']:.0%} "
+                    f"(mem {st['mem_hits']}, disk {st['disk_hits']}, miss {st['misses']}, items {st['mem_items']})")
+
+    # Không bỏ sót: mọi mối đe dọa đều vào hàng đợi, dispatcher sẽ gom thành tin digest
+    indicators += [(None, None, None)] * (len(threats) - len(indicators))
+    with METRICS.stage('notify', rows_in=len(threats)) as st:
+        _notify(threats, indicators, verdicts)
+        st.rows_out = len(threats)
+
+def _notify(threats, indicators, verdicts):
+    """Dựng tin cảnh báo cho từng mối đe dọa rồi đưa vào dispatcher (hoặc in ra nếu không có Telegram)"""
+    for (_, row), (src_ip, file_hash, file_path) in zip(threats.iterrows(), indicators):
         msg = f"🚨 *AI DETECTED THREAT!* (Score: {row['ai_score']:.2f})\n"
         msg += f"🖥️ Agent: `{row.get('agent.name', 'Unknown')}`\n"
+        if row['repeat_count'] > 1:
+            msg += f"🔁 Lặp lại: {row['repeat_count']} lần\n"
         
         ti_info = ""
-        if TI_ENABLED:
-            # --- QUAN TRỌNG: KIỂM TRA TÊN CỘT CSV Ở ĐÂY ---
-            # Bạn có thể cần sửa 'data.srcip' thành tên cột IP trong file CSV của bạn
-            src_ip = row.get('data.srcip') or row.get('src_ip')
-            
-            # Bạn có thể cần sửa 'syscheck.sha256_after' thành tên cột Hash trong CSV
-            file_hash = row.get('syscheck.sha256_after') or row.get('data.virustotal.sha256')
-            file_path = row.get('syscheck.path') or row.get('file_path')
-
-            if src_ip and str(src_ip) != 'nan':
-                is_mal_ip, ip_score, country = check_ip_abuseipdb(src_ip)
-                if is_mal_ip:
-                    ti_info += f"🚫 *Bad IP:* {src_ip} ({country}) - Score: {ip_score}%\n"
-
-            if file_hash and str(file_hash) != 'nan':
-                is_mal_hash, positives, total = check_hash_virustotal(file_hash, file_path=file_path)
-                if is_mal_hash:
-                    ti_info += f"🦠 *Malware:* {positives}/{total} engines\n"
-                    if file_path: ti_info += f"📂 `{file_path}`\n"
+        if src_ip and src_ip in verdicts['ip']:
+            is_mal_ip, ip_score, country = verdicts['ip'][src_ip]
+            if is_mal_ip:
+                ti_info += f"🚫 *Bad IP:* {src_ip} ({country}) - Score: {ip_score}%\n"
+
+        if file_hash and file_hash in verdicts['hash']:
+            is_mal_hash, positives, total = verdicts['hash'][file_hash]
+            if is_mal_hash:
+                ti_info += f"🦠 *Malware:* {positives}/{total} engines\n"
+                if file_path: ti_info += f"📂 `{file_path}`\n"
 
         if ti_info: msg += "\n🔍 *THREAT INTEL:*\n" + ti_info + "\n"
         
@@ -99,29 +270,64 @@ def alert_threats(df):
         if len(full_text) > 100: full_text = full_text[:100] + "..."
         msg += f"📝 Log: `{full_text}`"
         
-        if TELEGRAM_ENABLED: send_alert(msg)
+        if TELEGRAM_ENABLED: get_dispatcher().submit(msg)
         else: print(msg)
 
+def run_inference(df, loaded=None, feature_store=None):
+    """
+    Chấm điểm + gửi cảnh báo cho một DataFrame log.
+    Dùng chung cho chạy CLI và chế độ daemon trong main_pipeline.py (daemon truyền get_feature_store()).
+    Trả về số mối đe dọa (None nếu không dự đoán được).
+    """
+    preds, probs = predict_from_dataframe(df, loaded=loaded, feature_store=feature_store)
+    if preds is None:
+        return None
+
+    df['ai_pred'] = preds
+    df['ai_score'] = probs
+    n_threats = int(sum(preds))
+    print(f"\n📊 Tổng: {len(df)} | 🚨 Threat: {n_threats} | 📦 Model: {df['ai_model_version'].iloc[0]}")
+
+    if n_threats > 0:
+        alert_threats(df)
+    else:
+        print("✅ Sạch. Không có mối đe dọa.")
+    return n_threats
+
 if __name__ == '__main__':
     pd.set_option('display.max_columns', None)
     parser = argparse.ArgumentParser()
-    parser.add_argument('--file', type=str, default=str(DATA_PATH))
+    parser.add_argument('--file', type=str, default=None,
+                        help='File .feather, .csv hoặc .ndjson (mặc định: spool/CSV mới nhất)')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Chấm điểm theo khối N dòng (backfill file lớn, RAM cố định, không gửi cảnh báo)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='(với --chunksize) File CSV ghi kết quả chấm điểm')
     args = parser.parse_args()
 
-    logger.info(f"🧪 Bắt đầu dự đoán: {args.file}")
+    logger.info(f"🧪 Bắt đầu dự đoán: {args.file or 'dữ liệu mới nhất'}")
     try:
-        df = read_csv_safe(args.file)
-        preds, probs = predict_from_dataframe(df)
-        
-        if preds is not None:
-            df['ai_pred'] = preds
-            df['ai_score'] = probs
-            n_threats = sum(preds)
-            print(f"\n📊 Tổng: {len(df)} | 🚨 Threat: {n_threats}")
-            
-            if n_threats > 0:
-                alert_threats(df)
+        if args.chunksize:
+            predict_stream(args.file, chunksize=args.chunksize, sink=args.output)
+        else:
+            # Vòng lặp main_pipeline.py chạy lại bước này mỗi chu kỳ kể cả khi fetch không có log mới:
+            # spool chưa đổi từ lần cộng trước thì bỏ qua, không đếm 1 batch 2 lần vào feature store
+            feature_store = get_feature_store()
+            source = data_signature(args.file)
+            if feature_store.source == source:
+                logger.info("ℹ️ Dữ liệu chưa đổi kể từ lần chấm điểm trước, bỏ qua.")
             else:
-                print("✅ Sạch. Không có mối đe dọa.")
+                df = load_dataset(args.file, consumer='inference')
+                run_inference(df, feature_store=feature_store)
+                feature_store.source = source
+                feature_store.save()
+                # Cộng batch vào kho tổng hợp để bước báo cáo (report_generator.py --range) không phải đọc lại log thô
+                rollups = get_rollup_store()
+                if rollups is not None:
+                    rollups.update(df)
     except Exception as e:
-        logger.error(f"Lỗi: {e}")
\ No newline at end of file
+        logger.error(f"Lỗi: {e}")
+    finally:
+        # Chạy 1 lần rồi thoát: chờ dispatcher gửi nốt, phần chưa gửi được nằm lại trong outbox
+        if TELEGRAM_ENABLED:
+            get_dispatcher().close(timeout=30)
@@ -0,0 +1,158 @@
+import hashlib
+import pickle
+import numpy as np
+import pandas as pd
+from collections import deque
+from config import STATE_DIR
+from utils import logger
+
+# pyahocorasick (C) là tùy chọn: có thì dùng, không có thì dùng automaton Python thuần bên dưới
+try:
+    import ahocorasick
+    AHOCORASICK_ENABLED = True
+except ImportError:
+    AHOCORASICK_ENABLED = False
+
+MATCHER_CACHE_DIR = STATE_DIR / 'keyword_matchers'
+
+class KeywordMatcher:
+    """
+    Bộ so khớp nhiều từ khóa cùng lúc (Aho-Corasick), không phân biệt hoa thường.
+    Quét mỗi chuỗi đúng 1 lượt dù danh sách từ khóa (IOC) có hàng nghìn phần tử,
+    thay cho regex '|'.join(keywords) chạy chậm dần theo số từ khóa.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = tuple(dict.fromkeys(k.lower() for k in keywords if k))
+        if AHOCORASICK_ENABLED:
+            self._automaton = ahocorasick.Automaton()
+            for kw in self.keywords:
+                self._automaton.add_word(kw, kw)
+            self._automaton.make_automaton()
+        else:
+            self._build_tables()
+
+    def _build_tables(self):
+        """Dựng bảng goto/fail/output cho automaton Python thuần"""
+        goto = [{}]
+        output = [set()]
+        for kw in self.keywords:
+            state = 0
+            for ch in kw:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    output.append(set())
+                state = nxt
+            output[state].add(kw)
+
+        # Duyệt BFS từ các trạng thái độ sâu 1 (fail của chúng luôn là gốc)
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                output[nxt] |= output[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = [tuple(o) for o in output]
+
+    def find(self, text):
+        """Trả về tuple các từ khóa xuất hiện trong text (theo thứ tự gặp đầu tiên, không trùng)"""
+        if not text or not self.keywords:
+            return ()
+        text = text.lower()
+        found = {}
+        if AHOCORASICK_ENABLED:
+            for _, kw in self._automaton.iter(text):
+                found[kw] = None
+            return tuple(found)
+
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                for kw in output[state]:
+                    found[kw] = None
+        return tuple(found)
+
+    def match_series(self, series):
+        """
+        So khớp cả một cột. Chỉ quét các giá trị KHÁC NHAU (log SIEM lặp lại rất nhiều),
+        rồi map kết quả về từng dòng. Trả về mảng object các tuple từ khóa.
+        """
+        codes, uniques = pd.factorize(series.fillna('').astype(str))
+        unique_hits = np.empty(len(uniques) + 1, dtype=object)
+        unique_hits[:-1] = [self.find(u) for u in uniques]
+        unique_hits[-1] = ()  # codes = -1 (không có giá trị)
+        return unique_hits[codes]
+
+    def match_frame(self, df, columns):
+        """
+        Quét từng cột văn bản 1 lần.
+        Trả về (mask, hits): mask[i] = dòng i có ít nhất 1 từ khóa,
+        hits = Series chuỗi các từ khóa trúng của từng dòng (nối bằng ',').
+        """
+        n = len(df)
+        mask = np.zeros(n, dtype=bool)
+        per_column = []
+        for col in columns:
+            col_hits = self.match_series(df[col])
+            has = np.fromiter((bool(h) for h in col_hits), dtype=bool, count=n)
+            mask |= has
+            per_column.append(col_hits)
+
+        hits = np.full(n, '', dtype=object)
+        for i in np.flatnonzero(mask):
+            merged = {}
+            for col_hits in per_column:
+                for kw in col_hits[i]:
+                    merged[kw] = None
+            hits[i] = ','.join(merged)
+        return mask, pd.Series(hits, index=df.index)
+
+_MATCHERS = {}
+
+def get_matcher(keywords):
+    """
+    Lấy matcher đã biên dịch cho danh sách từ khóa.
+    Cache trong RAM (cùng tiến trình) và trên đĩa ở state/keyword_matchers (giữa các lần chạy),
+    khóa theo hash của danh sách từ khóa nên đổi LABEL_RULES là tự biên dịch lại.
+    """
+    normalized = sorted({k.lower() for k in keywords if k})
+    engine = 'c' if AHOCORASICK_ENABLED else 'py'
+    key = hashlib.sha256(('\n'.join(normalized) + engine).encode('utf-8')).hexdigest()[:16]
+    if key in _MATCHERS:
+        return _MATCHERS[key]
+
+    cache_path = MATCHER_CACHE_DIR / f'matcher_{key}.pkl'
+    matcher = None
+    if cache_path.exists():
+        try:
+            with open(cache_path, 'rb') as f:
+                matcher = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Cache matcher hỏng ({e}), biên dịch lại.")
+
+    if matcher is None:
+        matcher = KeywordMatcher(normalized)
+        try:
+            MATCHER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump(matcher, f)
+        except Exception as e:
+            logger.warning(f"⚠️ Không ghi được cache matcher: {e}")
+
+    _MATCHERS[key] = matcher
+    return matcher
@@ -0,0 +1,322 @@
+"""
+Đo đạc pipeline: độ trễ từng bước (histogram), số dòng vào/ra, tỉ lệ trúng cache, RAM đỉnh.
+- Xuất Prometheus text: file ghi đè mỗi chu kỳ (node_exporter textfile collector) hoặc endpoint HTTP /metrics.
+- Xuất JSON lines: 1 dòng mỗi chu kỳ để xem lại / vẽ biểu đồ.
+- Profiler tùy chọn (cProfile hoặc tracemalloc) cho N chu kỳ, bật được khi daemon đang chạy bằng file trigger.
+
+Dùng:
+    with METRICS.stage('predict', rows_in=len(df)) as st:
+        ...
+        st.rows_out = n_threats
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+from config import (METRICS_JSONL_MAX_BYTES, METRICS_HOST, PROFILE_DIR, PROFILE_TRIGGER_PATH, PROFILE_CYCLES)
+from utils import logger
+
+# Mốc histogram (giây) cho độ trễ
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+PROFILE_TOP = 30                # Số dòng hot spot ghi vào log / file tóm tắt
+
+def peak_rss_mb():
+    """RAM đỉnh của tiến trình (MB). Windows không có module resource -> None"""
+    try:
+        import resource
+        # ru_maxrss: Linux trả về KB, macOS trả về byte
+        divisor = 2 ** 20 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+    except ImportError:
+        return None
+
+def _labels(labels):
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+class Histogram:
+    """Histogram tích lũy kiểu Prometheus (thread-safe)"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = int(np.searchsorted(self.buckets, value, side='left'))
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def samples(self, name, labels=()):
+        """Các dòng _bucket/_sum/_count (không kèm HELP/TYPE), labels: tuple (tên, giá trị)"""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        prefix = _labels(labels) + "," if labels else ""
+        suffix = "{" + _labels(labels) + "}" if labels else ""
+        lines, cumulative = [], 0
+        for le, c in zip(self.buckets, counts):
+            cumulative += c
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{suffix} {total}")
+        lines.append(f"{name}_count{suffix} {cumulative}")
+        return lines
+
+    def prometheus(self, name, help_text):
+        return [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"] + self.samples(name)
+
+class StageTimer:
+    """Kết quả 1 lần chạy bước: gán rows_out trong khối with"""
+    __slots__ = ('stage', 'rows_in', 'rows_out', 'seconds')
+
+    def __init__(self, stage, rows_in=None):
+        self.stage = stage
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = 0.0
+
+class PipelineMetrics:
+    """
+    Bộ đếm dùng chung của tiến trình.
+    - stage(): histogram độ trễ + số lần chạy/lỗi + tổng dòng vào/ra theo từng bước
+    - set_gauge() / set_counter(): giá trị tức thời / bộ đếm tích lũy lấy từ module khác (cache, dispatcher...)
+    - begin_cycle() / end_cycle(): gom số liệu của 1 chu kỳ thành 1 bản ghi JSON
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._counters = defaultdict(int)     # (tên, labels) -> giá trị
+        self._gauges = {}
+        self._help = {
+            'siem_stage_runs_total': 'Pipeline stage executions',
+            'siem_stage_errors_total': 'Pipeline stage executions that raised',
+            'siem_stage_rows_in_total': 'Rows entering a pipeline stage',
+            'siem_stage_rows_out_total': 'Rows passed on to the next stage',
+        }
+        self._cycle = defaultdict(lambda: {'seconds': 0.0, 'runs': 0, 'rows_in': 0, 'rows_out': 0, 'errors': 0})
+
+    def _key(self, name, help_text, labels):
+        if help_text:
+            self._help.setdefault(name, help_text)
+        return name, tuple(sorted(labels.items()))
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        timer = StageTimer(name, rows_in)
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            yield timer
+            ok = True
+        finally:
+            timer.seconds = time.perf_counter() - t0
+            self.record_stage(timer, ok)
+
+    def record_stage(self, timer, ok=True):
+        labels = (('stage', timer.stage),)
+        with self._lock:
+            hist = self._latency.get(timer.stage)
+            if hist is None:
+                hist = self._latency[timer.stage] = Histogram(self.buckets)
+            self._counters[('siem_stage_runs_total', labels)] += 1
+            if not ok:
+                self._counters[('siem_stage_errors_total', labels)] += 1
+            if timer.rows_in is not None:
+                self._counters[('siem_stage_rows_in_total', labels)] += timer.rows_in
+            if timer.rows_out is not None:
+                self._counters[('siem_stage_rows_out_total', labels)] += timer.rows_out
+            # 1 bước có thể chạy nhiều lần trong 1 chu kỳ (vd: streaming theo khối) -> cộng dồn
+            c = self._cycle[timer.stage]
+            c['seconds'] += timer.seconds
+            c['runs'] += 1
+            c['rows_in'] += timer.rows_in or 0
+            c['rows_out'] += timer.rows_out or 0
+            c['errors'] += 0 if ok else 1
+        hist.observe(timer.seconds)
+
+    def inc(self, name, value=1, help_text=None, **labels):
+        with self._lock:
+            self._counters[self._key(name, help_text, labels)] += value
+
+    def set_counter(self, name, value, help_text=None, **labels):
+        """Bộ đếm tích lũy do module khác tự đếm (vd: ti_cache.stats()) -> ghi đè giá trị"""
+        with self._lock:
+            self._counters[self._key(name, help_text, labels)] = value
+
+    def set_gauge(self, name, value, help_text=None, **labels):
+        with self._lock:
+            self._gauges[self._key(name, help_text, labels)] = value
+
+    def record_cache(self, cache, hits, misses):
+        """Số lần trúng/trượt tích lũy của 1 cache + tỉ lệ trúng"""
+        self.set_counter('siem_cache_hits_total', hits, 'Cache hits', cache=cache)
+        self.set_counter('siem_cache_misses_total', misses, 'Cache misses', cache=cache)
+        lookups = hits + misses
+        self.set_gauge('siem_cache_hit_ratio', hits / lookups if lookups else 0.0, 'Cache hit ratio', cache=cache)
+
+    def begin_cycle(self):
+        with self._lock:
+            self._cycle.clear()
+
+    def end_cycle(self, **extra):
+        """Bản ghi của chu kỳ vừa xong: thời gian + số dòng từng bước, cache, RAM đỉnh"""
+        rss = peak_rss_mb()
+        if rss is not None:
+            self.set_gauge('siem_process_peak_rss_megabytes', rss, 'Peak resident set size of the process')
+        with self._lock:
+            stages = {k: dict(v) for k, v in self._cycle.items()}
+            caches = {dict(labels)['cache']: v for (name, labels), v in self._gauges.items()
+                      if name == 'siem_cache_hit_ratio'}
+        return {'time': datetime.now().isoformat(timespec='seconds'), **extra,
+                'stages': stages, 'cache_hit_ratio': caches, 'peak_rss_mb': rss}
+
+    def prometheus(self):
+        with self._lock:
+            latency = dict(self._latency)
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            helps = dict(self._help)
+        lines = ["# HELP siem_stage_seconds Pipeline stage latency", "# TYPE siem_stage_seconds histogram"]
+        for stage in sorted(latency):
+            lines += latency[stage].samples('siem_stage_seconds', (('stage', stage),))
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            families = defaultdict(list)
+            for (name, labels), v in values.items():
+                families[name].append((labels, v))
+            for name in sorted(families):
+                if name in helps:
+                    lines.append(f"# HELP {name} {helps[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, v in sorted(families[name]):
+                    lines.append(f"{name}{{{_labels(labels)}}} {v}" if labels else f"{name} {v}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Ghi file tạm rồi os.replace: collector không bao giờ đọc phải file ghi dở"""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_text(self.prometheus(), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def append_jsonl(record, path, max_bytes=METRICS_JSONL_MAX_BYTES):
+        path = Path(path)
+        if max_bytes and path.exists() and path.stat().st_size > max_bytes:
+            os.replace(path, path.with_name(path.name + '.1'))
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+# Bộ đếm dùng chung của tiến trình (inference, daemon, serve cùng ghi vào)
+METRICS = PipelineMetrics()
+
+def start_metrics_server(port, host=METRICS_HOST, metrics=METRICS):
+    """Endpoint GET /metrics (Prometheus text) chạy ở luồng nền, chỉ dùng thư viện chuẩn"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Không in mỗi lần Prometheus scrape
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"📈 Metrics endpoint: http://{host}:{port}/metrics")
+    return server
+
+class CycleProfiler:
+    """
+    Profile N chu kỳ kế tiếp rồi tự tắt (không cần khởi động lại / deploy lại).
+    - cprofile   : ghi <dir>/cycle_<n>_<time>.prof (mở bằng snakeviz / pstats) + log top hàm theo cumtime
+    - tracemalloc: ghi <dir>/cycle_<n>_<time>.txt các dòng code cấp phát nhiều RAM nhất + RAM đỉnh
+    Bật bằng request() hoặc tạo file trigger chứa "<số chu kỳ> [cprofile|tracemalloc]".
+    """
+
+    def __init__(self, output_dir=PROFILE_DIR, trigger_path=PROFILE_TRIGGER_PATH):
+        self.output_dir = Path(output_dir)
+        self.trigger_path = Path(trigger_path) if trigger_path else None
+        self.remaining = 0
+        self.mode = 'cprofile'
+
+    def request(self, cycles, mode='cprofile'):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Profiler không hợp lệ: {mode}. Chọn: {PROFILE_MODES}")
+        self.remaining, self.mode = int(cycles), mode
+        logger.info(f"🔬 Bật profiler {mode} cho {self.remaining} chu kỳ tiếp theo.")
+
+    def poll_trigger(self):
+        """Gọi đầu mỗi chu kỳ: có file trigger thì đọc, xóa và bật profiler"""
+        if self.trigger_path is None or not self.trigger_path.exists():
+            return
+        try:
+            parts = self.trigger_path.read_text(encoding='utf-8').split()
+            self.trigger_path.unlink()
+            cycles = int(parts[0]) if parts else PROFILE_CYCLES
+            self.request(cycles, parts[1] if len(parts) > 1 else 'cprofile')
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ File trigger profiler không hợp lệ ({self.trigger_path}): {e}")
+
+    @contextmanager
+    def cycle(self, label):
+        if self.remaining <= 0:
+            yield
+            return
+        self.remaining -= 1
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = self.output_dir / f"cycle_{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        if self.mode == 'tracemalloc':
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self._dump_tracemalloc(snapshot, peak, stem.with_suffix('.txt'))
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self._dump_cprofile(profiler, stem.with_suffix('.prof'))
+        if self.remaining == 0:
+            logger.info("🔬 Profiler đã chạy đủ số chu kỳ, tắt.")
+
+    @staticmethod
+    def _dump_cprofile(profiler, path):
+        profiler.dump_stats(str(path))
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        logger.info(f"🔬 cProfile -> {path}\n{out.getvalue()}")
+
+    @staticmethod
+    def _dump_tracemalloc(snapshot, peak, path):
+        lines = [f"Peak traced memory: {peak / 2 ** 20:.1f} MB", ""]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_TOP]]
+        path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+        logger.info(f"🔬 tracemalloc (peak {peak / 2 ** 20:.1f} MB) -> {path}\n" + "\n".join(lines[2:12]))
@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+import hashlib
+from collections import namedtuple
+from pathlib import Path
+from config import MODEL_PATH, ENCODERS_PATH, VECTORIZER_PATH, MANIFEST_PATH, ARTIFACT_CHECK_INTERVAL
+from utils import logger, load_artifacts, file_sha256
+from tree_scorer import TreeScorer
+
+# Một bộ model hoàn chỉnh đã nạp vào RAM. version cho biết bộ nào đã chấm điểm batch.
+# scorer: TreeScorer (cây đã export, chấm điểm nhanh) nếu manifest có; None thì dùng model.predict_proba
+ArtifactSnapshot = namedtuple('ArtifactSnapshot', ['model', 'artifacts', 'vectorizer', 'version', 'scorer'],
+                              defaults=(None,))
+EMPTY_SNAPSHOT = ArtifactSnapshot(None, None, None, None)
+
+class ArtifactRegistry:
+    """
+    Kho model dùng chung cho cả tiến trình.
+    - Nạp model/preprocessor/vectorizer đúng 1 lần, các lần gọi get() sau trả về bản trong RAM.
+    - Cứ mỗi check_interval giây so mtime/size các file; khi train.py ghi bản mới thì nạp lại.
+    - Nạp lại kiểu atomic: chỉ đổi sang bản mới khi hash từng file khớp manifest (không dùng file ghi dở)
+      và nạp thành công; lỗi thì giữ nguyên bản cũ đang chạy.
+    """
+
+    def __init__(self, model_path=MODEL_PATH, encoders_path=ENCODERS_PATH, vectorizer_path=VECTORIZER_PATH,
+                 manifest_path=MANIFEST_PATH, check_interval=ARTIFACT_CHECK_INTERVAL):
+        self.model_path = Path(model_path)
+        self.encoders_path = Path(encoders_path)
+        self.vectorizer_path = Path(vectorizer_path)
+        self.manifest_path = Path(manifest_path)
+        self.check_interval = check_interval
+        self._snapshot = EMPTY_SNAPSHOT
+        self._manifest_files = {}
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _stat_fingerprint(self):
+        fp = []
+        for p in (self.model_path, self.encoders_path, self.vectorizer_path, self.manifest_path):
+            try:
+                st = p.stat()
+                fp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                fp.append(None)
+        return tuple(fp)
+
+    def _resolve_version(self):
+        """
+        Trả về version của bộ file đang có trên đĩa, hoặc None nếu chưa nhất quán
+        (hash không khớp manifest = train.py đang ghi dở).
+        """
+        self._manifest_files = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self._manifest_files = manifest.get('files', {})
+            for name, info in self._manifest_files.items():
+                path = self.model_path.parent / info['path']
+                if not path.exists() or file_sha256(path) != info['sha256']:
+                    return None
+            return manifest['version']
+
+        # Model cũ chưa có manifest: version = hash nội dung các file
+        h = hashlib.sha256()
+        for p in (self.model_path, self.encoders_path, self.vectorizer_path):
+            if p.exists():
+                h.update(file_sha256(p).encode())
+        return 'legacy-' + h.hexdigest()[:8]
+
+    def reload(self, force=False):
+        """Kiểm tra đĩa và nạp lại nếu có bản mới. Trả về snapshot hiện hành."""
+        with self._lock:
+            fingerprint = self._stat_fingerprint()
+            if not force and fingerprint == self._fingerprint:
+                return self._snapshot
+            if fingerprint[0] is None:
+                logger.error(f"❌ Không tìm thấy model tại {self.model_path}. Hãy chạy train.py trước.")
+                return self._snapshot
+
+            try:
+                version = self._resolve_version()
+                if version is None:
+                    logger.warning("⏳ File model đang được ghi (hash chưa khớp manifest), giữ bản đang chạy.")
+                    return self._snapshot
+                if version == self._snapshot.version and not force:
+                    self._fingerprint = fingerprint
+                    return self._snapshot
+
+                t0 = time.perf_counter()
+                model, artifacts, vectorizer = load_artifacts(self.model_path, self.encoders_path, self.vectorizer_path)
+                # Chỉ dùng cây đã export khi manifest xác nhận nó thuộc đúng bộ model này
+                scorer = None
+                if 'scorer' in self._manifest_files:
+                    scorer = TreeScorer.load(self.model_path.parent / self._manifest_files['scorer']['path'])
+                # Đổi snapshot bằng 1 phép gán: luồng khác luôn thấy bộ cũ hoặc bộ mới trọn vẹn
+                old_version = self._snapshot.version
+                self._snapshot = ArtifactSnapshot(model, artifacts, vectorizer, version, scorer)
+                self._fingerprint = fingerprint
+                if old_version:
+                    logger.info(f"🔁 Hot-reload model: {old_version} -> {version} ({time.perf_counter() - t0:.2f}s)")
+                else:
+                    logger.info(f"📦 Loaded model version {version} ({time.perf_counter() - t0:.2f}s)")
+            except Exception as e:
+                logger.error(f"❌ Nạp model thất bại, giữ bản đang chạy ({self._snapshot.version}): {e}")
+            return self._snapshot
+
+    def get(self):
+        """Snapshot hiện hành. Chỉ chạm ổ đĩa tối đa 1 lần mỗi check_interval giây."""
+        now = time.monotonic()
+        if self._snapshot.model is None or now - self._last_check >= self.check_interval:
+            self._last_check = now
+            return self.reload()
+        return self._snapshot
+
+# Registry mặc định của tiến trình
+REGISTRY = ArtifactRegistry()
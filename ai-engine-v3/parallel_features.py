@@ -0,0 +1,102 @@
+"""
+Tính đặc trưng song song cho batch lớn (backfill bằng predict_stream, burst của daemon, train trên file lớn).
+- Chia batch thành các khối FEATURIZE_SHARD_ROWS dòng liên tiếp. Mỗi khối chạy feature_engineer
+  (+ transform_features khi dự đoán) trên 1 tiến trình của pool, kết quả được ghép lại đúng thứ tự dòng.
+- preprocessor / vectorizer đã fit chỉ gửi 1 lần cho mỗi tiến trình (initializer) và chỉ đọc.
+  Pool được giữ lại giữa các batch và tạo lại khi model đổi version.
+- Đặc trưng hành vi (FeatureStore.annotate) phụ thuộc thứ tự thời gian nên vẫn chạy tuần tự trước khi chia khối.
+Mỗi dòng chỉ phụ thuộc chính nó nên ma trận ghép lại giống hệt bản tuần tự.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.sparse import vstack
+from config import FEATURIZE_WORKERS, FEATURIZE_PARALLEL_MIN_ROWS, FEATURIZE_SHARD_ROWS
+from utils import logger
+from preprocess import feature_engineer, engineer_input_columns
+from features import transform_features
+
+# Bộ biến đổi đã fit trong từng tiến trình worker (gán 1 lần bởi _init_worker)
+_WORKER_ARTIFACTS = (None, None)
+
+def _init_worker(artifacts, vectorizer):
+    global _WORKER_ARTIFACTS
+    _WORKER_ARTIFACTS = (artifacts, vectorizer)
+
+def _engineer_shard(shard, is_training):
+    X_num, X_cat, X_text, y = feature_engineer(shard, is_training=is_training)
+    return X_num, X_cat, X_text.to_numpy(), y
+
+def _transform_shard(shard):
+    artifacts, vectorizer = _WORKER_ARTIFACTS
+    X_num, X_cat, X_text, _ = feature_engineer(shard, is_training=False)
+    return transform_features(X_num, X_cat, X_text, artifacts, vectorizer), X_text.to_numpy()
+
+def resolve_workers(n_workers=FEATURIZE_WORKERS):
+    """0 / None = số core"""
+    return n_workers if n_workers and n_workers > 0 else (os.cpu_count() or 1)
+
+def use_parallel(n_rows, n_workers=FEATURIZE_WORKERS, min_rows=FEATURIZE_PARALLEL_MIN_ROWS):
+    """Batch có đáng chia cho nhiều tiến trình không"""
+    return resolve_workers(n_workers) > 1 and n_rows >= min_rows
+
+def _mp_context():
+    # forkserver: không fork tiến trình đang có luồng nền (dispatcher, metrics server); Windows chỉ có spawn
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+class ParallelFeaturizer:
+    """Pool tiến trình tính đặc trưng. artifacts / vectorizer = None nếu chỉ dùng engineer() (lúc train)."""
+
+    def __init__(self, artifacts=None, vectorizer=None, n_workers=FEATURIZE_WORKERS, shard_rows=FEATURIZE_SHARD_ROWS):
+        self.n_workers = resolve_workers(n_workers)
+        self.shard_rows = shard_rows
+        self._pool = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=_mp_context(),
+                                         initializer=_init_worker, initargs=(artifacts, vectorizer))
+
+    def _shards(self, df):
+        # Chỉ gửi các cột feature_engineer cần (bỏ message/log thô không dùng tới -> ít dữ liệu pickle hơn)
+        df = df[engineer_input_columns(df)]
+        return [df.iloc[i:i + self.shard_rows] for i in range(0, len(df), self.shard_rows)]
+
+    def engineer(self, df, is_training=False):
+        """Như preprocess.feature_engineer (cùng index với df)"""
+        shards = self._shards(df)
+        parts = list(self._pool.map(_engineer_shard, shards, [is_training] * len(shards)))
+        X_num = pd.concat([p[0] for p in parts]).fillna(0)
+        X_cat = pd.concat([p[1] for p in parts])
+        X_text = pd.Series(np.concatenate([p[2] for p in parts]), index=df.index)
+        y = pd.concat([p[3] for p in parts]) if is_training else None
+        return X_num, X_cat, X_text, y
+
+    def transform(self, df):
+        """feature_engineer + transform_features. Trả về (ma trận CSR, X_text cùng index với df)."""
+        parts = list(self._pool.map(_transform_shard, self._shards(df)))
+        X_full = vstack([p[0] for p in parts]).tocsr()
+        X_text = pd.Series(np.concatenate([p[1] for p in parts]), index=df.index)
+        return X_full, X_text
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_FEATURIZER = None
+_FEATURIZER_VERSION = None
+
+def get_featurizer(snapshot):
+    """Pool dùng chung của tiến trình cho bộ model snapshot (tạo lại khi model đổi version)"""
+    global _FEATURIZER, _FEATURIZER_VERSION
+    if _FEATURIZER is None or _FEATURIZER_VERSION != snapshot.version:
+        if _FEATURIZER is not None:
+            _FEATURIZER.close()
+        _FEATURIZER = ParallelFeaturizer(snapshot.artifacts, snapshot.vectorizer)
+        _FEATURIZER_VERSION = snapshot.version
+        logger.info(f"🧵 Featurizer pool: {_FEATURIZER.n_workers} processes (model {snapshot.version})")
+    return _FEATURIZER
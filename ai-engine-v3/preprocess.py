@@ -1,16 +1,29 @@
-from config import DATA_PATH, LABEL_RULES
+from config import DATA_PATH, SPOOL_PATH, LABEL_RULES
 import pandas as pd
 import numpy as np
 from utils import logger, check_required_cols
+from spool import ARROW_ENABLED, read_spool, iter_spool, is_spool_path, spool_columns
+from schema import (flatten_alerts, apply_schema, consumer_columns, csv_dtypes, parse_timestamps,
+                    label_text_fields, CAT_COLUMNS, TEXT_COLUMNS)
+from keyword_matcher import get_matcher
+from feature_store import feature_columns
 from pathlib import Path
+import json
 
 # Các cột bắt buộc phải có trong file CSV
 REQUIRED = ['timestamp'] 
 
-def read_csv_safe(path):
+def engineer_input_columns(df):
+    """Các cột của df mà feature_engineer đọc tới (để chỉ gửi đúng các cột này sang tiến trình khác)"""
+    wanted = set(['timestamp', 'rule.level', 'is_threat'] + CAT_COLUMNS + TEXT_COLUMNS + feature_columns())
+    return [c for c in df.columns if c in wanted]
+
+def read_csv_safe(path, consumer=None):
     """
     Đọc file CSV an toàn.
     Hỗ trợ cả đường dẫn dạng chuỗi (str) và đối tượng Path.
+    consumer: 'train' | 'inference' | 'report' -> chỉ đọc các cột bước đó cần (schema.CONSUMER_COLUMNS);
+    None -> đọc tất cả. Các cột đã khai báo kiểu trong schema được ép kiểu ngay khi đọc.
     """
     try:
         # Chuyển đổi sang đối tượng Path nếu nó là chuỗi
@@ -21,17 +34,93 @@ def read_csv_safe(path):
             logger.error(f"❌ File not found: {path}")
             raise FileNotFoundError(f"File {path} does not exist.")
             
-        df = pd.read_csv(path)
-        logger.info(f"📂 Loaded CSV with {len(df)} rows and {len(df.columns)} cols")
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = consumer_columns(consumer, header)
+        df = apply_schema(pd.read_csv(path, usecols=usecols, dtype=csv_dtypes(usecols)))
+        logger.info(f"📂 Loaded CSV with {len(df)} rows and {len(df.columns)}/{len(header)} cols")
         return df
     except Exception as e:
         logger.error(f"Failed to read CSV: {e}")
         raise
 
-def auto_label(df):
+def resolve_data_path(path=None):
+    """
+    Chọn file dữ liệu mặc định: spool Feather (nếu có pyarrow) hoặc CSV export.
+    Nếu cả hai cùng tồn tại thì lấy file mới ghi gần nhất.
+    """
+    if path is not None:
+        return Path(path)
+    candidates = [p for p in ([SPOOL_PATH] if ARROW_ENABLED else []) + [DATA_PATH] if p.exists()]
+    if not candidates:
+        return DATA_PATH
+    return max(candidates, key=lambda p: p.stat().st_mtime)
+
+def load_dataset(path=None, columns=None, consumer=None):
+    """
+    Đọc dữ liệu log từ spool Feather hoặc CSV (tự nhận theo đuôi file).
+    path=None: dùng resolve_data_path(). columns: chỉ đọc các cột này (chỉ áp dụng cho spool).
+    consumer: chỉ đọc các cột bước đó cần (xem read_csv_safe).
+    """
+    path = resolve_data_path(path)
+    if is_spool_path(path):
+        if columns is None and consumer is not None:
+            columns = consumer_columns(consumer, spool_columns(path))
+        return apply_schema(read_spool(path, columns=columns))
+    return read_csv_safe(path, consumer)
+
+def _select_columns(columns, consumer, available):
+    # columns (danh sách cột cụ thể, bỏ cột không có) ưu tiên hơn consumer
+    if columns is not None:
+        wanted = set(columns)
+        return [c for c in available if c in wanted]
+    return consumer_columns(consumer, available)
+
+def iter_dataset(path=None, chunksize=50000, consumer=None, columns=None):
+    """
+    Đọc dữ liệu theo từng khối chunksize dòng (không nạp cả file vào RAM).
+    Hỗ trợ spool Feather, CSV và NDJSON alert Wazuh thô (.ndjson/.jsonl, làm phẳng theo schema).
+    consumer: chỉ đọc các cột bước đó cần (xem read_csv_safe). columns: chỉ đọc các cột này.
+    """
+    path = resolve_data_path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"File {path} does not exist.")
+    if is_spool_path(path):
+        selected = None if consumer is None and columns is None else \
+            _select_columns(columns, consumer, spool_columns(path))
+        chunks = iter_spool(path, chunksize, columns=selected)
+    elif path.suffix.lower() in ('.ndjson', '.jsonl'):
+        chunks = _iter_ndjson(path, chunksize, consumer, columns)
+    else:
+        usecols = _select_columns(columns, consumer, pd.read_csv(path, nrows=0).columns)
+        chunks = pd.read_csv(path, chunksize=chunksize, usecols=usecols, dtype=csv_dtypes(usecols))
+    for chunk in chunks:
+        yield apply_schema(chunk)
+
+def _iter_ndjson(path, chunksize, consumer=None, columns=None):
+    def flatten(batch):
+        df = flatten_alerts(batch)
+        return df[_select_columns(columns, consumer, df.columns)]
+    with open(path, 'r', encoding='utf-8') as f:
+        batch = []
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= chunksize:
+                yield flatten(batch)
+                batch = []
+        if batch:
+            yield flatten(batch)
+
+def srcip_keys(df):
+    """Khóa IP nguồn dùng cho quy tắc 'IP hiếm' của auto_label"""
+    return df['data.srcip'].fillna('unknown').astype(str)
+
+def auto_label(df, srcip_freqs=None):
     """
     Tự động gán nhãn 'is_threat' (0 hoặc 1) dựa trên các quy tắc (Heuristics).
     Chỉ dùng bước này khi HUẤN LUYỆN (Training).
+    srcip_freqs: tần suất IP nguồn (Series IP -> tỉ lệ) tính trên TOÀN BỘ dữ liệu khi gán nhãn theo khối;
+                 None = tính trên chính df.
     """
     df = df.copy()
     # Tạo cột điểm rủi ro ban đầu là 0.0
@@ -54,21 +143,23 @@ def auto_label(df):
 
     # 3. Dựa vào từ khóa (Trọng số 0.7)
     # Tìm các từ như 'mimikatz', 'hacker' trong toàn bộ log
-    text_fields = [c for c in df.columns if 'image' in c or 'command' in c or 'eventdata' in c or 'msg' in c or 'message' in c]
+    text_fields = label_text_fields(df.columns)
     keywords = LABEL_RULES['keyword_indicators']
     
     if text_fields:
-        # Gộp nội dung các cột văn bản lại để tìm cho dễ
-        combined_text = df[text_fields].fillna('').astype(str).agg(' '.join, axis=1)
-        mask = combined_text.str.contains('|'.join(keywords), case=False, na=False)
+        # Automaton Aho-Corasick quét từng cột 1 lượt (không gộp chuỗi từng dòng),
+        # ghi lại luôn các từ khóa đã trúng để tiện tra cứu
+        mask, hits = get_matcher(keywords).match_frame(df, text_fields)
         df.loc[mask, 'is_threat_score'] += 0.7
+        df['matched_keywords'] = hits
 
     # 4. Dựa vào tần suất IP (Anomaly) - IP hiếm gặp (Trọng số 0.2)
     # Nếu một IP xuất hiện quá ít (dưới 0.1%), có thể là bất thường
     if 'data.srcip' in df.columns:
-        freqs = df['data.srcip'].fillna('unknown').astype(str).value_counts(normalize=True)
+        keys = srcip_keys(df)
+        freqs = srcip_freqs if srcip_freqs is not None else keys.value_counts(normalize=True)
         # Map tần suất vào từng dòng
-        df['srcip_freq'] = df['data.srcip'].fillna('unknown').astype(str).map(lambda x: freqs.get(x,0))
+        df['srcip_freq'] = keys.map(lambda x: freqs.get(x,0))
         df.loc[df['srcip_freq'] < 0.001, 'is_threat_score'] += 0.2
 
     # Chốt nhãn: Nếu tổng điểm >= 0.5 thì coi là Threat (1), ngược lại là Normal (0)
@@ -90,7 +181,7 @@ def feature_engineer(df, is_training=False):
     
     # 1. Kỹ thuật đặc trưng thời gian (Time-based Features)
     if 'timestamp' in df.columns:
-        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+        df['timestamp'] = parse_timestamps(df['timestamp'])
         df['hour'] = df['timestamp'].dt.hour.fillna(0).astype(int)
         df['weekday'] = df['timestamp'].dt.weekday.fillna(0).astype(int)
     else:
@@ -107,26 +198,35 @@ def feature_engineer(df, is_training=False):
         if col not in num_cols and col not in df.columns:
              df[col] = 0
              if col not in num_cols: num_cols.append(col)
+
+    # Đặc trưng hành vi theo cửa sổ trượt (nếu đã gắn bằng FeatureStore.annotate)
+    num_cols += [c for c in feature_columns() if c in df.columns]
         
     X_num = df[num_cols].copy().fillna(0)
     X_num = X_num.apply(pd.to_numeric, errors='coerce').fillna(0)
 
     # 3. Nhóm dữ liệu danh mục (Categorical Features)
-    cat_candidates = ['rule.id', 'agent.name', 'data.srcip']
+    cat_candidates = CAT_COLUMNS
     # Đảm bảo đủ cột, thiếu thì điền 'unknown'
     for col in cat_candidates:
         if col not in df.columns:
             df[col] = 'unknown'
             
-    X_cat = df[cat_candidates].fillna('unknown').astype(str)
+    # astype(object) trước fillna: cột category (schema đọc file) không nhận giá trị mới 'unknown'
+    X_cat = df[cat_candidates].astype(object).fillna('unknown').astype(str)
 
     # 4. Nhóm dữ liệu văn bản (Text Features for NLP)
-    text_candidates = ['data.win.eventdata.image', 'data.command', 'message', 'full_log', 'data.win.eventdata.commandLine']
+    text_candidates = TEXT_COLUMNS
     text_cols = [c for c in text_candidates if c in df.columns]
     
     if text_cols:
         # Gộp tất cả cột text lại thành một chuỗi dài để NLP xử lý
-        X_text = df[text_cols].fillna('').astype(str).agg(' '.join, axis=1)
+        # (cộng chuỗi theo cột thay vì agg(' '.join, axis=1) từng dòng: cùng kết quả, nhanh hơn hàng chục lần)
+        parts = [df[c].fillna('').astype(str) for c in text_cols]
+        X_text = parts[0]
+        for part in parts[1:]:
+            X_text = X_text + ' ' + part
+        X_text = X_text.rename(None)
     else:
         X_text = pd.Series([''] * len(df))
 
@@ -143,7 +243,7 @@ def feature_engineer(df, is_training=False):
 if __name__ == '__main__':
     try:
         # Test đọc file
-        df = read_csv_safe(DATA_PATH)
+        df = load_dataset()
         # Test gán nhãn
         df = auto_label(df)
         # Test tạo feature
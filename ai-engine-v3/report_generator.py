@@ -4,8 +4,12 @@ import matplotlib.dates as mdates
 from fpdf import FPDF
 import os
 import sys
-from datetime import datetime
-from config import DATA_PATH, BASE_DIR
+import argparse
+from datetime import datetime, timezone
+from config import BASE_DIR, LOTL_INDICATORS, REPORT_TOP_N, REPORT_RANGE
+from preprocess import load_dataset, resolve_data_path
+from keyword_matcher import get_matcher
+from rollup_store import RollupStore, get_rollup_store, range_bounds, threat_flags, HOUR, DAY
 
 # --- FIX LỖI ENCODING TRÊN WINDOWS (CHO TERMINAL) ---
 if sys.platform == "win32":
@@ -90,47 +94,39 @@ class UltimatePDFReport(FPDF):
         self.cell(20, 6, text, 0, 0, 'C', 1)
         self.set_text_color(0)
 
-def generate_timeline_chart(df):
-    """Vẽ biểu đồ Timeline"""
+def generate_timeline_chart(timeline, title):
+    """Vẽ biểu đồ Timeline từ số liệu tổng hợp (cột time / events / threats)"""
+    if timeline.empty:
+        return None
     plt.style.use('ggplot')
     plt.figure(figsize=(10, 4))
-    
-    if 'timestamp' in df.columns:
-        df['dt'] = pd.to_datetime(df['timestamp'], errors='coerce')
-        timeline = df.groupby(df['dt'].dt.hour)['rule.level'].count()
-        plt.plot(timeline.index, timeline.values, marker='o', linestyle='-', color='#2980b9', label='Total Events')
-        
-        if 'is_threat' in df.columns:
-            threats = df[df['is_threat'] == 1]
-            if not threats.empty:
-                threat_timeline = threats.groupby(threats['dt'].dt.hour)['rule.level'].count()
-                plt.bar(threat_timeline.index, threat_timeline.values, color='#e74c3c', alpha=0.5, label='Threats')
-
-        plt.title('Security Events Timeline (Last 24h)')
-        plt.xlabel('Hour of Day')
-        plt.ylabel('Event Count')
-        plt.legend()
-        plt.grid(True, linestyle='--', alpha=0.7)
-        
-        chart_path = REPORT_DIR / 'chart_timeline.png'
-        plt.savefig(chart_path, bbox_inches='tight')
-        plt.close()
-        return str(chart_path)
-    return None
-
-def generate_threat_actor_table(pdf, df):
-    """Tạo bảng Top Threat Actors"""
-    if 'data.win.eventdata.image' not in df.columns:
-        pdf.body_text("No process image data available.")
-        return
 
-    threats = df[df.get('is_threat', 0) == 1]
-    if threats.empty:
+    times = timeline['time'].dt.tz_localize(None)
+    plt.plot(times, timeline['events'], marker='o', linestyle='-', color='#2980b9', label='Total Events')
+    if timeline['threats'].any():
+        # Độ rộng cột = độ rộng ngăn thời gian (giờ hoặc ngày)
+        width = (times.iloc[1] - times.iloc[0]) if len(times) > 1 else pd.Timedelta(hours=1)
+        plt.bar(times, timeline['threats'], width=width * 0.8, color='#e74c3c', alpha=0.5, label='Threats')
+
+    plt.title(title)
+    plt.xlabel('Time (UTC)')
+    plt.ylabel('Event Count')
+    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M'))
+    plt.gcf().autofmt_xdate()
+    plt.legend()
+    plt.grid(True, linestyle='--', alpha=0.7)
+
+    chart_path = REPORT_DIR / 'chart_timeline.png'
+    plt.savefig(chart_path, bbox_inches='tight')
+    plt.close()
+    return str(chart_path)
+
+def generate_threat_actor_table(pdf, top_processes):
+    """Tạo bảng Top Threat Actors (RollupStore.top('process'))"""
+    if top_processes.empty:
         pdf.body_text("No active threats detected.")
         return
 
-    top_actors = threats['data.win.eventdata.image'].value_counts().head(5)
-    
     pdf.set_font('Arial', 'B', 9)
     pdf.set_fill_color(230, 230, 230)
     
@@ -141,18 +137,40 @@ def generate_threat_actor_table(pdf, df):
     pdf.cell(40, 8, 'Severity', 1, 1, 'C', 1)
     
     pdf.set_font('Arial', '', 9)
-    for proc_name, count in top_actors.items():
-        avg_lvl = threats[threats['data.win.eventdata.image'] == proc_name]['rule.level'].mean()
-        
+    for row in top_processes.itertuples(index=False):
         # Clean text trước khi in vào ô
-        clean_proc = clean_text(str(proc_name))[-55:]
+        clean_proc = clean_text(str(row.key))[-55:]
         
         pdf.cell(100, 8, clean_proc, 1, 0, 'L')
-        pdf.cell(20, 8, str(count), 1, 0, 'C')
-        pdf.cell(30, 8, f"{avg_lvl:.1f}", 1, 0, 'C')
-        pdf.risk_badge(avg_lvl)
+        pdf.cell(20, 8, str(row.threats), 1, 0, 'C')
+        pdf.cell(30, 8, f"{row.avg_threat_level:.1f}", 1, 0, 'C')
+        pdf.risk_badge(row.avg_threat_level)
         pdf.ln()
 
+def generate_mitre_table(pdf, top_techniques, top_tactics):
+    """Bảng MITRE ATT&CK: các technique gặp nhiều nhất + phân bố tactic"""
+    if top_techniques.empty:
+        pdf.body_text("No MITRE ATT&CK techniques observed in this period.")
+        return
+
+    pdf.set_font('Arial', 'B', 9)
+    pdf.cell(30, 8, 'Technique ID', 1, 0, 'C', 1)
+    pdf.cell(100, 8, 'Technique', 1, 0, 'C', 1)
+    pdf.cell(30, 8, 'Alerts', 1, 0, 'C', 1)
+    pdf.cell(30, 8, 'Threats', 1, 1, 'C', 1)
+
+    pdf.set_font('Arial', '', 9)
+    for row in top_techniques.itertuples(index=False):
+        pdf.cell(30, 8, clean_text(row.key), 1)
+        pdf.cell(100, 8, clean_text(row.label or '-')[:60], 1)
+        pdf.cell(30, 8, str(row.events), 1, 0, 'C')
+        pdf.cell(30, 8, str(row.threats), 1, 0, 'C')
+        pdf.ln()
+    if not top_tactics.empty:
+        pdf.ln(2)
+        tactics = ", ".join(f"{row.key} ({row.events})" for row in top_tactics.itertuples(index=False))
+        pdf.body_text(f"Tactics: {tactics}", size=9)
+
 def generate_narrative(df):
     threats = df[df.get('is_threat', 0) == 1]
     if threats.empty:
@@ -178,7 +196,7 @@ def generate_narrative(df):
     if cmd and cmd != 'nan':
         narrative += f"The command line executed was: '{cmd[:100]}...' "
         
-    if 'powershell' in process.lower() or 'cmd' in process.lower():
+    if get_matcher(LOTL_INDICATORS).find(process):
         narrative += "This usage of system administration tools is indicative of 'Living off the Land' (LotL) tactics. "
         
     if level >= 12:
@@ -186,23 +204,71 @@ def generate_narrative(df):
     
     return narrative
 
-def create_pro_report():
-    # Dùng ký tự ASCII thường cho log terminal
-    print(f"[INFO] Generating Professional Report from: {DATA_PATH}")
-    
-    if not DATA_PATH.exists():
-        print("[ERROR] Data file not found.")
-        return
+def generate_rollup_narrative(store, since, until, scope):
+    """Diễn giải cho cả khoảng thời gian, chỉ dùng số liệu tổng hợp"""
+    summary = store.summary(since, until)
+    if not summary['threats']:
+        return (f"Over the {scope.lower()}, {summary['events']} events from {summary['agents']} agents were processed "
+                f"and no significant security incidents were detected. System appears healthy.")
+
+    narrative = (f"Over the {scope.lower()}, {summary['events']} events from {summary['agents']} agents were processed; "
+                 f"{summary['threats']} were classified as threats ({summary['ai_threats']} flagged by the AI model). ")
+    top_rule = store.top('rule', since, until, limit=1)
+    if not top_rule.empty:
+        rule = top_rule.iloc[0]
+        narrative += (f"The most frequent threat was '{rule['label'] or 'unknown rule'}' (rule {rule['key']}, "
+                      f"{rule['threats']} alerts, max level {rule['max_level']:.0f}). ")
+    top_agent = store.top('agent', since, until, limit=1)
+    if not top_agent.empty:
+        narrative += f"Agent '{top_agent.iloc[0]['key']}' raised the most threats ({top_agent.iloc[0]['threats']}). "
+    timeline = store.timeline(since, until)
+    if not timeline.empty and timeline['threats'].any():
+        peak = timeline.loc[timeline['threats'].idxmax()]
+        narrative += f"Threat activity peaked at {peak['time']:%Y-%m-%d %H:00} UTC ({peak['threats']} threats). "
+    if (summary['max_level'] or 0) >= 12:
+        narrative += "At least one CRITICAL incident (level 12+) occurred in this period."
+    return narrative
 
+def create_pro_report(df=None, period=None):
+    """
+    Tạo báo cáo PDF.
+    df: DataFrame đã có sẵn trong RAM (chế độ daemon). Nếu None và không có period thì đọc spool/CSV mới nhất.
+    period: khoảng thời gian ('24h', '7d', '30d'...) -> số liệu, biểu đồ và bảng lấy từ kho tổng hợp
+            (rollup_store, daemon cộng dồn mỗi chu kỳ), không đọc lại log thô.
+            df nếu có chỉ dùng cho diễn giải batch mới nhất + phụ lục log mẫu.
+    """
     try:
-        df = pd.read_csv(DATA_PATH)
-        if 'is_threat' not in df.columns:
-             if 'rule.level' in df.columns:
-                df['is_threat'] = df['rule.level'].apply(lambda x: 1 if x >= 10 else 0)
-             else:
-                df['is_threat'] = 0
+        if df is not None:
+            print(f"[INFO] Generating Professional Report from in-memory batch ({len(df)} rows)")
+            df = df.copy()
+        elif period is None:
+            data_path = resolve_data_path()
+            # Dùng ký tự ASCII thường cho log terminal
+            print(f"[INFO] Generating Professional Report from: {data_path}")
+            if not data_path.exists():
+                print("[ERROR] Data file not found.")
+                return
+            # Chỉ đọc các cột báo cáo dùng tới (bỏ data.win.system.message và các trường thô khác)
+            df = load_dataset(data_path, consumer='report')
+        if df is not None and 'is_threat' not in df.columns:
+            df['is_threat'] = threat_flags(df)
+
+        if period is not None:
+            store = get_rollup_store()
+            if store is None:
+                raise RuntimeError("rollup store is disabled (ROLLUP_DB_PATH = None)")
+            since, until = range_bounds(period)
+            scope = f"Last {period}"
+            print(f"[INFO] Using rollups for {scope.lower()}")
+        else:
+            # Tổng hợp batch vào kho tạm trong RAM: cùng 1 đường vẽ biểu đồ / bảng với báo cáo theo khoảng
+            store = RollupStore(path=':memory:', retention_days=None)
+            store.update(df)
+            since = until = None
+            scope = "Current batch"
+        summary = store.summary(since, until)
     except Exception as e:
-        print(f"[ERROR] Read CSV failed: {e}")
+        print(f"[ERROR] Read data failed: {e}")
         return
 
     pdf = UltimatePDFReport()
@@ -213,22 +279,37 @@ def create_pro_report():
     pdf.section_title("1. System Metadata") 
     pdf.info_box("Report ID:", f"RPT-{datetime.now().strftime('%Y%m%d-%H%M')}")
     pdf.info_box("Target Environment:", "Wazuh Lab (Production)")
-    pdf.info_box("Total Agents:", f"{df['agent.name'].nunique()} Active Agents")
-    pdf.info_box("Log Volume:", f"{len(df)} events processed")
+    if since is not None:
+        start, end = (datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d %H:%M') for t in (since, until))
+        pdf.info_box("Report Period:", f"{scope} ({start} -> {end} UTC)")
+    else:
+        pdf.info_box("Report Period:", scope)
+    pdf.info_box("Total Agents:", f"{summary['agents']} Active Agents")
+    pdf.info_box("Log Volume:", f"{summary['events']} events processed")
+    pdf.info_box("Threats:", f"{summary['threats']} detected ({summary['ai_threats']} by AI model)")
     pdf.info_box("Detection Engine:", "AI Engine v3.0 (XGBoost + NLP)")
     pdf.ln(5)
 
     # 2. EXECUTIVE SUMMARY & NARRATIVE
     pdf.section_title("2. Incident Narrative & Analysis")
-    narrative_text = generate_narrative(df)
-    pdf.body_text(narrative_text)
+    if period is not None:
+        pdf.body_text(generate_rollup_narrative(store, since, until, scope))
+        if df is not None:
+            pdf.body_text("Latest batch: " + generate_narrative(df))
+    else:
+        pdf.body_text(generate_narrative(df))
     pdf.ln(5)
 
     # 3. VISUAL ANALYSIS (TIMELINE)
     pdf.section_title("3. Threat Timeline")
     print("[INFO] Drawing charts...")
     try:
-        timeline_img = generate_timeline_chart(df)
+        # Quá 3 ngày thì gộp theo ngày cho biểu đồ dễ đọc
+        first, last = summary['first_hour'], summary['last_hour']
+        span = (until - since) if since is not None else ((last - first + HOUR) if first is not None else 0)
+        bucket = DAY if span > 3 * DAY else HOUR
+        timeline_img = generate_timeline_chart(store.timeline(since, until, bucket),
+                                               f"Security Events Timeline ({scope}, per {'day' if bucket == DAY else 'hour'})")
         if timeline_img:
             pdf.image(timeline_img, x=10, w=190)
             os.remove(timeline_img)
@@ -238,34 +319,22 @@ def create_pro_report():
 
     # 4. THREAT ACTORS TABLE
     pdf.section_title("4. Top Threat Processes")
-    generate_threat_actor_table(pdf, df)
+    generate_threat_actor_table(pdf, store.top('process', since, until, REPORT_TOP_N))
     pdf.ln(10)
 
     # 5. MITRE ATT&CK MAPPING
     pdf.section_title("5. MITRE ATT&CK Matrix")
-    pdf.set_font('Arial', 'B', 9)
-    pdf.cell(40, 8, 'Tactic', 1, 0, 'C', 1)
-    pdf.cell(40, 8, 'Technique ID', 1, 0, 'C', 1)
-    pdf.cell(110, 8, 'Description', 1, 1, 'C', 1)
-    
-    pdf.set_font('Arial', '', 9)
-    mitre_data = [
-        ('Execution', 'T1059.001', 'PowerShell Usage'),
-        ('Persistence', 'T1078', 'Valid Accounts'),
-        ('Defense Evasion', 'T1027', 'Obfuscated Files')
-    ]
-    for tactic, tid, desc in mitre_data:
-        pdf.cell(40, 8, tactic, 1)
-        pdf.cell(40, 8, tid, 1)
-        pdf.cell(110, 8, desc, 1)
-        pdf.ln()
+    generate_mitre_table(pdf, store.top('technique', since, until, REPORT_TOP_N, by='events'),
+                         store.top('tactic', since, until, REPORT_TOP_N, by='events'))
     
     # APPENDIX
     pdf.add_page()
     pdf.section_title("Appendix A: Raw Log Samples")
     
-    threats = df[df['is_threat'] == 1].head(10)
-    if not threats.empty:
+    threats = df[df['is_threat'] == 1].head(10) if df is not None else None
+    if threats is None:
+        pdf.body_text("Raw logs are not kept in the rollup store; run without --range for samples of the latest batch.")
+    elif not threats.empty:
         pdf.set_font('Courier', '', 8)
         for _, row in threats.iterrows():
             # Clean text trước khi in log
@@ -289,4 +358,12 @@ def create_pro_report():
         return None
 
 if __name__ == '__main__':
-    create_pro_report()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--range', dest='period', type=str, nargs='?', const=REPORT_RANGE, default=None,
+                        help='Báo cáo từ kho tổng hợp cho khoảng thời gian (vd: 24h, 7d, 30d; bỏ trống = REPORT_RANGE) '
+                             'thay vì đọc spool/CSV')
+    args = parser.parse_args()
+    if args.period is not None and get_rollup_store() is None:
+        print("[WARN] Rollup store is disabled (ROLLUP_DB_PATH = None), reading spool/CSV instead")
+        args.period = None
+    create_pro_report(period=args.period)
@@ -0,0 +1,341 @@
+"""
+Kho số liệu tổng hợp cho báo cáo (SQLite), cộng dồn sau mỗi chu kỳ chấm điểm của daemon
+(nạp dữ liệu cũ: python rollup_store.py --backfill wazuh_data.csv; xem nhanh: python rollup_store.py --show 7d).
+
+Bảng rollups: 1 dòng cho mỗi (giờ, chiều, khóa) gồm số alert, số threat (cột is_threat, chưa gán nhãn thì
+rule.level >= ngưỡng gán nhãn), số threat do AI phát hiện (ai_pred), tổng level, tổng level của threat, level cao nhất.
+Chiều: 'total' (khóa rỗng), 'agent', 'rule', 'process', 'tactic', 'technique'
+(rule.mitre.* là list nên 1 alert được đếm cho mọi tactic / technique của nó).
+Bảng labels: tên hiển thị của khóa (rule.id -> rule.description, technique id -> tên technique).
+
+Mỗi batch được gộp theo (giờ, chiều, khóa) rồi upsert cộng dồn, nên báo cáo 24h / 7d / 30d chỉ đọc
+các dòng tổng hợp của khoảng đó, không phụ thuộc lượng log thô đã nhận.
+Giờ tính theo UTC (epoch giây của đầu giờ); alert không đọc được timestamp tính vào giờ hiện tại.
+Alert cũ hơn ROLLUP_RETENTION_DAYS bị bỏ qua (và được đếm) thay vì ghi vào rồi bị dọn ngay.
+Bảng backfills: sha256 các file đã --backfill, chạy lại cùng file bị từ chối (trừ khi --force).
+"""
+import argparse
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+from config import ROLLUP_DB_PATH, ROLLUP_RETENTION_DAYS, REPORT_TOP_N, LABEL_RULES
+from utils import logger, file_sha256
+from schema import LIST_SEP, parse_timestamps
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Chiều tổng hợp -> cột nguồn
+DIMENSIONS = {
+    'agent': 'agent.name',
+    'rule': 'rule.id',
+    'process': 'data.win.eventdata.image',
+    'tactic': 'rule.mitre.tactic',
+    'technique': 'rule.mitre.id',
+}
+LIST_DIMENSIONS = ('tactic', 'technique')
+COUNTERS = ('events', 'threats', 'ai_threats', 'level_sum', 'threat_level_sum')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    hour INTEGER NOT NULL, dim TEXT NOT NULL, key TEXT NOT NULL,
+    events INTEGER NOT NULL, threats INTEGER NOT NULL, ai_threats INTEGER NOT NULL,
+    level_sum REAL NOT NULL, threat_level_sum REAL NOT NULL, max_level REAL NOT NULL,
+    PRIMARY KEY (dim, hour, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS labels (
+    dim TEXT NOT NULL, key TEXT NOT NULL, label TEXT NOT NULL,
+    PRIMARY KEY (dim, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS backfills (
+    sha256 TEXT PRIMARY KEY, path TEXT NOT NULL, alerts INTEGER NOT NULL, expired INTEGER NOT NULL,
+    loaded_at REAL NOT NULL
+);
+"""
+_UPSERT = (
+    "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (dim, hour, key) DO UPDATE SET"
+    " events = events + excluded.events, threats = threats + excluded.threats,"
+    " ai_threats = ai_threats + excluded.ai_threats, level_sum = level_sum + excluded.level_sum,"
+    " threat_level_sum = threat_level_sum + excluded.threat_level_sum,"
+    " max_level = MAX(max_level, excluded.max_level)"
+)
+_UPSERT_LABEL = "INSERT INTO labels VALUES (?, ?, ?) ON CONFLICT (dim, key) DO UPDATE SET label = excluded.label"
+_ROW_COLUMNS = ['hour', 'dim', 'key', *COUNTERS, 'max_level']
+
+_RANGE_RE = re.compile(r'^\s*(\d+)\s*([hdw])\s*$', re.IGNORECASE)
+_RANGE_UNITS = {'h': HOUR, 'd': DAY, 'w': 7 * DAY}
+
+def parse_range(value):
+    """'24h' / '7d' / '2w' -> số giây"""
+    match = _RANGE_RE.match(str(value))
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Khoảng thời gian không hợp lệ: {value!r} (vd: 24h, 7d, 30d)")
+    return int(match.group(1)) * _RANGE_UNITS[match.group(2).lower()]
+
+def range_bounds(period, now=None):
+    """(since, until) epoch giây của khoảng period tính đến hết giờ hiện tại (24h = 24 ngăn giờ, gồm giờ đang chạy)"""
+    now = time.time() if now is None else now
+    until = int(now // HOUR * HOUR) + HOUR
+    return until - parse_range(period), until
+
+def threat_flags(df):
+    """Cờ threat 0/1 từng dòng: cột is_threat nếu đã gán nhãn, không thì rule.level >= ngưỡng gán nhãn"""
+    if 'is_threat' in df.columns:
+        return pd.to_numeric(df['is_threat'], errors='coerce').fillna(0).astype(int).to_numpy()
+    if 'rule.level' in df.columns:
+        level = pd.to_numeric(df['rule.level'], errors='coerce')
+        return (level >= LABEL_RULES['rule_level_threshold']).astype(int).to_numpy()
+    return np.zeros(len(df), dtype=int)
+
+def hour_buckets(df, now=None):
+    """Epoch giây (UTC) của đầu giờ chứa mỗi alert"""
+    current = int((time.time() if now is None else now) // HOUR * HOUR)
+    if 'timestamp' not in df.columns:
+        return np.full(len(df), current, dtype=np.int64)
+    ts = parse_timestamps(df['timestamp'])
+    ts = ts.dt.tz_localize('UTC') if ts.dt.tz is None else ts.dt.tz_convert('UTC')
+    seconds = (ts - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+    return (seconds // HOUR * HOUR).fillna(current).astype(np.int64).to_numpy()
+
+def _group(frame, dim):
+    out = frame.groupby(['hour', 'key'], sort=False).agg(
+        events=('level', 'size'), threats=('threats', 'sum'), ai_threats=('ai_threats', 'sum'),
+        level_sum=('level', 'sum'), threat_level_sum=('threat_level', 'sum'), max_level=('level', 'max'),
+    ).reset_index()
+    out.insert(1, 'dim', dim)
+    return out
+
+def aggregate(df, now=None, hours=None):
+    """
+    Gộp 1 batch alert thành các dòng (giờ, chiều, khóa, bộ đếm...) theo thứ tự _ROW_COLUMNS.
+    hours: hour_buckets(df) đã tính sẵn (tránh đọc timestamp 2 lần).
+    """
+    n = len(df)
+    level = pd.to_numeric(df['rule.level'], errors='coerce').fillna(0).to_numpy(dtype=float) \
+        if 'rule.level' in df.columns else np.zeros(n)
+    ai = pd.to_numeric(df['ai_pred'], errors='coerce').fillna(0).astype(int).to_numpy() \
+        if 'ai_pred' in df.columns else np.zeros(n, dtype=int)
+    hours = hour_buckets(df, now) if hours is None else hours
+    base = pd.DataFrame({'hour': hours, 'threats': threat_flags(df), 'ai_threats': ai, 'level': level})
+    base['threat_level'] = base['level'] * base['threats']
+
+    parts = [_group(base.assign(key=''), 'total')]
+    for dim, column in DIMENSIONS.items():
+        if column not in df.columns:
+            continue
+        keys = df[column].astype(object).to_numpy()
+        frame = base.assign(key=keys)
+        if dim in LIST_DIMENSIONS:
+            frame = frame.assign(key=frame['key'].str.split(LIST_SEP)).explode('key')
+        frame = frame[frame['key'].notna()]
+        frame = frame.assign(key=frame['key'].astype(str).str.strip())
+        frame = frame[~frame['key'].isin(('', 'nan', 'None'))]
+        if not frame.empty:
+            parts.append(_group(frame, dim))
+    return pd.concat(parts, ignore_index=True)[_ROW_COLUMNS]
+
+def extract_labels(df):
+    """[(chiều, khóa, tên hiển thị)] của batch: rule.id -> rule.description, technique id -> tên technique"""
+    labels = {}
+    if {'rule.id', 'rule.description'} <= set(df.columns):
+        pairs = df[['rule.id', 'rule.description']].astype(object).dropna().drop_duplicates()
+        for rule_id, desc in pairs.itertuples(index=False):
+            labels[('rule', str(rule_id))] = str(desc)
+    if {'rule.mitre.id', 'rule.mitre.technique'} <= set(df.columns):
+        pairs = df[['rule.mitre.id', 'rule.mitre.technique']].astype(object).dropna().drop_duplicates()
+        for ids, names in pairs.itertuples(index=False):
+            ids, names = str(ids).split(LIST_SEP), str(names).split(LIST_SEP)
+            # Tên technique có dấu phẩy thì 2 list lệch nhau: bỏ qua thay vì ghép sai
+            if len(ids) == len(names):
+                for tid, name in zip(ids, names):
+                    labels[('technique', tid.strip())] = name.strip()
+    return [(dim, key, label) for (dim, key), label in labels.items()]
+
+class RollupStore:
+    """
+    Số liệu tổng hợp theo giờ trên SQLite. path=':memory:' -> kho tạm trong RAM (báo cáo cho 1 batch).
+    retention_days=None: không xóa số liệu cũ.
+    """
+
+    def __init__(self, path=ROLLUP_DB_PATH, retention_days=ROLLUP_RETENTION_DAYS):
+        self.retention = retention_days * DAY if retention_days else None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self._counters = {'alerts': 0, 'expired': 0, 'rows': 0}
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def update(self, df, now=None):
+        """
+        Cộng dồn 1 batch alert vào kho (1 transaction). Trả về số dòng tổng hợp đã ghi.
+        Alert cũ hơn hạn lưu giữ bị bỏ qua và cộng vào stats()['expired'].
+        """
+        if df is None or df.empty:
+            return 0
+        hours = hour_buckets(df, now)
+        expired = 0
+        if self.retention is not None:
+            keep = hours >= (time.time() if now is None else now) - self.retention
+            expired = int((~keep).sum())
+            if expired:
+                df, hours = df[keep], hours[keep]
+        if df.empty:
+            with self._lock:
+                self._counters['expired'] += expired
+            return 0
+        rows = aggregate(df, now, hours)
+        labels = extract_labels(df)
+        try:
+            with self._lock, self._db:
+                self._db.executemany(_UPSERT, rows.to_numpy(dtype=object).tolist())
+                self._db.executemany(_UPSERT_LABEL, labels)
+                self._prune(now)
+                self._counters['alerts'] += len(df)
+                self._counters['expired'] += expired
+                self._counters['rows'] += len(rows)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Không ghi được số liệu tổng hợp: {e}")
+            return 0
+        return len(rows)
+
+    def stats(self):
+        """Số alert đã cộng / bỏ qua vì quá hạn lưu giữ / số dòng tổng hợp đã ghi (từ lúc mở kho)"""
+        with self._lock:
+            return dict(self._counters)
+
+    def backfilled(self, sha256):
+        """Thông tin lần backfill trước của file có nội dung sha256 (None nếu chưa nạp)"""
+        with self._lock:
+            row = self._db.execute("SELECT path, alerts, expired, loaded_at FROM backfills WHERE sha256 = ?",
+                                   (sha256,)).fetchone()
+        return dict(zip(('path', 'alerts', 'expired', 'loaded_at'), row)) if row else None
+
+    def mark_backfilled(self, sha256, path, alerts, expired):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO backfills VALUES (?, ?, ?, ?, ?)",
+                             (sha256, str(path), alerts, expired, time.time()))
+
+    def _prune(self, now=None):
+        # Dọn số liệu quá hạn tối đa 1 lần mỗi giờ
+        now = time.time() if now is None else now
+        if self.retention is None or now - self._last_prune < HOUR:
+            return
+        self._db.execute("DELETE FROM rollups WHERE hour < ?", (int(now - self.retention),))
+        self._last_prune = now
+
+    @staticmethod
+    def _bounds(since, until):
+        return (-2 ** 62 if since is None else int(since)), (2 ** 62 if until is None else int(until))
+
+    def summary(self, since=None, until=None):
+        """Tổng số alert / threat / threat AI, level cao nhất, số agent, giờ đầu / cuối có dữ liệu"""
+        bounds = self._bounds(since, until)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COALESCE(SUM(events), 0), COALESCE(SUM(threats), 0), COALESCE(SUM(ai_threats), 0),"
+                " MAX(max_level), MIN(hour), MAX(hour) FROM rollups WHERE dim = 'total' AND hour >= ? AND hour < ?",
+                bounds).fetchone()
+            agents = self._db.execute(
+                "SELECT COUNT(DISTINCT key) FROM rollups WHERE dim = 'agent' AND hour >= ? AND hour < ?",
+                bounds).fetchone()[0]
+        keys = ('events', 'threats', 'ai_threats', 'max_level', 'first_hour', 'last_hour')
+        return {**dict(zip(keys, row)), 'agents': agents}
+
+    def timeline(self, since=None, until=None, bucket=HOUR):
+        """DataFrame time (UTC) / events / threats / ai_threats theo từng ngăn bucket giây"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hour / ? * ? AS t, SUM(events), SUM(threats), SUM(ai_threats) FROM rollups"
+                " WHERE dim = 'total' AND hour >= ? AND hour < ? GROUP BY t ORDER BY t",
+                (bucket, bucket, *self._bounds(since, until))).fetchall()
+        out = pd.DataFrame(rows, columns=['time', 'events', 'threats', 'ai_threats'])
+        out['time'] = pd.to_datetime(out['time'], unit='s', utc=True)
+        return out
+
+    def top(self, dim, since=None, until=None, limit=REPORT_TOP_N, by='threats'):
+        """
+        limit khóa đứng đầu của 1 chiều theo bộ đếm by (bỏ khóa có by = 0).
+        Cột: key, label, events, threats, ai_threats, avg_level, avg_threat_level, max_level.
+        """
+        if by not in COUNTERS:
+            raise ValueError(f"by phải là một trong {COUNTERS}")
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT r.key, l.label, SUM(r.events), SUM(r.threats), SUM(r.ai_threats), SUM(r.level_sum),"
+                f" SUM(r.threat_level_sum), MAX(r.max_level) FROM rollups r"
+                f" LEFT JOIN labels l ON l.dim = r.dim AND l.key = r.key"
+                f" WHERE r.dim = ? AND r.hour >= ? AND r.hour < ? GROUP BY r.key"
+                f" HAVING SUM(r.{by}) > 0 ORDER BY SUM(r.{by}) DESC, r.key LIMIT ?",
+                (dim, *self._bounds(since, until), limit)).fetchall()
+        out = pd.DataFrame(rows, columns=['key', 'label', 'events', 'threats', 'ai_threats', 'level_sum',
+                                          'threat_level_sum', 'max_level'])
+        out['avg_level'] = out['level_sum'] / out['events'].clip(lower=1)
+        out['avg_threat_level'] = out['threat_level_sum'] / out['threats'].clip(lower=1)
+        return out.drop(columns=['level_sum', 'threat_level_sum'])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_STORE = None
+
+def get_rollup_store():
+    """Kho tổng hợp dùng chung của tiến trình (None nếu ROLLUP_DB_PATH = None hoặc không mở được)"""
+    global _STORE
+    if _STORE is None and ROLLUP_DB_PATH is not None:
+        try:
+            _STORE = RollupStore()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Không mở được kho tổng hợp {ROLLUP_DB_PATH}: {e}")
+    return _STORE
+
+def backfill(path, chunksize=50000, force=False):
+    """
+    Cộng dữ liệu cũ (CSV / Feather / NDJSON) vào kho theo khối. Trả về số alert đã cộng.
+    File (theo nội dung) đã backfill thì bị từ chối để không đếm 2 lần, trừ khi force=True.
+    Lần chạy bị ngắt giữa chừng không được ghi nhận: các khối đã cộng vẫn nằm trong kho.
+    """
+    from preprocess import iter_dataset
+    store = get_rollup_store()
+    if store is None:
+        raise RuntimeError("Kho tổng hợp đang tắt (ROLLUP_DB_PATH = None).")
+    digest = file_sha256(path)
+    previous = store.backfilled(digest)
+    if previous is not None and not force:
+        logger.warning(f"⚠️ {path} đã được backfill lúc {time.strftime('%Y-%m-%d %H:%M', time.localtime(previous['loaded_at']))} "
+                       f"({previous['alerts']} alert, từ {previous['path']}); bỏ qua để không đếm 2 lần. Dùng --force nếu chắc chắn.")
+        return 0
+    before = store.stats()
+    for chunk in iter_dataset(path, chunksize, consumer='report'):
+        store.update(chunk)
+    after = store.stats()
+    added, expired = after['alerts'] - before['alerts'], after['expired'] - before['expired']
+    # Không cộng được alert nào (vd: tất cả đã quá hạn) thì không ghi nhận, để tăng ROLLUP_RETENTION_DAYS rồi nạp lại được
+    if added > 0:
+        store.mark_backfilled(digest, path, added, expired)
+    logger.info(f"📥 Đã cộng {added} alert từ {path} vào {ROLLUP_DB_PATH}")
+    if expired:
+        logger.warning(f"⚠️ Bỏ qua {expired} alert cũ hơn {ROLLUP_RETENTION_DAYS} ngày (ROLLUP_RETENTION_DAYS).")
+    return added
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backfill', type=str, default=None, help='Cộng 1 file dữ liệu cũ vào kho tổng hợp')
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('--force', action='store_true', help='(backfill) Cộng cả file đã từng backfill (sẽ đếm 2 lần)')
+    parser.add_argument('--show', type=str, default=None, help='In tóm tắt 1 khoảng thời gian (vd: 24h, 7d, 30d)')
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill(args.backfill, args.chunksize, force=args.force)
+    if args.show:
+        store = get_rollup_store()
+        since, until = range_bounds(args.show)
+        print(store.summary(since, until))
+        for dim in ('agent', 'rule', 'process', 'technique'):
+            print(f"\n--- Top {dim} ---")
+            print(store.top(dim, since, until, by='events').to_string(index=False))
@@ -0,0 +1,198 @@
+import json
+import numpy as np
+import pandas as pd
+
+# --- SCHEMA CÁC TRƯỜNG WAZUH MÀ ENGINE THỰC SỰ DÙNG ---
+# Thay vì pd.json_normalize bung TOÀN BỘ cây JSON (rule.pci_dss, rule.hipaa, data.win.system.*...),
+# bộ làm phẳng chỉ lấy các đường dẫn khai báo dưới đây và ghi thẳng vào mảng có kiểu.
+# Kiểu: 'str' (chuỗi), 'int' (số nguyên, thiếu -> float NaN), 'float', 'list' (list -> chuỗi nối bằng LIST_SEP)
+# Muốn engine dùng thêm trường nào thì thêm vào đây.
+ALERT_FIELDS = {
+    # Định danh & thời gian
+    'id': 'str',
+    'timestamp': 'str',
+    'location': 'str',
+    # Agent
+    'agent.id': 'str',
+    'agent.name': 'str',
+    'agent.ip': 'str',
+    # Rule (feature_engineer, auto_label, report)
+    'rule.id': 'str',
+    'rule.level': 'int',
+    'rule.description': 'str',
+    'rule.groups': 'list',
+    'rule.mitre.id': 'list',
+    'rule.mitre.tactic': 'list',
+    'rule.mitre.technique': 'list',
+    'decoder.name': 'str',
+    # Văn bản cho NLP / từ khóa
+    'full_log': 'str',
+    'message': 'str',
+    'data.command': 'str',
+    'data.win.system.eventID': 'str',
+    'data.win.system.message': 'str',
+    # Sysmon / Windows Security eventdata hay dùng
+    'data.win.eventdata.image': 'str',
+    'data.win.eventdata.commandLine': 'str',
+    'data.win.eventdata.parentImage': 'str',
+    'data.win.eventdata.parentCommandLine': 'str',
+    'data.win.eventdata.originalFileName': 'str',
+    'data.win.eventdata.description': 'str',
+    'data.win.eventdata.targetFilename': 'str',
+    'data.win.eventdata.hashes': 'str',
+    'data.win.eventdata.user': 'str',
+    'data.win.eventdata.targetUserName': 'str',
+    'data.win.eventdata.subjectUserName': 'str',
+    'data.win.eventdata.ipAddress': 'str',
+    'data.win.eventdata.logonType': 'str',
+    'data.win.eventdata.processName': 'str',
+    # Mạng (TI lookup)
+    'data.srcip': 'str',
+    'data.srcuser': 'str',
+    'data.dstuser': 'str',
+    # File integrity / VirusTotal (TI lookup)
+    'syscheck.path': 'str',
+    'syscheck.sha256_after': 'str',
+    'data.virustotal.sha256': 'str',
+}
+
+LIST_SEP = ','          # Ký tự nối các phần tử của trường list (vd: rule.mitre.id = "T1059.001,T1078")
+RAW_COLUMN = '_raw'     # Cột chứa JSON gốc khi gọi flatten_alerts(include_raw=True)
+
+# Tách sẵn đường dẫn 1 lần để vòng lặp không phải split lại
+_FIELD_PATHS = {name: tuple(name.split('.')) for name in ALERT_FIELDS}
+
+def _get_path(doc, path):
+    for key in path:
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+        if doc is None:
+            return None
+    return doc
+
+def _to_str(v):
+    return v if isinstance(v, str) else str(v)
+
+def _to_list_str(v):
+    if isinstance(v, (list, tuple)):
+        return LIST_SEP.join(map(str, v))
+    return _to_str(v)
+
+def _to_array(values, kind):
+    """Chuyển list giá trị (có None) thành mảng numpy đúng kiểu"""
+    if kind in ('int', 'float'):
+        arr = np.array([np.nan if v is None else v for v in values], dtype=float)
+        if kind == 'int' and not np.isnan(arr).any():
+            return arr.astype(np.int64)
+        return arr
+    conv = _to_list_str if kind == 'list' else _to_str
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = [np.nan if v is None else conv(v) for v in values]
+    return arr
+
+def flatten_alerts(hits, fields=None, include_raw=False, drop_empty=True):
+    """
+    Làm phẳng list alert Wazuh (dict lồng nhau) theo schema khai báo.
+    - fields: dict {đường_dẫn: kiểu}, mặc định ALERT_FIELDS.
+    - include_raw: thêm cột '_raw' chứa JSON gốc đầy đủ của từng alert.
+    - drop_empty: bỏ các cột không alert nào có (giống json_normalize chỉ sinh cột có dữ liệu).
+    """
+    fields = fields or ALERT_FIELDS
+    columns = {}
+    for name, kind in fields.items():
+        path = _FIELD_PATHS.get(name) or tuple(name.split('.'))
+        values = [_get_path(hit, path) for hit in hits]
+        if drop_empty and all(v is None for v in values):
+            continue
+        columns[name] = _to_array(values, kind)
+
+    if include_raw:
+        raw = np.empty(len(hits), dtype=object)
+        raw[:] = [json.dumps(hit, ensure_ascii=False) for hit in hits]
+        columns[RAW_COLUMN] = raw
+
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(hits)))
+
+# --- SCHEMA ĐỌC FILE (CSV / spool): KIỂU CỘT + CỘT MỖI BƯỚC CẦN ---
+# File export CSV có ~95 cột (data.win.system.*, rule.pci_dss...). Mỗi bước chỉ đọc các cột khai báo dưới đây
+# (usecols / chiếu cột spool) và ép kiểu ngay khi đọc thay vì để pandas đoán từng cột là object.
+CATEGORY_COLUMNS = ('agent.id', 'agent.name', 'rule.id', 'decoder.name', 'location')   # ít giá trị khác nhau
+INT8_COLUMNS = ('rule.level',)       # Level Wazuh 0-16; thiếu giá trị -> float32 NaN (như 'int' của flatten)
+DATETIME_COLUMNS = ('timestamp',)
+
+# Cột category / văn bản mà preprocess.feature_engineer sử dụng
+CAT_COLUMNS = ['rule.id', 'agent.name', 'data.srcip']
+TEXT_COLUMNS = ['data.win.eventdata.image', 'data.command', 'message', 'full_log', 'data.win.eventdata.commandLine']
+# auto_label quét từ khóa trên mọi cột có tên chứa các chuỗi này
+LABEL_TEXT_MARKERS = ('image', 'command', 'eventdata', 'msg', 'message')
+
+# feature_engineer + khóa của FeatureStore (đặc trưng hành vi)
+_FEATURE_INPUTS = (['timestamp', 'rule.level'] + CAT_COLUMNS + TEXT_COLUMNS +
+                   ['agent.id', 'data.win.eventdata.ipAddress', 'data.win.eventdata.targetUserName',
+                    'data.dstuser', 'data.srcuser', 'data.win.system.eventID', 'rule.groups'])
+CONSUMER_COLUMNS = {
+    # + các cột văn bản auto_label quét (label_text_fields), thêm theo cột thực có trong file
+    'train': _FEATURE_INPUTS + ['is_threat'],
+    # + chống trùng (id, rule.id/agent.id/srcip), TI, tin cảnh báo, cột ghi ra sink, chiều MITRE của kho tổng hợp
+    'inference': _FEATURE_INPUTS + ['id', 'rule.description', 'syscheck.path', 'syscheck.sha256_after',
+                                    'data.virustotal.sha256', 'rule.mitre.id', 'rule.mitre.tactic',
+                                    'rule.mitre.technique'],
+    'report': ['timestamp', 'agent.name', 'rule.id', 'rule.level', 'rule.description', 'data.win.eventdata.image',
+               'data.win.eventdata.commandLine', 'rule.mitre.id', 'rule.mitre.tactic', 'rule.mitre.technique',
+               'is_threat', 'full_text', 'ai_pred', 'ai_score'],
+}
+
+def label_text_fields(columns):
+    """Các cột văn bản auto_label quét từ khóa"""
+    return [c for c in columns if any(m in c for m in LABEL_TEXT_MARKERS)]
+
+def consumer_columns(consumer, available):
+    """Các cột trong available (theo thứ tự file) mà bước consumer cần; consumer=None -> tất cả"""
+    if consumer is None:
+        return list(available)
+    if consumer not in CONSUMER_COLUMNS:
+        raise ValueError(f"Consumer '{consumer}' không hợp lệ (chọn: {', '.join(CONSUMER_COLUMNS)}).")
+    wanted = set(CONSUMER_COLUMNS[consumer])
+    if consumer == 'train':
+        wanted.update(label_text_fields(available))
+    return [c for c in available if c in wanted]
+
+def csv_dtypes(columns):
+    """dtype cho pd.read_csv: category như trên, số level đọc float32 (ép int8 ở apply_schema), chuỗi giữ là chuỗi"""
+    dtypes = {}
+    for c in columns:
+        if c in CATEGORY_COLUMNS:
+            dtypes[c] = 'category'
+        elif c in INT8_COLUMNS:
+            dtypes[c] = 'float32'
+        elif c in DATETIME_COLUMNS or ALERT_FIELDS.get(c) in ('str', 'list'):
+            dtypes[c] = str
+    return dtypes
+
+def parse_timestamps(values):
+    """
+    Timestamp ISO8601 của Wazuh (vd: 2025-11-25T00:06:21.012+0000) -> datetime64.
+    format='ISO8601' bỏ qua bước đoán định dạng từng phần tử; giá trị lỗi -> NaT.
+    Đã là datetime thì giữ nguyên; lẫn nhiều múi giờ thì quy về UTC.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    try:
+        return pd.to_datetime(values, format='ISO8601', errors='coerce')
+    except (ValueError, TypeError):
+        return pd.to_datetime(values, format='ISO8601', errors='coerce', utc=True)
+
+def apply_schema(df):
+    """Ép kiểu các cột đã khai báo (sửa trực tiếp df, trả về df)"""
+    for c in CATEGORY_COLUMNS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype('category')
+    for c in INT8_COLUMNS:
+        if c in df.columns:
+            level = pd.to_numeric(df[c], errors='coerce')
+            df[c] = level.astype(np.int8) if level.notna().all() else level.astype(np.float32)
+    for c in DATETIME_COLUMNS:
+        if c in df.columns:
+            df[c] = parse_timestamps(df[c])
+    return df
@@ -0,0 +1,214 @@
+"""
+Dịch vụ HTTP chấm điểm alert Wazuh thời gian thực (không phải chờ chu kỳ poll 60s).
+
+  POST /score    Body: 1 alert JSON, mảng JSON, hoặc NDJSON (mỗi dòng 1 alert)
+                 -> {"model_version": ..., "results": [{"id", "ai_score", "ai_pred"}, ...]} cùng thứ tự gửi lên
+  GET  /health   Trạng thái model + hàng đợi
+  GET  /metrics  Chỉ số dạng Prometheus text (độ sâu hàng đợi, histogram độ trễ, kích thước batch)
+
+Các request đồng thời được gom thành micro-batch (tối đa SERVE_MAX_BATCH alert hoặc SERVE_MAX_WAIT_MS ms)
+rồi mới chạy feature_engineer + predict 1 lần, nên thông lượng cao mà độ trễ vẫn dưới 1 giây.
+
+Chạy: python serve.py [--host 127.0.0.1] [--port 8088]
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from flask import Flask, request, jsonify, Response
+from config import (SERVE_HOST, SERVE_PORT, SERVE_MAX_BATCH, SERVE_MAX_WAIT_MS, SERVE_QUEUE_MAX,
+                    SERVE_REQUEST_TIMEOUT)
+from utils import logger
+from metrics import METRICS, LATENCY_BUCKETS, Histogram
+from schema import flatten_alerts
+from feature_store import FeatureStore
+from inference import load_all, predict_from_dataframe
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+class QueueFullError(Exception):
+    pass
+
+class _Pending:
+    """1 request đang chờ: danh sách alert + chỗ nhận kết quả"""
+    __slots__ = ('alerts', 'enqueued', 'done', 'result', 'error')
+
+    def __init__(self, alerts):
+        self.alerts = alerts
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class MicroBatcher:
+    """
+    Gom các request đồng thời thành micro-batch rồi chấm điểm ở 1 luồng nền.
+    Batch được chốt khi đủ max_batch alert, hoặc khi request đến sớm nhất đã chờ max_wait_ms.
+    Request lớn hơn max_batch được chấm nguyên khối (không bị cắt).
+    """
+
+    def __init__(self, max_batch=SERVE_MAX_BATCH, max_wait_ms=SERVE_MAX_WAIT_MS, max_queue=SERVE_QUEUE_MAX):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        # Store hành vi riêng trong RAM của dịch vụ (không ghi đĩa mỗi batch như daemon)
+        self.feature_store = FeatureStore(path=None)
+        self._queue = queue.Queue()
+        self._queued_alerts = 0
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'alerts': 0, 'batches': 0, 'errors': 0, 'rejected': 0}
+        self.request_latency = Histogram(LATENCY_BUCKETS)
+        self.batch_latency = Histogram(LATENCY_BUCKETS)
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def queue_depth(self):
+        with self._lock:
+            return self._queued_alerts
+
+    def submit(self, alerts, timeout=SERVE_REQUEST_TIMEOUT):
+        """Đưa alert vào hàng đợi và chờ kết quả. Trả về (version, scores, preds)."""
+        pending = _Pending(alerts)
+        with self._lock:
+            if self._queued_alerts + len(alerts) > self.max_queue:
+                self.stats['rejected'] += 1
+                raise QueueFullError(f"Hàng đợi đầy ({self._queued_alerts} alert đang chờ)")
+            self._queued_alerts += len(alerts)
+            self.stats['requests'] += 1
+            self.stats['alerts'] += len(alerts)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError(f"Không có kết quả sau {timeout}s")
+        self.request_latency.observe(time.monotonic() - pending.enqueued)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        first = self._queue.get()
+        batch, size = [first], len(first.alerts)
+        deadline = first.enqueued + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                # Hết hạn chờ vẫn lấy nốt các request đã nằm sẵn trong hàng đợi (đến trong lúc chấm batch trước)
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item.alerts)
+        with self._lock:
+            self._queued_alerts -= size
+        return batch, size
+
+    def _score(self, alerts):
+        snapshot = load_all()
+        if snapshot.model is None:
+            raise RuntimeError("Chưa có model. Hãy chạy train.py trước.")
+        df = flatten_alerts(alerts)
+        preds, probs = predict_from_dataframe(df, loaded=snapshot, feature_store=self.feature_store)
+        if preds is None:
+            raise RuntimeError("Dự đoán thất bại")
+        return snapshot.version, probs, preds
+
+    def _run(self):
+        while True:
+            batch, size = self._collect()
+            t0 = time.perf_counter()
+            try:
+                version, probs, preds = self._score([a for p in batch for a in p.alerts])
+                offset = 0
+                for p in batch:
+                    n = len(p.alerts)
+                    p.result = (version, probs[offset:offset + n], preds[offset:offset + n])
+                    offset += n
+            except Exception as e:
+                logger.error(f"❌ Lỗi chấm điểm micro-batch ({size} alert): {e}")
+                self.stats['errors'] += 1
+                for p in batch:
+                    p.error = e
+            self.stats['batches'] += 1
+            self.batch_latency.observe(time.perf_counter() - t0)
+            self.batch_size.observe(size)
+            for p in batch:
+                p.done.set()
+
+    def prometheus(self):
+        lines = [
+            "# HELP siem_serve_queue_depth Alerts waiting to be scored",
+            "# TYPE siem_serve_queue_depth gauge",
+            f"siem_serve_queue_depth {self.queue_depth()}",
+        ]
+        for key in ('requests', 'alerts', 'batches', 'errors', 'rejected'):
+            lines += [f"# TYPE siem_serve_{key}_total counter", f"siem_serve_{key}_total {self.stats[key]}"]
+        lines += self.request_latency.prometheus('siem_serve_request_seconds', 'End-to-end /score latency')
+        lines += self.batch_latency.prometheus('siem_serve_batch_seconds', 'Feature engineering + predict time per micro-batch')
+        lines += self.batch_size.prometheus('siem_serve_batch_size', 'Alerts per micro-batch')
+        return "\n".join(lines) + "\n"
+
+def parse_alerts(body, content_type=''):
+    """Body -> list alert. Nhận 1 object JSON, mảng JSON hoặc NDJSON."""
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    text = text.strip()
+    if not text:
+        return []
+    if 'ndjson' not in content_type:
+        try:
+            data = json.loads(text)
+            return data if isinstance(data, list) else [data]
+        except json.JSONDecodeError:
+            pass  # Có thể là NDJSON gửi kèm Content-Type application/json
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def create_app(batcher=None):
+    app = Flask(__name__)
+    batcher = batcher or MicroBatcher()
+
+    @app.post('/score')
+    def score():
+        try:
+            alerts = parse_alerts(request.get_data(), request.content_type or '')
+        except json.JSONDecodeError as e:
+            return jsonify(error=f"JSON không hợp lệ: {e}"), 400
+        if not alerts or not all(isinstance(a, dict) for a in alerts):
+            return jsonify(error="Body phải là alert JSON, mảng alert hoặc NDJSON"), 400
+        try:
+            version, probs, preds = batcher.submit(alerts)
+        except QueueFullError as e:
+            return jsonify(error=str(e)), 503
+        except TimeoutError as e:
+            return jsonify(error=str(e)), 504
+        except Exception as e:
+            return jsonify(error=str(e)), 500
+        results = [{'id': a.get('id'), 'ai_score': float(s), 'ai_pred': int(p)}
+                   for a, s, p in zip(alerts, probs, preds)]
+        return jsonify(model_version=version, results=results)
+
+    @app.get('/health')
+    def health():
+        snapshot = load_all()
+        return jsonify(status='ok' if snapshot.model is not None else 'no_model',
+                       model_version=snapshot.version, queue_depth=batcher.queue_depth(), **batcher.stats)
+
+    @app.get('/metrics')
+    def metrics():
+        # Kèm số liệu từng bước (feature_engineer / vectorize / predict) do inference ghi
+        return Response(batcher.prometheus() + METRICS.prometheus(), mimetype='text/plain; version=0.0.4')
+
+    app.batcher = batcher
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dịch vụ chấm điểm alert Wazuh thời gian thực')
+    parser.add_argument('--host', default=SERVE_HOST)
+    parser.add_argument('--port', type=int, default=SERVE_PORT)
+    args = parser.parse_args()
+
+    # Nạp model trước khi nhận request đầu tiên
+    if load_all().model is None:
+        logger.warning("⚠️ Chưa có model, /score sẽ trả lỗi cho tới khi train.py chạy xong (tự hot-reload).")
+    logger.info(f"🌐 Scoring service: http://{args.host}:{args.port}/score "
+                f"(batch <= {SERVE_MAX_BATCH}, chờ <= {SERVE_MAX_WAIT_MS}ms)")
+    create_app().run(host=args.host, port=args.port, threaded=True)
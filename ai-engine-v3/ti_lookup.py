@@ -1,7 +1,13 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import sys
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from utils import logger
+from ti_cache import VerdictCache
 import os
 from dotenv import load_dotenv
 
@@ -22,16 +28,118 @@ ABUSEIPDB_THRESHOLD = 50
 
 VIRUSTOTAL_THRESHOLD = 3
 
+# --- ĐỊA CHỈ API (ghi đè bằng biến môi trường để test với HTTP server giả lập) ---
+ABUSEIPDB_URL = os.getenv("ABUSEIPDB_URL", "https://api.abuseipdb.com/api/v2/check")
+VIRUSTOTAL_URL = os.getenv("VIRUSTOTAL_URL", "https://www.virustotal.com/api/v3/files")
+
+# --- GIỚI HẠN TỐC ĐỘ & QUOTA THEO NHÀ CUNG CẤP (mặc định theo gói miễn phí) ---
+# rate: số request/giây, burst: số request được bắn dồn, daily_quota: tổng request/ngày (None = không giới hạn)
+TI_RATE_LIMITS = {
+    'abuseipdb': {'rate': 1.0, 'burst': 5, 'daily_quota': 1000},
+    'virustotal': {'rate': 4 / 60, 'burst': 4, 'daily_quota': 500},
+}
+TI_MAX_WORKERS = 8       # Số lookup chạy song song
+TI_TIMEOUT = 5           # Timeout mỗi request (giây)
+TI_MAX_RETRIES = 3       # Số lần thử lại khi gặp 429/5xx/lỗi mạng
+TI_BACKOFF = 1.0         # Backoff cơ sở (giây), nhân đôi sau mỗi lần thử
+TI_MAX_WAIT = 30         # Chờ token của rate limiter tối đa bao lâu trước khi bỏ qua lookup
+
+class TokenBucket:
+    """Rate limiter kiểu token bucket + quota theo ngày, an toàn đa luồng"""
+
+    def __init__(self, rate, burst, daily_quota=None):
+        self.rate = rate
+        self.capacity = burst
+        self.daily_quota = daily_quota
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._day = time.strftime('%Y-%m-%d')
+        self._used_today = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=TI_MAX_WAIT):
+        """Lấy 1 token, chờ tối đa timeout giây. Hết quota ngày hoặc quá thời gian chờ -> False"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                today = time.strftime('%Y-%m-%d')
+                if today != self._day:
+                    self._day, self._used_today = today, 0
+                if self.daily_quota is not None and self._used_today >= self.daily_quota:
+                    return False
+
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._used_today += 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+_BUCKETS = {name: TokenBucket(**cfg) for name, cfg in TI_RATE_LIMITS.items()}
+
+def _make_session():
+    """Session dùng chung: giữ kết nối keep-alive, pool đủ cho TI_MAX_WORKERS luồng"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=TI_MAX_WORKERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+_SESSION = _make_session()
+
+# Cache verdict dùng chung (RAM LRU + SQLite). Lỗi mạng/hết quota KHÔNG được cache.
+_CACHE = VerdictCache()
+
+def cache_stats():
+    """Số liệu hit/miss của cache TI"""
+    return _CACHE.stats()
+
+def _request(provider, url, **kwargs):
+    """
+    GET qua session dùng chung, tuân thủ rate limit của provider, thử lại khi gặp 429/5xx/lỗi mạng
+    (tôn trọng header Retry-After, nếu không có thì backoff lũy thừa + jitter).
+    Trả về Response, hoặc None nếu hết quota/hết lượt thử.
+    """
+    bucket = _BUCKETS[provider]
+    for attempt in range(TI_MAX_RETRIES + 1):
+        if not bucket.acquire():
+            logger.warning(f"⚠️ {provider}: hết quota/rate limit, bỏ qua lookup.")
+            return None
+        delay = TI_BACKOFF * (2 ** attempt) + random.uniform(0, TI_BACKOFF)
+        try:
+            response = _SESSION.get(url, timeout=TI_TIMEOUT, **kwargs)
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                delay = float(retry_after)
+            logger.warning(f"⚠️ {provider}: HTTP {response.status_code}, thử lại sau {delay:.1f}s")
+        except requests.RequestException as e:
+            logger.warning(f"⚠️ {provider}: lỗi kết nối ({e}), thử lại sau {delay:.1f}s")
+        if attempt < TI_MAX_RETRIES:
+            time.sleep(delay)
+    return None
+
 def check_ip_abuseipdb(ip_address):
     """
     Kiểm tra uy tín IP trên AbuseIPDB.
     Trả về: (is_malicious, confidence_score, country)
     """
+    cached = _CACHE.get('abuseipdb', ip_address)
+    if cached is not None:
+        return cached
+
     if not ABUSEIPDB_API_KEY or ABUSEIPDB_API_KEY == "YOUR_ABUSEIPDB_API_KEY":
         logger.warning("⚠️ Chưa cấu hình AbuseIPDB API Key.")
         return False, 0, "Unknown"
 
-    url = "https://api.abuseipdb.com/api/v2/check"
+    url = ABUSEIPDB_URL
     querystring = {
         "ipAddress": ip_address,
         "maxAgeInDays": "90"
@@ -42,7 +150,9 @@ def check_ip_abuseipdb(ip_address):
     }
 
     try:
-        response = requests.get(url, headers=headers, params=querystring, timeout=5)
+        response = _request('abuseipdb', url, headers=headers, params=querystring)
+        if response is None:
+            return False, 0, "Error"
         if response.status_code == 200:
             data = response.json()['data']
             score = data.get('abuseConfidenceScore', 0)
@@ -52,6 +162,7 @@ def check_ip_abuseipdb(ip_address):
             if is_malicious:
                 logger.info(f"🚫 AbuseIPDB: IP {ip_address} là ĐỘC HẠI (Score: {score}%)")
             
+            _CACHE.set('abuseipdb', ip_address, (is_malicious, score, country), is_malicious)
             return is_malicious, score, country
         else:
             logger.error(f"Lỗi AbuseIPDB: {response.status_code}")
@@ -65,17 +176,23 @@ def check_hash_virustotal(file_hash, file_path=None):
     Kiểm tra mã băm (MD5/SHA256) trên VirusTotal.
     Trả về: (is_malicious, positives_count, total_engines)
     """
+    cached = _CACHE.get('virustotal', file_hash)
+    if cached is not None:
+        return cached
+
     if not VIRUSTOTAL_API_KEY or VIRUSTOTAL_API_KEY == "YOUR_VIRUSTOTAL_API_KEY":
         logger.warning("⚠️ Chưa cấu hình VirusTotal API Key.")
         return False, 0, 0
 
-    url = f"https://www.virustotal.com/api/v3/files/{file_hash}"
+    url = f"{VIRUSTOTAL_URL}/{file_hash}"
     headers = {
         "x-apikey": VIRUSTOTAL_API_KEY
     }
 
     try:
-        response = requests.get(url, headers=headers, timeout=5)
+        response = _request('virustotal', url, headers=headers)
+        if response is None:
+            return False, 0, 0
         if response.status_code == 200:
             data = response.json()['data']['attributes']['last_analysis_stats']
             malicious = data.get('malicious', 0)
@@ -89,9 +206,12 @@ def check_hash_virustotal(file_hash, file_path=None):
                     log_msg += f"\n   - 📂 Đường dẫn file: {file_path}" # In đường dẫn tại đây
                 
                 logger.info(log_msg)
+            _CACHE.set('virustotal', file_hash, (is_malicious, malicious, total), is_malicious)
             return is_malicious, malicious, total
         elif response.status_code == 404:
             logger.info(f"VirusTotal: Hash {file_hash} chưa từng được quét.")
+            # "Chưa từng quét" cũng cache như kết quả sạch (TTL negative)
+            _CACHE.set('virustotal', file_hash, (False, 0, 0), False)
             return False, 0, 0
         else:
             logger.error(f"Lỗi VirusTotal: {response.status_code}")
@@ -100,6 +220,28 @@ def check_hash_virustotal(file_hash, file_path=None):
         logger.error(f"Lỗi kết nối VirusTotal: {e}")
         return False, 0, 0
 
+def lookup_batch(ips=(), hashes=(), file_paths=None, max_workers=TI_MAX_WORKERS):
+    """
+    Tra cứu song song cả lô chỉ báo (IP + hash), mỗi chỉ báo chỉ tra 1 lần.
+    file_paths: dict {hash: đường dẫn file} để ghi log cho đẹp (tùy chọn).
+    Trả về: {'ip': {ip: (is_malicious, score, country)}, 'hash': {hash: (is_malicious, positives, total)}}
+    """
+    ips = list(dict.fromkeys(ips))
+    hashes = list(dict.fromkeys(hashes))
+    file_paths = file_paths or {}
+    verdicts = {'ip': {}, 'hash': {}}
+    if not ips and not hashes:
+        return verdicts
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        ip_futures = {ip: pool.submit(check_ip_abuseipdb, ip) for ip in ips}
+        hash_futures = {h: pool.submit(check_hash_virustotal, h, file_path=file_paths.get(h)) for h in hashes}
+        for ip, fut in ip_futures.items():
+            verdicts['ip'][ip] = fut.result()
+        for h, fut in hash_futures.items():
+            verdicts['hash'][h] = fut.result()
+    return verdicts
+
 if __name__ == "__main__":
     # Test thử
     print("--- TESTING TI LOOKUP ---")
@@ -1,123 +1,153 @@
 import numpy as np
 import pandas as pd
-from sklearn.pipeline import Pipeline
-from sklearn.compose import ColumnTransformer
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.model_selection import StratifiedKFold, cross_validate
 from sklearn.metrics import make_scorer, accuracy_score, f1_score, precision_score, recall_score
-from sklearn.feature_extraction.text import TfidfVectorizer
-from scipy.sparse import hstack
 import joblib
+import sklearn
 import argparse
 import sys
+from datetime import date
 import os
 
 # Import cấu hình và hàm tiện ích từ các file bạn đã tạo trước đó
-from config import RANDOM_STATE, CV_FOLDS, TFIDF_MAX_FEATURES, DEFAULT_BACKEND, MODEL_PATH, VECTORIZER_PATH, ENCODERS_PATH, DATA_PATH
+from config import RANDOM_STATE, CV_FOLDS, DEFAULT_BACKEND, FEATURE_BACKEND, MODEL_PATH, VECTORIZER_PATH, ENCODERS_PATH, DATA_PATH, SCORER_PATH
 from utils import logger, save_artifacts, ensure_binary_labels
-from preprocess import read_csv_safe, auto_label, feature_engineer
+from preprocess import load_dataset, resolve_data_path, auto_label, feature_engineer
+from feature_store import FeatureStore
+from features import FEATURE_BACKENDS, fit_transform_features
+from feature_cache import FeatureCache, feature_cache_key
+from tree_scorer import export_trees
+from parallel_features import ParallelFeaturizer, use_parallel
 
 # Sửa lỗi hiển thị tiếng Việt trên Windows console
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding='utf-8')
 
-def get_model(backend='xgboost'):
+def get_model(backend='xgboost', n_jobs=-1, **params):
     """
     Factory để tạo model dựa trên backend được chọn.
     Hỗ trợ XGBoost, LightGBM, CatBoost.
+    n_jobs: số luồng của chính model (-1 = toàn bộ core). params ghi đè cấu hình mặc định (dùng khi dò tham số).
     """
     if backend == 'xgboost':
         from xgboost import XGBClassifier
-        return XGBClassifier(
-            n_estimators=300,
-            max_depth=6,
-            learning_rate=0.1,
-            use_label_encoder=False,
-            eval_metric='logloss',
-            n_jobs=-1,
-            random_state=RANDOM_STATE
-        )
+        defaults = dict(n_estimators=300, max_depth=6, learning_rate=0.1, use_label_encoder=False,
+                        eval_metric='logloss', random_state=RANDOM_STATE)
+        return XGBClassifier(**{**defaults, **params}, n_jobs=n_jobs)
     elif backend == 'lightgbm':
         import lightgbm as lgb
-        return lgb.LGBMClassifier(n_estimators=1000, random_state=RANDOM_STATE, n_jobs=-1)
+        defaults = dict(n_estimators=1000, random_state=RANDOM_STATE)
+        return lgb.LGBMClassifier(**{**defaults, **params}, n_jobs=n_jobs)
     elif backend == 'catboost':
         from catboost import CatBoostClassifier
-        return CatBoostClassifier(iterations=500, verbose=100, random_state=RANDOM_STATE)
+        defaults = dict(iterations=500, verbose=100, random_state=RANDOM_STATE)
+        # CatBoost không nhận -1 cho số luồng theo kiểu sklearn ở mọi phiên bản -> quy đổi
+        return CatBoostClassifier(**{**defaults, **params}, thread_count=n_jobs if n_jobs > 0 else (os.cpu_count() or 1))
     else:
         raise ValueError(f"Backend '{backend}' chưa được hỗ trợ hoặc chưa cài đặt.")
 
-def train_pipeline(backend=DEFAULT_BACKEND):
-    logger.info(f"🚀 Starting training pipeline with backend: {backend}")
-    
-    # --- 1. Load & Preprocess ---
-    # Đọc dữ liệu từ file CSV (đường dẫn lấy từ config.py)
-    logger.info(f"Reading data from: {DATA_PATH}")
-    df = read_csv_safe(DATA_PATH)
-    
+def thread_plan(n_tasks, mode='tasks'):
+    """
+    Chia core giữa các tác vụ song song và số luồng của từng model để không bị oversubscribe
+    (vd: cross_validate(n_jobs=-1) lồng model n_jobs=-1 -> folds x cores luồng tranh nhau).
+    mode='tasks': chạy song song nhiều tác vụ (fold / cấu hình), mỗi model ít luồng.
+    mode='model': chạy tuần tự từng tác vụ, mỗi model dùng hết core.
+    Trả về (số tác vụ song song, số luồng mỗi model).
+    """
+    cpus = os.cpu_count() or 1
+    if mode == 'model' or n_tasks <= 1:
+        return 1, cpus
+    outer = min(n_tasks, cpus)
+    return outer, max(1, cpus // outer)
+
+def label_and_engineer(df):
+    """auto_label -> đặc trưng hành vi -> feature_engineer. Trả về (X_num, X_cat, X_text, y) chưa biến đổi."""
     # Gán nhãn tự động (Auto-labeling) để có dữ liệu train
     df = auto_label(df)
+
+    # Đặc trưng hành vi (đếm theo cửa sổ trượt): phát lại toàn bộ dữ liệu theo thứ tự thời gian
+    # trên 1 store mới trong RAM, giống cách inference cập nhật store theo từng batch
+    df = df.join(FeatureStore(path=None).annotate(df))
     
     # Feature Engineering: Tạo đặc trưng và lấy nhãn y
     # is_training=True để hàm trả về cả y
-    X_num, X_cat, X_text, y = feature_engineer(df, is_training=True)
+    # File lớn: chia khối cho nhiều tiến trình (xem parallel_features.py)
+    if use_parallel(len(df)):
+        with ParallelFeaturizer() as featurizer:
+            X_num, X_cat, X_text, y = featurizer.engineer(df, is_training=True)
+    else:
+        X_num, X_cat, X_text, y = feature_engineer(df, is_training=True)
     
     # Đảm bảo nhãn y là nhị phân (0/1)
-    y = ensure_binary_labels(y)
+    return X_num, X_cat, X_text, ensure_binary_labels(y)
+
+def build_training_matrix(data_path, feature_backend=FEATURE_BACKEND):
+    """Đọc dữ liệu -> label_and_engineer -> fit bộ biến đổi. Trả về (X_full, y, artifacts, vectorizer)."""
+    X_num, X_cat, X_text, y = label_and_engineer(load_dataset(data_path, consumer='train'))
+
+    # --- 2 & 3. Xây dựng Transformers + biến đổi dữ liệu Train ---
+    # Số: StandardScaler. Category + text: One-Hot + TF-IDF (backend 'tfidf')
+    # hoặc băm cố định số chiều (backend 'hashing'), xem features.py
+    logger.info("⚙️  Transforming features...")
+    X_full, artifacts, vectorizer = fit_transform_features(X_num, X_cat, X_text, backend=feature_backend)
+    return X_full, y, artifacts, vectorizer
+
+def load_training_matrix(data_path=None, feature_backend=FEATURE_BACKEND, use_cache=True):
+    """build_training_matrix có cache: trả về (X_full, y, artifacts, vectorizer)"""
+    # --- 1. Load & Preprocess ---
+    # Đọc dữ liệu từ spool Feather hoặc CSV (mặc định lấy file mới nhất theo config.py)
+    data_path = resolve_data_path(data_path)
+    logger.info(f"Reading data from: {data_path}")
+
+    # Cùng dữ liệu + quy tắc gán nhãn + cấu hình đặc trưng thì dùng lại ma trận đã tính
+    # (so sánh nhiều --backend liên tiếp không phải làm lại auto_label / feature_engineer / fit TF-IDF)
+    cache = FeatureCache() if use_cache else None
+    cached = None
+    if cache is not None:
+        key, key_parts = feature_cache_key(data_path, feature_backend)
+        cached = cache.load(key)
+    if cached is not None:
+        X_full, y, artifacts, vectorizer = cached
+    else:
+        X_full, y, artifacts, vectorizer = build_training_matrix(data_path, feature_backend)
+        if cache is not None:
+            cache.save(key, X_full, y, artifacts, vectorizer, meta={'data_path': str(data_path), **key_parts})
 
     # Kiểm tra sơ bộ dữ liệu
     n_threats = sum(y)
-    logger.info(f"Data shape: {len(df)} rows. Threat ratio: {n_threats}/{len(y)} ({n_threats/len(y):.2%})")
+    logger.info(f"Data shape: {len(y)} rows. Threat ratio: {n_threats}/{len(y)} ({n_threats/len(y):.2%})")
 
     if n_threats == 0:
         logger.warning("⚠️ CẢNH BÁO: Không có mẫu Threat nào trong dữ liệu! Model sẽ học không hiệu quả.")
         logger.warning("💡 Gợi ý: Hãy chạy tấn công giả lập (net user /add...) rồi chạy lại fetch_alerts.py")
-
-    # --- 2. Xây dựng Transformers (Bộ biến đổi dữ liệu) ---
-    numeric_features = list(X_num.columns)
-    categorical_features = list(X_cat.columns)
-
-    # Pipeline cho dữ liệu số: Chuẩn hóa (StandardScaler)
-    num_transformer = Pipeline(steps=[
-        ('scaler', StandardScaler())
-    ])
-    
-    # Pipeline cho dữ liệu danh mục: One-Hot Encoding (biến chữ thành vector 0/1)
-    # handle_unknown='ignore': Gặp giá trị lạ thì bỏ qua, không lỗi
-    cat_transformer = Pipeline(steps=[
-        ('onehot', OneHotEncoder(handle_unknown='ignore', sparse_output=True)) 
-    ])
-
-    # Bộ xử lý cột (ColumnTransformer) để áp dụng riêng từng loại
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ('num', num_transformer, numeric_features),
-            ('cat', cat_transformer, categorical_features)
-        ], remainder='drop'
-    )
-
-    # NLP: TF-IDF Vectorizer cho dữ liệu văn bản
-    vectorizer = TfidfVectorizer(max_features=TFIDF_MAX_FEATURES, ngram_range=(1,2))
-
-    # --- 3. Chuẩn bị dữ liệu Train ---
-    logger.info("⚙️  Transforming features...")
-    
-    # Biến đổi số & category
-    X_pre = preprocessor.fit_transform(X_num.join(X_cat))
-    
-    # Biến đổi text
-    # Nếu không có text thì tạo ma trận rỗng
-    if X_text is not None and not X_text.empty and not (X_text == '').all():
-        X_text_tfidf = vectorizer.fit_transform(X_text)
+    logger.info(f"   Feature matrix: {X_full.shape[0]} x {X_full.shape[1]} ({X_full.nnz} non-zero)")
+    return X_full, y, artifacts, vectorizer
+
+def save_model(model, artifacts, vectorizer):
+    """Export cây + lưu model/preprocessor/vectorizer kèm manifest (registry của daemon tự hot-reload)"""
+    # Export cây ra mảng NumPy phẳng cho bộ chấm điểm độ trễ thấp (tree_scorer.py), đưa vào manifest cùng model
+    scorer = export_trees(model, SCORER_PATH)
+    # Lưu preprocessor (chứa scaler và onehot/hasher) + tên backend để dùng lại khi dự đoán
+    return save_artifacts(model, artifacts, vectorizer, MODEL_PATH, ENCODERS_PATH, VECTORIZER_PATH,
+                          extra_files={'scorer': SCORER_PATH} if scorer is not None else None)
+
+def train_pipeline(backend=DEFAULT_BACKEND, data_path=None, feature_backend=FEATURE_BACKEND, use_cache=True,
+                   data_dir=None, since=None, until=None):
+    logger.info(f"🚀 Starting training pipeline with backend: {backend} (features: {feature_backend})")
+    if data_dir is not None:
+        # Kho phân vùng theo ngày: đọc theo khối + lấy mẫu mẫu an toàn kèm trọng số (không qua cache đặc trưng)
+        from data_loader import load_partitioned_matrix
+        X_full, y, artifacts, vectorizer, sample_weight = load_partitioned_matrix(data_dir, feature_backend,
+                                                                                  since, until)
+        fit_params = {'sample_weight': sample_weight}
     else:
-        from scipy.sparse import csr_matrix
-        X_text_tfidf = csr_matrix((X_pre.shape[0], 0))
-        logger.warning("⚠️ No text data found for TF-IDF.")
-    
-    # Gộp lại thành ma trận lớn (Sparse Matrix)
-    X_full = hstack([X_pre, X_text_tfidf])
+        X_full, y, artifacts, vectorizer = load_training_matrix(data_path, feature_backend, use_cache)
+        fit_params = {}
 
     # --- 4. Cross-Validation (Kiểm tra chéo) ---
-    model = get_model(backend)
+    # Song song theo fold, mỗi model chỉ dùng phần core của mình (không lồng n_jobs=-1 vào n_jobs=-1)
+    cv_jobs, model_jobs = thread_plan(CV_FOLDS)
+    model = get_model(backend, n_jobs=model_jobs)
     
     # Chia tập dữ liệu thành 5 phần để test chéo
     cv = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=RANDOM_STATE)
@@ -125,41 +155,83 @@ def train_pipeline(backend=DEFAULT_BACKEND):
     # Các chỉ số đánh giá
     scoring = {
         'accuracy': make_scorer(accuracy_score),
-        'f1': make_scorer(f1_score, zero_division=0)
+        'f1': make_scorer(f1_score, zero_division=0),
+        'precision': make_scorer(precision_score, zero_division=0),
+        'recall': make_scorer(recall_score, zero_division=0),
     }
 
+    # Có trọng số lấy mẫu (--data-dir): chấm CV có trọng số để chỉ số phản ánh đúng lượng mẫu an toàn thật
+    weighted_cv = 'sample_weight' in fit_params and hasattr(model, 'set_fit_request')
+    if fit_params and not weighted_cv:
+        logger.warning(f"⚠️ {type(model).__name__} không hỗ trợ metadata routing: chỉ số CV tính trên dữ liệu "
+                       f"đã lấy mẫu (không trọng số), precision sẽ cao hơn thực tế.")
+
     logger.info('🔄 Running Cross-Validation...')
     
     # Kiểm tra xem có đủ dữ liệu để split không (ít nhất 2 class)
     if len(np.unique(y)) < 2:
         logger.warning("⚠️ Dữ liệu chỉ có 1 lớp (toàn an toàn hoặc toàn nguy hiểm). Bỏ qua Cross-Validation.")
     else:
-        res = cross_validate(model, X_full, y, cv=cv, scoring=scoring, return_train_score=False, n_jobs=-1)
+        with sklearn.config_context(enable_metadata_routing=weighted_cv):
+            if weighted_cv:
+                model.set_fit_request(sample_weight=True)
+                scoring = {k: v.set_score_request(sample_weight=True) for k, v in scoring.items()}
+            res = cross_validate(model, X_full, y, cv=cv, scoring=scoring, return_train_score=False, n_jobs=cv_jobs,
+                                 params=fit_params)
         for k, v in res.items():
             logger.info(f"   CV {k}: mean={np.mean(v):.4f} std={np.std(v):.4f}")
 
-    # --- 5. Train Final Model (Trên toàn bộ dữ liệu) ---
+    # --- 5. Train Final Model (Trên toàn bộ dữ liệu, model dùng hết core) ---
     logger.info('🧠 Fitting final model...')
-    model.fit(X_full, y)
+    model = get_model(backend)
+    model.fit(X_full, y, **fit_params)
 
     # --- 6. Lưu trữ (Save Artifacts) ---
-    # Lưu preprocessor (chứa scaler và onehot) để dùng lại khi dự đoán
-    artifacts = {
-        'preprocessor': preprocessor,
-        'numeric_features': numeric_features,
-        'categorical_features': categorical_features
-    }
-    
-    save_artifacts(model, artifacts, vectorizer, MODEL_PATH, ENCODERS_PATH, VECTORIZER_PATH)
+    save_model(model, artifacts, vectorizer)
     logger.info('🎉 Training complete!')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--backend', default=DEFAULT_BACKEND, help='xgboost|lightgbm|catboost')
+    parser.add_argument('--data', default=None, help='File .feather hoặc .csv (mặc định: spool/CSV mới nhất)')
+    parser.add_argument('--features', default=FEATURE_BACKEND, choices=FEATURE_BACKENDS, help='Backend đặc trưng: tfidf|hashing')
+    parser.add_argument('--data-dir', default=None,
+                        help='Thư mục kho lưu trữ phân vùng theo ngày: đọc theo khối, lấy mẫu mẫu an toàn (xem data_loader.py)')
+    parser.add_argument('--since', type=date.fromisoformat, default=None, help='(data-dir) Từ ngày YYYY-MM-DD')
+    parser.add_argument('--until', type=date.fromisoformat, default=None, help='(data-dir) Đến ngày YYYY-MM-DD')
+    parser.add_argument('--no-cache', action='store_true', help='Không dùng / không ghi cache ma trận đặc trưng')
+    parser.add_argument('--tune', action='store_true',
+                        help='Dò siêu tham số (successive halving) trên các backend đã cài rồi lưu model tốt nhất')
+    parser.add_argument('--tune-backends', nargs='+', default=None, help='(tune) Backend tham gia, mặc định: tất cả đã cài')
+    parser.add_argument('--budget', type=float, default=None, help='(tune) Ngân sách thời gian thực (giây)')
+    parser.add_argument('--cpu-budget', type=float, default=None, help='(tune) Ngân sách CPU (giây CPU của tiến trình)')
+    parser.add_argument('--parallel', choices=['candidates', 'model'], default='candidates',
+                        help='(tune) Song song theo cấu hình (mỗi model ít luồng) hay theo model (chạy lần lượt)')
+    parser.add_argument('--max-latency-ms', type=float, default=None,
+                        help='(tune) Chỉ chọn model có độ trễ chấm 1 alert (p50) không quá ngưỡng này')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Boost thêm cây lên model hiện tại bằng --data (cửa sổ mới), giữ nguyên preprocessor/vectorizer')
+    parser.add_argument('--valid-data', default=None,
+                        help='(incremental) Tập tham chiếu đã gán nhãn để kiểm tra model mới không kém đi')
+    parser.add_argument('--rounds', type=int, default=None, help='(incremental) Số cây thêm')
+    parser.add_argument('--force', action='store_true', help='(incremental) Lưu dù chốt chặn kiểm tra từ chối')
     args = parser.parse_args()
     
     try:
-        train_pipeline(backend=args.backend)
+        if args.incremental:
+            from incremental import incremental_pipeline
+            from config import INCREMENTAL_ROUNDS
+            if not incremental_pipeline(data_path=args.data, valid_path=args.valid_data,
+                                        rounds=args.rounds or INCREMENTAL_ROUNDS, force=args.force):
+                sys.exit(1)
+        elif args.tune:
+            from tune import tune_pipeline
+            tune_pipeline(backends=args.tune_backends, data_path=args.data, feature_backend=args.features,
+                          budget_seconds=args.budget, cpu_budget_seconds=args.cpu_budget, parallel=args.parallel,
+                          max_latency_ms=args.max_latency_ms, use_cache=not args.no_cache)
+        else:
+            train_pipeline(backend=args.backend, data_path=args.data, feature_backend=args.features,
+                           use_cache=not args.no_cache, data_dir=args.data_dir, since=args.since, until=args.until)
     except Exception as e:
         logger.error(f"Training failed: {e}")
         import traceback
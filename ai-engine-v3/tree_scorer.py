@@ -0,0 +1,284 @@
+import json
+import os
+import numpy as np
+from pathlib import Path
+from scipy.sparse import csr_matrix, issparse
+from config import SCORER_PATH
+from utils import logger
+
+# Cách xử lý giá trị thiếu tại mỗi nút (theo quy ước của từng thư viện)
+MISSING_NAN = 0    # NaN đi theo nhánh mặc định (XGBoost, LightGBM missing_type='NaN')
+MISSING_ZERO = 1   # 0 hoặc NaN đi theo nhánh mặc định (LightGBM missing_type='Zero')
+MISSING_NONE = 2   # NaN coi như 0 rồi so sánh bình thường (LightGBM missing_type='None')
+
+class TreeScorer:
+    """
+    Bộ chấm điểm cây quyết định thuần NumPy cho model XGBoost / LightGBM (phân loại nhị phân).
+    Tất cả cây được "phẳng hóa" thành các mảng nút (feature, threshold, left, right, ...) và duyệt
+    đồng thời cho mọi (dòng, cây) bằng vài phép gather vector hóa, không qua DMatrix/wrapper sklearn
+    nên chi phí mỗi lần gọi rất thấp (chấm từng event hoặc micro-batch).
+    Nhận trực tiếp ma trận thưa CSR đã hstack (đầu ra của features.transform_features).
+    """
+
+    def __init__(self, feature, threshold, left, right, default_left, missing_type, value, roots,
+                 n_features, base_margin, decision='lt', absent_value=np.nan, max_depth=None, source=''):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.missing_type = np.asarray(missing_type, dtype=np.int8)
+        self.value = np.asarray(value, dtype=np.float32)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.n_features = int(n_features)
+        self.base_margin = float(base_margin)
+        self.decision = decision              # 'lt': x < thr đi trái (XGBoost); 'le': x <= thr (LightGBM)
+        self.absent_value = float(absent_value)   # Ô không lưu trong ma trận thưa: NaN (XGBoost) hay 0 (LightGBM)
+        self.source = source
+        # XGBoost so sánh trên float32, LightGBM trên float64: ép dữ liệu đúng kiểu để kết quả khớp từng bit
+        self._dtype = np.float32 if decision == 'lt' else np.float64
+        self.is_leaf = self.left < 0
+        self.max_depth = int(max_depth) if max_depth is not None else self._compute_depth()
+
+        # Chỉ giữ lại các cột thực sự được cây dùng: ma trận đặc khi chấm điểm nhỏ hơn rất nhiều
+        used = np.unique(self.feature[~self.is_leaf])
+        self.used_features = used
+        self._col_map = np.full(self.n_features, -1, dtype=np.int64)
+        self._col_map[used] = np.arange(len(used))
+        self._has_special_missing = bool((self.missing_type != MISSING_NAN).any())
+        self._build_layout()
+
+    def _build_layout(self):
+        """
+        Đánh số lại nút để 2 con của mỗi nút nằm liền nhau (con phải = con trái + 1): mỗi bước duyệt
+        chỉ còn node = first_child[node] + go_right. Nút lá trỏ về chính nó (ngưỡng +inf, luôn "đi trái")
+        nên duyệt đủ max_depth bước mà không cần kiểm tra lá.
+        """
+        # Xếp cây sâu trước: ở bước duyệt thứ d chỉ cần xử lý các cây có độ sâu > d (cột đầu của ma trận nút)
+        depths = np.array([self._tree_depth(r) for r in self.roots.tolist()], dtype=np.int64)
+        by_depth = np.argsort(-depths, kind='stable')
+        self._active_trees = [int((depths > d).sum()) for d in range(self.max_depth)]
+
+        order, first_child = [], {}
+        new_roots = []
+        for root in self.roots[by_depth].tolist():
+            new_roots.append(len(order))
+            order.append(root)
+            i = len(order) - 1
+            while i < len(order):
+                node = order[i]
+                if not self.is_leaf[node]:
+                    first_child[node] = len(order)
+                    order.extend((int(self.left[node]), int(self.right[node])))
+                i += 1
+        order = np.asarray(order, dtype=np.int64)
+        leaf = self.is_leaf[order]
+        new_id = np.arange(len(order), dtype=np.int64)
+
+        self._roots = np.asarray(new_roots, dtype=np.int32)
+        self._first_child = np.where(leaf, new_id, [first_child.get(o, -1) for o in order.tolist()]).astype(np.int32)
+        # Ngưỡng NaN ở lá: mọi phép so sánh đều False -> đứng yên tại lá
+        self._threshold = np.where(leaf, np.nan, self.threshold[order]).astype(self._dtype)
+        self._default_right = (~self.default_left[order]) & ~leaf
+        self._missing_type = np.where(leaf, MISSING_NAN, self.missing_type[order]).astype(np.int8)
+        self._local_feature = np.where(leaf, 0, self._col_map[np.where(leaf, 0, self.feature[order])]).astype(np.int32)
+        self._value = np.where(leaf, self.value[order], 0.0).astype(np.float32)
+        # Đường nhanh (chỉ có missing kiểu NaN): dữ liệu được nhân 2 bản, NaN -> -inf (đi trái) và NaN -> +inf (đi phải);
+        # nút có nhánh mặc định bên phải đọc bản +inf. Mỗi bước duyệt chỉ còn 1 phép so sánh, không cần isnan.
+        k = len(self.used_features)
+        self._fast_feature = (self._local_feature + k * self._default_right).astype(np.int32)
+
+    def _tree_depth(self, root):
+        depth, frontier = 0, np.array([root])
+        while True:
+            frontier = frontier[~self.is_leaf[frontier]]
+            if len(frontier) == 0:
+                return depth
+            frontier = np.concatenate([self.left[frontier], self.right[frontier]])
+            depth += 1
+
+    def _compute_depth(self):
+        return max((self._tree_depth(r) for r in self.roots.tolist()), default=0)
+
+    # --- Dựng từ model đã train ---
+    @classmethod
+    def from_xgboost(cls, model):
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        learner = json.loads(booster.save_raw('json'))['learner']
+        objective = learner['objective']['name']
+        if objective not in ('binary:logistic', 'reg:logistic'):
+            raise ValueError(f"Chỉ hỗ trợ XGBoost binary:logistic (model là {objective}).")
+        params = learner['learner_model_param']
+        base_score = float(str(params['base_score']).strip('[]'))
+        base_margin = float(np.log(base_score / (1 - base_score)))
+
+        feature, threshold, left, right, default_left, value, roots = [], [], [], [], [], [], []
+        for tree in learner['gradient_booster']['model']['trees']:
+            if any(tree.get('split_type', [])):
+                raise ValueError("Cây có split categorical chưa được hỗ trợ.")
+            offset = len(feature)
+            roots.append(offset)
+            lc = np.asarray(tree['left_children'])
+            rc = np.asarray(tree['right_children'])
+            leaf = lc < 0
+            feature.extend(tree['split_indices'])
+            threshold.extend(tree['split_conditions'])
+            left.extend(np.where(leaf, -1, lc + offset))
+            right.extend(np.where(leaf, -1, rc + offset))
+            default_left.extend(tree['default_left'])
+            # Ở nút lá XGBoost lưu giá trị lá trong split_conditions
+            value.extend(np.where(leaf, tree['split_conditions'], 0.0))
+        n = len(feature)
+        return cls(feature, threshold, left, right, default_left, np.full(n, MISSING_NAN), value, roots,
+                   n_features=int(params['num_feature']), base_margin=base_margin,
+                   decision='lt', absent_value=np.nan, source='xgboost')
+
+    @classmethod
+    def from_lightgbm(cls, model):
+        booster = model.booster_ if hasattr(model, 'booster_') else model
+        dump = booster.dump_model()
+        if dump.get('num_tree_per_iteration', 1) != 1 or not str(dump.get('objective', '')).startswith('binary'):
+            raise ValueError("Chỉ hỗ trợ LightGBM binary.")
+        missing_codes = {'NaN': MISSING_NAN, 'Zero': MISSING_ZERO, 'None': MISSING_NONE}
+
+        cols = {k: [] for k in ('feature', 'threshold', 'left', 'right', 'default_left', 'missing_type', 'value')}
+        roots = []
+
+        def add_node(node):
+            idx = len(cols['feature'])
+            for k in cols:
+                cols[k].append(0)
+            if 'leaf_value' in node:
+                cols['left'][idx] = cols['right'][idx] = -1
+                cols['value'][idx] = node['leaf_value']
+                return idx
+            if node.get('decision_type', '<=') != '<=':
+                raise ValueError("Cây có split categorical chưa được hỗ trợ.")
+            cols['feature'][idx] = node['split_feature']
+            cols['threshold'][idx] = node['threshold']
+            cols['default_left'][idx] = node.get('default_left', True)
+            cols['missing_type'][idx] = missing_codes.get(node.get('missing_type', 'None'), MISSING_NONE)
+            cols['left'][idx] = add_node(node['left_child'])
+            cols['right'][idx] = add_node(node['right_child'])
+            return idx
+
+        for tree in dump['tree_info']:
+            roots.append(add_node(tree['tree_structure']))
+        # boost_from_average của LightGBM đã cộng sẵn giá trị khởi tạo vào lá của cây đầu tiên
+        return cls(cols['feature'], cols['threshold'], cols['left'], cols['right'], cols['default_left'],
+                   cols['missing_type'], cols['value'], roots, n_features=dump['max_feature_idx'] + 1,
+                   base_margin=0.0, decision='le', absent_value=0.0, source='lightgbm')
+
+    @classmethod
+    def from_model(cls, model):
+        name = type(model).__module__.split('.')[0]
+        if name == 'xgboost':
+            return cls.from_xgboost(model)
+        if name == 'lightgbm':
+            return cls.from_lightgbm(model)
+        raise ValueError(f"Chưa hỗ trợ export cây cho model {type(model).__name__}.")
+
+    # --- Lưu / nạp (.npz: mảng NumPy thuần, không pickle, đọc được từ ngôn ngữ khác) ---
+    _ARRAYS = ('feature', 'threshold', 'left', 'right', 'default_left', 'missing_type', 'value', 'roots')
+
+    def save(self, path=SCORER_PATH):
+        path = Path(path)
+        meta = {'n_features': self.n_features, 'base_margin': self.base_margin, 'decision': self.decision,
+                'absent_value': None if np.isnan(self.absent_value) else self.absent_value,
+                'max_depth': self.max_depth, 'source': self.source}
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **{k: getattr(self, k) for k in self._ARRAYS})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=SCORER_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            arrays = {k: data[k] for k in cls._ARRAYS}
+        absent = meta.pop('absent_value')
+        return cls(**arrays, absent_value=np.nan if absent is None else absent, **meta)
+
+    # --- Chấm điểm ---
+    def _gather(self, X):
+        """Lấy các cột cây dùng từ ma trận (thưa hoặc đặc) thành mảng đặc float32 (n, số cột dùng)"""
+        if not issparse(X):
+            X = np.asarray(X, dtype=self._dtype)
+            return X[:, self.used_features]
+        X = csr_matrix(X)
+        n = X.shape[0]
+        out = np.full((n, len(self.used_features)), self.absent_value, dtype=self._dtype)
+        cols = self._col_map[X.indices]
+        rows = np.repeat(np.arange(n), np.diff(X.indptr))
+        keep = cols >= 0
+        out[rows[keep], cols[keep]] = X.data[keep]
+        return out
+
+    def _predict_margin_fast(self, Xd):
+        missing = np.isnan(Xd)
+        Xf = np.hstack([np.where(missing, -np.inf, Xd), np.where(missing, np.inf, Xd)])
+        # Log SIEM lặp lại rất nhiều: chỉ duyệt cây cho các dòng đặc trưng khác nhau rồi map kết quả về
+        inverse = None
+        if len(Xf) > 1:
+            rows = np.ascontiguousarray(Xf).view(np.dtype((np.void, Xf.dtype.itemsize * Xf.shape[1]))).ravel()
+            _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+            Xf = Xf[first]
+        n, k2 = Xf.shape
+        flat = Xf.ravel()
+        row_offset = (np.arange(n, dtype=np.int64) * k2)[:, None]
+        node = np.tile(self._roots, (n, 1))
+        for active in self._active_trees:
+            cur = node[:, :active]
+            x = flat.take(row_offset + self._fast_feature.take(cur))
+            thr = self._threshold.take(cur)
+            go_right = (x >= thr) if self.decision == 'lt' else (x > thr)
+            node[:, :active] = self._first_child.take(cur) + go_right
+        margin = self._value.take(node).sum(axis=1, dtype=np.float64) + self.base_margin
+        return margin if inverse is None else margin[inverse]
+
+    def predict_margin(self, X):
+        Xd = self._gather(X)
+        if not self._has_special_missing:
+            return self._predict_margin_fast(Xd)
+        n, k = Xd.shape
+        flat = Xd.ravel()
+        row_offset = (np.arange(n, dtype=np.int64) * k)[:, None]
+        node = np.tile(self._roots, (n, 1))
+        for _ in range(self.max_depth):
+            x = flat[row_offset + self._local_feature[node]]
+            missing = np.isnan(x)
+            mt = self._missing_type[node]
+            x = np.where(missing & (mt == MISSING_NONE), 0, x).astype(self._dtype, copy=False)
+            missing = (missing & (mt == MISSING_NAN)) | ((mt == MISSING_ZERO) & (missing | (x == 0)))
+            thr = self._threshold[node]
+            go_right = (x >= thr) if self.decision == 'lt' else (x > thr)
+            go_right &= ~missing
+            go_right |= missing & self._default_right[node]
+            node = self._first_child[node] + go_right
+        return self._value[node].sum(axis=1, dtype=np.float64) + self.base_margin
+
+    def predict_proba(self, X):
+        """Giống sklearn: mảng (n, 2) xác suất lớp 0 / lớp 1"""
+        p = 1.0 / (1.0 + np.exp(-self.predict_margin(X)))
+        return np.column_stack([1.0 - p, p])
+
+def export_trees(model, path=SCORER_PATH):
+    """
+    Export cây của model vừa train ra file .npz cho TreeScorer.
+    Model chưa hỗ trợ (vd: CatBoost) thì xóa file cũ (tránh lệch version) và trả về None.
+    """
+    try:
+        scorer = TreeScorer.from_model(model)
+    except Exception as e:
+        logger.warning(f"⚠️ Không export được cây cho bộ chấm điểm nhanh: {e}")
+        Path(path).unlink(missing_ok=True)
+        return None
+    scorer.save(path)
+    logger.info(f"🌲 Exported {len(scorer.roots)} trees ({len(scorer.feature)} nodes, depth {scorer.max_depth}) -> {path}")
+    return scorer
+
+def load_scorer(path=SCORER_PATH):
+    """Nạp TreeScorer đã export; không có file thì trả về None"""
+    if not Path(path).exists():
+        return None
+    return TreeScorer.load(path)
@@ -0,0 +1,270 @@
+"""
+Dò siêu tham số có ngân sách cho train.py (chạy: python train.py --tune [--budget 600] [--max-latency-ms 2]).
+
+- Successive halving trên cả XGBoost / LightGBM / CatBoost (backend nào đã cài):
+  vòng đầu TUNE_CANDIDATES cấu hình ngẫu nhiên mỗi backend với TUNE_MIN_ROUNDS cây,
+  mỗi vòng sau giữ 1/TUNE_ETA cấu hình tốt nhất và nhân số cây lên TUNE_ETA lần, tới TUNE_MAX_ROUNDS.
+- Mọi lần fit đều dừng sớm theo logloss trên tập validation (giữ TUNE_VALID_FRACTION dữ liệu).
+- Ngân sách: thời gian thực (--budget) và/hoặc giây CPU (--cpu-budget); hết ngân sách thì không fit thêm,
+  lấy kết quả tốt nhất đã có.
+- Luồng: song song theo cấu hình (mỗi model ít luồng) hoặc theo model (lần lượt, model dùng hết core),
+  tổng số luồng không vượt số core.
+- Mỗi cấu hình đo thêm độ trễ chấm điểm (batch 1 và 1024, dùng TreeScorer nếu export được như daemon)
+  -> báo cáo biên Pareto điểm số / độ trễ / chi phí fit; model thắng được fit lại trên toàn bộ dữ liệu và lưu.
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import average_precision_score, roc_auc_score, f1_score, log_loss
+from config import (RANDOM_STATE, FEATURE_BACKEND, TUNE_BUDGET_SECONDS, TUNE_CANDIDATES, TUNE_MIN_ROUNDS,
+                    TUNE_MAX_ROUNDS, TUNE_ETA, TUNE_EARLY_STOPPING, TUNE_VALID_FRACTION, TUNE_DIR)
+from utils import logger
+from train import get_model, thread_plan, load_training_matrix, save_model
+from tree_scorer import TreeScorer
+
+# Không gian tìm kiếm: tên -> ('int'|'float'|'log', thấp, cao)
+SEARCH_SPACE = {
+    'xgboost': {
+        'max_depth': ('int', 3, 10),
+        'learning_rate': ('log', 0.02, 0.3),
+        'subsample': ('float', 0.6, 1.0),
+        'colsample_bytree': ('float', 0.4, 1.0),
+        'min_child_weight': ('log', 0.5, 10.0),
+        'reg_lambda': ('log', 0.1, 10.0),
+    },
+    'lightgbm': {
+        'num_leaves': ('int', 15, 255),
+        'learning_rate': ('log', 0.02, 0.3),
+        'min_child_samples': ('int', 5, 100),
+        'subsample': ('float', 0.6, 1.0),
+        'colsample_bytree': ('float', 0.4, 1.0),
+        'reg_lambda': ('log', 0.1, 10.0),
+    },
+    'catboost': {
+        'depth': ('int', 4, 10),
+        'learning_rate': ('log', 0.02, 0.3),
+        'l2_leaf_reg': ('log', 1.0, 10.0),
+    },
+}
+# Tham số số cây và tham số cố định (tắt log) của từng backend khi dò
+ROUNDS_PARAM = {'xgboost': 'n_estimators', 'lightgbm': 'n_estimators', 'catboost': 'iterations'}
+FIXED_PARAMS = {
+    'xgboost': {},
+    'lightgbm': {'subsample_freq': 1, 'verbose': -1},
+    'catboost': {'verbose': False, 'allow_writing_files': False},
+}
+LATENCY_ITERATIONS = 30
+
+def available_backends():
+    """Các backend import được trong môi trường hiện tại"""
+    found = []
+    for backend, module in (('xgboost', 'xgboost'), ('lightgbm', 'lightgbm'), ('catboost', 'catboost')):
+        try:
+            __import__(module)
+            found.append(backend)
+        except ImportError:
+            pass
+    return found
+
+def sample_params(space, rng):
+    params = {}
+    for name, (kind, low, high) in space.items():
+        if kind == 'int':
+            params[name] = int(rng.integers(low, high + 1))
+        elif kind == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            params[name] = float(rng.uniform(low, high))
+    return params
+
+class Budget:
+    """Ngân sách thời gian thực / CPU (time.process_time tính mọi luồng của tiến trình)"""
+
+    def __init__(self, seconds=None, cpu_seconds=None):
+        self.seconds = seconds
+        self.cpu_seconds = cpu_seconds
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+
+    def used(self):
+        return {'wall_seconds': time.perf_counter() - self._wall0, 'cpu_seconds': time.process_time() - self._cpu0}
+
+    def exhausted(self):
+        used = self.used()
+        return ((self.seconds is not None and used['wall_seconds'] >= self.seconds) or
+                (self.cpu_seconds is not None and used['cpu_seconds'] >= self.cpu_seconds))
+
+def _fit(backend, params, rounds, n_jobs, X_tr, y_tr, X_va, y_va, early_stopping=TUNE_EARLY_STOPPING):
+    """Fit 1 cấu hình có dừng sớm. Trả về (model, số cây tốt nhất)."""
+    model = get_model(backend, n_jobs=n_jobs, **FIXED_PARAMS[backend], **params, **{ROUNDS_PARAM[backend]: rounds})
+    if backend == 'xgboost':
+        model.set_params(early_stopping_rounds=early_stopping)
+        model.fit(X_tr, y_tr, eval_set=[(X_va, y_va)], verbose=False)
+        best = model.best_iteration + 1
+    elif backend == 'lightgbm':
+        import lightgbm as lgb
+        model.fit(X_tr, y_tr, eval_set=[(X_va, y_va)], callbacks=[lgb.early_stopping(early_stopping, verbose=False)])
+        best = model.best_iteration_ or rounds
+    else:
+        model.fit(X_tr, y_tr, eval_set=(X_va, y_va), early_stopping_rounds=early_stopping)
+        best = model.get_best_iteration() + 1
+    return model, int(best)
+
+def _scorer_for(model, backend, best_rounds):
+    """TreeScorer của đúng số cây tốt nhất (daemon chấm bằng nó nếu export được), không được thì None"""
+    try:
+        if backend == 'xgboost':
+            return TreeScorer.from_xgboost(model.get_booster()[:best_rounds])
+        return TreeScorer.from_model(model)
+    except Exception:
+        return None
+
+def _latency_ms(predict, X, batch_size, iterations=LATENCY_ITERATIONS):
+    """Độ trễ p50 (ms) mỗi lần gọi predict trên batch_size dòng"""
+    batch_size = min(batch_size, X.shape[0])
+    rng = np.random.default_rng(0)
+    starts = rng.integers(0, X.shape[0] - batch_size + 1, size=iterations)
+    predict(X[:batch_size])  # làm nóng
+    times = []
+    for s in starts:
+        t0 = time.perf_counter()
+        predict(X[s:s + batch_size])
+        times.append((time.perf_counter() - t0) * 1000)
+    return float(np.percentile(times, 50))
+
+def _evaluate(cand, rounds, n_jobs, data):
+    X_tr, y_tr, X_va, y_va = data
+    t0 = time.perf_counter()
+    model, best = _fit(cand['backend'], cand['params'], rounds, n_jobs, X_tr, y_tr, X_va, y_va)
+    fit_seconds = time.perf_counter() - t0
+    probs = model.predict_proba(X_va)[:, 1]
+    result = {
+        'candidate': cand['id'], 'backend': cand['backend'], 'rounds': rounds, 'best_rounds': best,
+        'fit_seconds': fit_seconds,
+        'average_precision': float(average_precision_score(y_va, probs)),
+        'roc_auc': float(roc_auc_score(y_va, probs)),
+        'f1': float(f1_score(y_va, (probs >= 0.5).astype(int), zero_division=0)),
+        'logloss': float(log_loss(y_va, probs, labels=[0, 1])),
+    }
+    return model, result
+
+def pareto_front(rows, maximize='average_precision', minimize=('latency_ms_1', 'fit_seconds')):
+    """Đánh dấu các dòng không bị dòng nào khác trội hơn (điểm >= và mọi chi phí <=, ít nhất 1 chỗ hơn hẳn)"""
+    for r in rows:
+        r['pareto'] = not any(
+            o is not r and o[maximize] >= r[maximize] and all(o[m] <= r[m] for m in minimize) and
+            (o[maximize] > r[maximize] or any(o[m] < r[m] for m in minimize))
+            for o in rows)
+    return rows
+
+def tune_pipeline(backends=None, data_path=None, feature_backend=FEATURE_BACKEND, budget_seconds=None,
+                  cpu_budget_seconds=None, parallel='candidates', max_latency_ms=None, use_cache=True,
+                  n_candidates=TUNE_CANDIDATES, min_rounds=TUNE_MIN_ROUNDS, max_rounds=TUNE_MAX_ROUNDS, eta=TUNE_ETA):
+    backends = backends or available_backends()
+    missing = [b for b in backends if b not in SEARCH_SPACE]
+    if missing:
+        raise ValueError(f"Backend không hỗ trợ dò tham số: {missing}")
+    if budget_seconds is None and cpu_budget_seconds is None:
+        budget_seconds = TUNE_BUDGET_SECONDS
+    logger.info(f"🎛️  Tuning {', '.join(backends)} (budget: {budget_seconds or '-'}s wall, "
+                f"{cpu_budget_seconds or '-'}s CPU, parallel={parallel})")
+
+    X, y, artifacts, vectorizer = load_training_matrix(data_path, feature_backend, use_cache)
+    if len(np.unique(y)) < 2:
+        raise ValueError("Dữ liệu chỉ có 1 lớp, không dò tham số được.")
+    X_tr, X_va, y_tr, y_va = train_test_split(X, y, test_size=TUNE_VALID_FRACTION, stratify=y, random_state=RANDOM_STATE)
+    data = (X_tr, y_tr, X_va, y_va)
+
+    rng = np.random.default_rng(RANDOM_STATE)
+    candidates = [{'id': f'{b}-{i}', 'backend': b, 'params': sample_params(SEARCH_SPACE[b], rng)}
+                  for b in backends for i in range(n_candidates)]
+    by_id = {c['id']: c for c in candidates}
+    budget = Budget(budget_seconds, cpu_budget_seconds)
+    evaluations = []
+    rounds, rung = min_rounds, 0
+
+    while candidates and not budget.exhausted():
+        workers, n_jobs = thread_plan(len(candidates), 'model' if parallel == 'model' else 'tasks')
+        logger.info(f"   Vòng {rung}: {len(candidates)} cấu hình x {rounds} cây "
+                    f"({workers} song song x {n_jobs} luồng/model)")
+
+        def run(cand):
+            # Kiểm tra ngân sách ngay trước khi fit: hết thì bỏ qua các cấu hình còn lại của vòng
+            if budget.exhausted():
+                return None
+            try:
+                return _evaluate(cand, rounds, n_jobs, data)
+            except Exception as e:
+                logger.warning(f"⚠️ {cand['id']} lỗi: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = [o for o in pool.map(run, candidates) if o is not None]
+        if not outcomes:
+            break
+
+        # Đo độ trễ tuần tự (không đo lúc các fit khác đang chiếm core)
+        for model, result in outcomes:
+            scorer = _scorer_for(model, result['backend'], result['best_rounds'])
+            predict = (scorer or model).predict_proba
+            result['scorer'] = scorer is not None
+            result['latency_ms_1'] = _latency_ms(predict, X_va, 1)
+            result['latency_ms_1024'] = _latency_ms(predict, X_va, 1024, iterations=5)
+            result['rung'] = rung
+            evaluations.append(result)
+            logger.info(f"     {result['candidate']:<12} AP={result['average_precision']:.4f} "
+                        f"trees={result['best_rounds']:>4} fit={result['fit_seconds']:.1f}s "
+                        f"p50@1={result['latency_ms_1']:.2f}ms")
+
+        if rounds >= max_rounds or len(outcomes) == 1:
+            break
+        ranked = sorted((r for _, r in outcomes), key=lambda r: (-r['average_precision'], r['logloss']))
+        candidates = [by_id[r['candidate']] for r in ranked[:max(1, len(ranked) // eta)]]
+        rounds, rung = min(rounds * eta, max_rounds), rung + 1
+
+    if not evaluations:
+        raise RuntimeError("Hết ngân sách trước khi đánh giá được cấu hình nào. Hãy tăng --budget.")
+
+    pareto_front(evaluations)
+    eligible = [r for r in evaluations if max_latency_ms is None or r['latency_ms_1'] <= max_latency_ms]
+    if not eligible:
+        logger.warning(f"⚠️ Không cấu hình nào có độ trễ <= {max_latency_ms}ms, chọn cấu hình nhanh nhất.")
+        eligible = [min(evaluations, key=lambda r: r['latency_ms_1'])]
+    # Điểm bằng nhau thì ưu tiên vòng sau (nhiều cây hơn đã được kiểm chứng) rồi tới độ trễ thấp
+    winner = max(eligible, key=lambda r: (r['average_precision'], r['rung'], -r['latency_ms_1']))
+
+    table = pd.DataFrame(evaluations)[['candidate', 'rung', 'best_rounds', 'average_precision', 'f1', 'roc_auc',
+                                       'fit_seconds', 'latency_ms_1', 'latency_ms_1024', 'scorer', 'pareto']]
+    print("\n" + table.sort_values(['rung', 'average_precision'], ascending=[True, False])
+          .to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    print("\nBiên Pareto (điểm AP / độ trễ / chi phí fit):")
+    print(table[table['pareto']].sort_values('latency_ms_1').to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+
+    # Fit lại cấu hình thắng trên toàn bộ dữ liệu với số cây tốt nhất (không cần dừng sớm), dùng hết core
+    cand = by_id[winner['candidate']]
+    logger.info(f"🏆 Winner: {cand['id']} {cand['params']} ({winner['best_rounds']} trees, "
+                f"AP={winner['average_precision']:.4f}). Refitting on all data...")
+    model = get_model(cand['backend'], **FIXED_PARAMS[cand['backend']], **cand['params'],
+                      **{ROUNDS_PARAM[cand['backend']]: winner['best_rounds']})
+    model.fit(X, y)
+    version = save_model(model, artifacts, vectorizer)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'backends': backends, 'feature_backend': feature_backend, 'parallel': parallel,
+        'budget': {'wall_seconds': budget_seconds, 'cpu_seconds': cpu_budget_seconds, **{f'used_{k}': v for k, v in budget.used().items()}},
+        'max_latency_ms': max_latency_ms,
+        'winner': {**winner, 'params': cand['params'], 'model_version': version},
+        'candidates': {c['id']: c['params'] for c in by_id.values()},
+        'evaluations': evaluations,
+    }
+    TUNE_DIR.mkdir(parents=True, exist_ok=True)
+    report_path = TUNE_DIR / f"tune_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"🎉 Tuning complete! Model {version}, report: {report_path}")
+    return report
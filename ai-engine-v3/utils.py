@@ -1,9 +1,14 @@
 import logging
 from sklearn.preprocessing import LabelEncoder
 import joblib
-from config import MODEL_DIR
+from config import MODEL_DIR, MANIFEST_PATH
 from pathlib import Path
+from datetime import datetime
 import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
 import sys
 
 # Setup logging (có màu mè cho dễ nhìn nếu muốn, ở đây dùng basic)
@@ -23,34 +28,81 @@ def setup_logger(name='ai_engine', level=logging.INFO):
 
 logger = setup_logger()
 
+def _codes_from_classes(s, classes):
+    """
+    Mã hóa vector hóa bằng pandas Categorical với danh mục cố định (bảng băm, 1 lượt, không lambda từng phần tử).
+    classes phải đã sắp xếp (LabelEncoder.classes_ luôn sắp xếp) nên mã trùng với le.transform().
+    Giá trị lạ (mã -1) được map về mã của 'unknown'.
+    """
+    codes = pd.Categorical(s, categories=classes).codes.astype(np.int64)
+    unseen = codes < 0
+    if unseen.any():
+        pos = np.searchsorted(classes, 'unknown')
+        if pos >= len(classes) or classes[pos] != 'unknown':
+            raise ValueError("Encoder không có lớp 'unknown' để map giá trị lạ.")
+        codes[unseen] = pos
+    return codes
+
 def safe_label_encode(series, encoder: LabelEncoder = None):
     """
     Mã hóa nhãn an toàn (Safe Label Encoding).
     Nếu gặp giá trị lạ (unseen), tự động map về 'unknown'.
+    Encoder trả về là LabelEncoder thường nên lưu chung với các artifact khác qua save_artifacts.
     """
-    s = series.fillna('unknown').astype(str)
+    s = series.astype(object).fillna('unknown').astype(str)
     if encoder is None:
         le = LabelEncoder()
-        vals = list(s.unique())
-        if 'unknown' not in vals:
-            vals.append('unknown')
+        vals = pd.unique(s)
+        if 'unknown' not in set(vals):
+            vals = np.append(vals, 'unknown')
         le.fit(vals)
-        # Transform an toàn
-        arr = le.transform(s.map(lambda x: x if x in le.classes_ else 'unknown'))
-        return le, arr
     else:
         le = encoder
-        known = set(le.classes_)
-        # Map giá trị lạ về 'unknown' trước khi transform
-        arr_mapped = s.map(lambda x: x if x in known else 'unknown')
-        return le, le.transform(arr_mapped)
+    return le, _codes_from_classes(s, le.classes_)
+
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def atomic_dump(obj, path):
+    """joblib.dump ra file tạm rồi os.replace: tiến trình khác không bao giờ đọc phải file ghi dở"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def save_artifacts(model, encoders: dict, vectorizer, model_path, encoders_path, vectorizer_path,
+                   manifest_path=MANIFEST_PATH, extra_files=None):
+    """
+    Lưu bộ model rồi ghi manifest (version + sha256 từng file).
+    extra_files: {tên: đường dẫn} các file đã ghi sẵn đi kèm model (vd: cây đã export) cũng được đưa vào manifest.
+    """
+    atomic_dump(model, model_path)
+    atomic_dump(encoders, encoders_path)
+    if vectorizer is not None:
+        atomic_dump(vectorizer, vectorizer_path)
 
-def save_artifacts(model, encoders: dict, vectorizer, model_path, encoders_path, vectorizer_path):
-    joblib.dump(model, model_path)
-    joblib.dump(encoders, encoders_path)
+    # Manifest ghi SAU CÙNG: registry chỉ nạp bộ model khi hash trên đĩa khớp với manifest
+    files = {'model': model_path, 'encoders': encoders_path}
     if vectorizer is not None:
-        joblib.dump(vectorizer, vectorizer_path)
-    logger.info(f"💾 Saved model to {model_path}")
+        files['vectorizer'] = vectorizer_path
+    files.update(extra_files or {})
+    hashes = {name: file_sha256(p) for name, p in files.items()}
+    version = datetime.now().strftime('%Y%m%d%H%M%S') + '-' + hashlib.sha256(
+        ''.join(hashes[k] for k in sorted(hashes)).encode()).hexdigest()[:8]
+    manifest = {
+        'version': version,
+        'files': {name: {'path': Path(p).name, 'sha256': hashes[name]} for name, p in files.items()}
+    }
+    tmp_manifest = Path(manifest_path).with_name(Path(manifest_path).name + '.tmp')
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, manifest_path)
+    logger.info(f"💾 Saved model to {model_path} (version {version})")
+    return version
 
 def load_artifacts(model_path, encoders_path, vectorizer_path):
     model = joblib.load(model_path)
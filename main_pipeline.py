@@ -1,7 +1,10 @@
 import subprocess
+import argparse
+import traceback
 import time
 import sys
 import os
+from collections import deque
 from datetime import datetime
 
 # --- CẤU HÌNH ---
@@ -19,8 +22,14 @@ PATH_FETCH = os.path.join("scripts", "fetch_alerts.py")
 PATH_INFERENCE = os.path.join("ai-engine-v3", "inference.py")
 PATH_REPORT = os.path.join("ai-engine-v3", "report_generator.py")
 
-def run_step(script_path, description):
-    """Hàm chạy script con"""
+# --- CHẾ ĐỘ DAEMON (chạy thường trú trong 1 tiến trình) ---
+# Import thư viện + nạp model đúng 1 lần, mỗi chu kỳ chỉ là gọi hàm.
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+ENGINE_DIR = os.path.join(ROOT_DIR, "ai-engine-v3")
+CYCLE_HISTORY = deque(maxlen=100)  # Lưu thời gian từng bước của 100 chu kỳ gần nhất
+
+def run_step(script_path, description, args=()):
+    """Hàm chạy script con (args: tham số dòng lệnh thêm cho script)"""
     print(f"\n{'='*40}")
     print(f"🚀 {description}")
     print(f"📂 File: {script_path}")
@@ -31,7 +40,7 @@ def run_step(script_path, description):
 
     try:
         # Chạy script và chờ nó xong mới chạy cái tiếp theo
-        result = subprocess.run([PYTHON_EXEC, script_path], check=True)
+        result = subprocess.run([PYTHON_EXEC, script_path, *args], check=True)
         return True
     except subprocess.CalledProcessError as e:
         print(f"⚠️ Lỗi khi chạy {script_path} (Code: {e.returncode})")
@@ -40,8 +49,148 @@ def run_step(script_path, description):
         print(f"❌ Lỗi hệ thống: {e}")
         return False
 
-def main():
-    print(f"🔥 SIEM AI AUTOMATION - Đang chạy (Interval: {LOOP_INTERVAL}s)")
+def run_cycle_inprocess(engine, report_every, cycle_no, report_range=None):
+    """
+    Một chu kỳ fetch → score → alert → rollup → report chạy bằng lời gọi hàm.
+    Thời gian / số dòng từng bước ghi vào metrics.METRICS (inference tự ghi feature_engineer, vectorize, predict, ti, notify).
+    """
+    metrics = engine['metrics'].METRICS
+
+    with metrics.stage('fetch') as st:
+        logs, new_cursor = engine['fetch'].fetch_new_alerts(engine['cursor'])
+        st.rows_out = len(logs)
+    if not logs:
+        print("⚠️ Không có log mới, bỏ qua chu kỳ này.")
+        return
+
+    # Vẫn ghi spool ra đĩa để các script lẻ (train/report CLI) dùng được
+    with metrics.stage('flatten', rows_in=len(logs)) as st:
+        df = engine['fetch'].save_to_spool(logs, engine['config'].SPOOL_PATH)
+        st.rows_out = len(df)
+
+    # Model lấy từ registry trong RAM; train.py ghi bản mới thì tự hot-reload
+    # Feature store hành vi trên đĩa lưu 1 lần mỗi chu kỳ, kèm dấu vết spool vừa ghi
+    # (inference.py chạy lẻ trên cùng spool đó sẽ không cộng batch này lần nữa)
+    feature_store = engine['inference'].get_feature_store()
+    engine['inference'].run_inference(df, feature_store=feature_store)
+    feature_store.source = engine['inference'].data_signature()
+    feature_store.save()
+
+    # Chấm điểm xong mới tiến cursor: chu kỳ lỗi sẽ lấy lại đúng các alert đó
+    engine['fetch'].save_cursor(new_cursor)
+    engine['cursor'] = new_cursor
+
+    # Cộng batch vào kho tổng hợp SAU khi tiến cursor: chu kỳ lỗi lấy lại alert cũng không bị đếm 2 lần
+    rollups = engine['rollups'].get_rollup_store()
+    if rollups is not None:
+        with metrics.stage('rollup', rows_in=len(df)) as st:
+            st.rows_out = rollups.update(df)
+
+    if report_every and cycle_no % report_every == 0:
+        # Biểu đồ / bảng lấy từ kho tổng hợp của cả khoảng report_range, batch hiện tại chỉ cho diễn giải + log mẫu
+        period = (report_range or engine['config'].REPORT_RANGE) if rollups is not None else None
+        with metrics.stage('report', rows_in=len(df)):
+            engine['report'].create_pro_report(df, period=period)
+
+def export_metrics(engine, record):
+    """Cập nhật chỉ số của dispatcher rồi ghi file Prometheus + nối 1 dòng JSONL"""
+    metrics, config = engine['metrics'].METRICS, engine['config']
+    if engine['inference'].TELEGRAM_ENABLED:
+        dispatcher = engine['inference'].get_dispatcher()
+        for key, value in dispatcher.stats.items():
+            metrics.set_counter(f'siem_dispatcher_{key}_total', value)
+        metrics.set_gauge('siem_dispatcher_pending', dispatcher.pending(), 'Alerts waiting to be sent to Telegram')
+    try:
+        metrics.write_prometheus(config.METRICS_PROM_PATH)
+        metrics.append_jsonl(record, config.METRICS_JSONL_PATH)
+    except OSError as e:
+        print(f"⚠️ Không ghi được metrics: {e}")
+
+def load_engine():
+    """Import toàn bộ module nặng (pandas/xgboost/matplotlib...) và nạp model 1 lần duy nhất"""
+    if ENGINE_DIR not in sys.path:
+        sys.path.insert(0, ENGINE_DIR)
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+
+    import config
+    import metrics
+    import inference
+    import report_generator
+    import rollup_store
+    from scripts import fetch_alerts
+
+    # Nạp sẵn model vào registry dùng chung của tiến trình
+    if inference.load_all().model is None:
+        raise RuntimeError(f"Không nạp được model tại {config.MODEL_PATH}. Hãy chạy train.py trước.")
+
+    return {
+        'config': config,
+        'fetch': fetch_alerts,
+        'inference': inference,
+        'report': report_generator,
+        'rollups': rollup_store,
+        'metrics': metrics,
+        'cursor': fetch_alerts.load_cursor(),
+    }
+
+def run_daemon(interval=LOOP_INTERVAL, report_every=1, metrics_port=None, profile_cycles=0, profile_mode='cprofile',
+               report_range=None):
+    print(f"🔥 SIEM AI DAEMON - Chạy thường trú (Interval: {interval}s)")
+    t0 = time.perf_counter()
+    engine = load_engine()
+    print(f"📦 Đã nạp engine + model trong {time.perf_counter() - t0:.2f}s")
+    metrics = engine['metrics'].METRICS
+    if metrics_port:
+        engine['metrics'].start_metrics_server(metrics_port)
+    # Profiler: bật từ dòng lệnh, hoặc khi đang chạy bằng cách tạo file trigger (xem config.PROFILE_TRIGGER_PATH)
+    profiler = engine['metrics'].CycleProfiler()
+    if profile_cycles:
+        profiler.request(profile_cycles, profile_mode)
+    print("👉 Nhấn Ctrl + C để dừng.\n")
+
+    cycle_no = 0
+    try:
+        while True:
+            cycle_no += 1
+            start = time.perf_counter()
+            print(f"\n--- 🕒 CHU KỲ #{cycle_no}: {datetime.now().strftime('%H:%M:%S')} ---")
+
+            ok = True
+            metrics.begin_cycle()
+            profiler.poll_trigger()
+            try:
+                with profiler.cycle(cycle_no), metrics.stage('cycle'):
+                    run_cycle_inprocess(engine, report_every, cycle_no, report_range)
+            except Exception as e:
+                # Một chu kỳ lỗi không được làm chết cả daemon
+                ok = False
+                print(f"❌ Chu kỳ #{cycle_no} lỗi: {e}")
+                traceback.print_exc()
+
+            elapsed = time.perf_counter() - start
+            record = metrics.end_cycle(cycle=cycle_no, ok=ok, total=elapsed)
+            timings = {k: v['seconds'] for k, v in record['stages'].items() if k != 'cycle'}
+            CYCLE_HISTORY.append({'cycle': cycle_no, 'ok': ok, 'total': elapsed, **timings})
+            export_metrics(engine, record)
+            steps = " | ".join(f"{k}={v:.3f}s" for k, v in timings.items())
+            print(f"⏱️  Chu kỳ #{cycle_no}: {elapsed:.3f}s ({steps or 'n/a'})")
+
+            # Giữ nhịp cố định: chỉ ngủ phần thời gian còn lại của interval
+            time.sleep(max(0.0, interval - elapsed))
+
+    except KeyboardInterrupt:
+        # Gửi nốt cảnh báo đang chờ, phần còn lại giữ trong outbox cho lần chạy sau
+        if engine['inference'].TELEGRAM_ENABLED:
+            engine['inference'].get_dispatcher().close(timeout=10)
+        ok_cycles = [c for c in CYCLE_HISTORY if c['ok']]
+        if ok_cycles:
+            avg = sum(c['total'] for c in ok_cycles) / len(ok_cycles)
+            print(f"\n📈 {len(ok_cycles)}/{len(CYCLE_HISTORY)} chu kỳ gần nhất thành công, trung bình {avg:.3f}s/chu kỳ.")
+        print("\n🛑 Đã dừng hệ thống (User Cancelled).")
+
+def main(interval=LOOP_INTERVAL, report_range=None):
+    print(f"🔥 SIEM AI AUTOMATION - Đang chạy (Interval: {interval}s)")
     print("👉 Nhấn Ctrl + C để dừng.\n")
 
     try:
@@ -50,7 +199,7 @@ def main():
             print(f"\n--- 🕒 CHU KỲ QUÉT: {start_time.strftime('%H:%M:%S')} ---")
 
             # BƯỚC 1: LẤY DỮ LIỆU MỚI
-            # Quan trọng: Bước này phải đảm bảo cập nhật file wazuh_data.csv
+            # Quan trọng: Bước này phải đảm bảo cập nhật spool wazuh_data.feather (hoặc wazuh_data.csv)
             if run_step(PATH_FETCH, "1. Fetch Data (Lấy log Wazuh)"):
                 
                 # BƯỚC 2: AI PHÂN TÍCH & GỬI TELEGRAM
@@ -59,18 +208,38 @@ def main():
                     
                     # BƯỚC 3: TẠO BÁO CÁO (Tùy chọn)
                     # Bác có thể comment dòng này nếu không muốn tạo PDF liên tục mỗi phút
-                    run_step(PATH_REPORT, "3. Generate Report")
+                    # Báo cáo lấy từ kho tổng hợp (bước 2 đã cộng batch vào), không đọc lại spool/CSV
+                    run_step(PATH_REPORT, "3. Generate Report", ['--range'] + ([report_range] if report_range else []))
             
             else:
                 print("⚠️ Bỏ qua chu kỳ này do lỗi Fetch Data.")
 
             elapsed = (datetime.now() - start_time).total_seconds()
             print(f"\n✅ Xong chu kỳ trong {elapsed:.2f}s.")
-            print(f"💤 Ngủ {LOOP_INTERVAL}s chờ lượt tiếp theo...")
-            time.sleep(LOOP_INTERVAL)
+            print(f"💤 Ngủ {interval}s chờ lượt tiếp theo...")
+            time.sleep(interval)
 
     except KeyboardInterrupt:
         print("\n🛑 Đã dừng hệ thống (User Cancelled).")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--daemon', action='store_true',
+                        help='Chạy thường trú trong 1 tiến trình (không spawn subprocess mỗi bước)')
+    parser.add_argument('--interval', type=float, default=LOOP_INTERVAL, help='Số giây giữa các chu kỳ')
+    parser.add_argument('--report-every', type=int, default=1,
+                        help='(daemon) Tạo PDF sau mỗi N chu kỳ, 0 = tắt')
+    parser.add_argument('--report-range', type=str, default=None,
+                        help='Khoảng thời gian của báo cáo, lấy từ kho tổng hợp (vd: 24h, 7d, 30d; mặc định REPORT_RANGE)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='(daemon) Mở endpoint Prometheus http://METRICS_HOST:<port>/metrics')
+    parser.add_argument('--profile-cycles', type=int, default=0,
+                        help='(daemon) Profile N chu kỳ đầu (kết quả trong ai-engine-v3/state/profiles)')
+    parser.add_argument('--profile-mode', choices=['cprofile', 'tracemalloc'], default='cprofile')
+    args = parser.parse_args()
+
+    if args.daemon:
+        run_daemon(interval=args.interval, report_every=args.report_every, metrics_port=args.metrics_port,
+                   profile_cycles=args.profile_cycles, profile_mode=args.profile_mode, report_range=args.report_range)
+    else:
+        main(interval=args.interval, report_range=args.report_range)
\ No newline at end of file
@@ -0,0 +1,277 @@
+import json
+import os
+import sys
+import queue
+import threading
+import time
+import uuid
+
+# Dùng chung thư mục state với AI engine
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PROJECT_ROOT, "ai-engine-v3"))
+from config import STATE_DIR
+
+from scripts.send_telegram import post_message
+
+# --- CẤU HÌNH ---
+TELEGRAM_MAX_LEN = 4096          # Giới hạn ký tự 1 tin nhắn Telegram
+CHAT_MIN_INTERVAL = 1.0          # Telegram: tối đa ~1 tin/giây cho mỗi chat
+CHAT_MAX_PER_MINUTE = 20         # Telegram: tối đa 20 tin/phút cho group
+COALESCE_WINDOW = 2.0            # Gom các alert đến trong 2 giây thành 1 tin digest
+MAX_RETRIES = 5                  # Số lần gửi lại khi lỗi tạm thời (ngoài 429)
+REQUEUE_BACKOFF = 30.0           # Digest vẫn lỗi sau MAX_RETRIES: đưa lại vào hàng đợi sau bấy nhiêu giây (nhân đôi mỗi lần lỗi)
+REQUEUE_MAX_BACKOFF = 600.0      # Trần thời gian chờ giữa 2 lượt đưa lại
+OUTBOX_PATH = STATE_DIR / 'telegram_outbox.jsonl'   # Alert chưa gửi được, sống qua restart
+OUTBOX_MAX = 1000                # Giữ tối đa bấy nhiêu alert chưa gửi (bỏ cái cũ nhất)
+DEAD_LETTER_PATH = STATE_DIR / 'telegram_dead_letter.jsonl'   # Alert bị Telegram từ chối hẳn (4xx kể cả dạng text thường)
+DIGEST_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+
+class AlertDispatcher:
+    """
+    Gửi cảnh báo Telegram ở luồng nền, tách khỏi luồng chấm điểm.
+    - submit() chỉ ghi alert vào outbox + hàng đợi rồi trả về ngay, không bao giờ chờ mạng.
+    - Luồng nền gom nhiều alert thành tin digest <= 4096 ký tự, tuân thủ rate limit của chat,
+      gặp 429 thì chờ đúng retry_after rồi gửi lại.
+    - Alert chưa gửi được lưu trong outbox (JSONL) và được gửi lại ở lần chạy sau.
+    - Alert bị từ chối hẳn (lỗi không gửi lại được) chuyển sang dead letter, không xếp hàng lại.
+    """
+
+    def __init__(self, send_func=post_message, outbox_path=OUTBOX_PATH, dead_letter_path=DEAD_LETTER_PATH):
+        self.send_func = send_func
+        self.outbox_path = outbox_path
+        self.dead_letter_path = dead_letter_path
+        self._queue = queue.Queue()
+        self._undelivered = {}        # id -> record, theo thứ tự nhận
+        self._lock = threading.Lock()
+        self._sent_times = []         # thời điểm các tin đã gửi (rate limit theo phút)
+        self._stop = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._deferred = []           # alert gửi lỗi, chờ đưa lại vào hàng đợi
+        self._failures = 0            # số lượt gửi lỗi liên tiếp (tính backoff)
+        self._requeue_at = 0.0
+        self.stats = {'submitted': 0, 'delivered': 0, 'messages': 0, 'dropped': 0, 'retries': 0,
+                      'rejected': 0}
+
+        for record in self._load_outbox():
+            self._undelivered[record['id']] = record
+            self._queue.put(record)
+        if self._undelivered:
+            # Có alert tồn từ lần trước: chưa rảnh cho tới khi gửi xong (flush() phải chờ)
+            self._idle.clear()
+            print(f"📮 Gửi lại {len(self._undelivered)} alert còn tồn trong outbox.")
+
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self._thread.start()
+
+    # --- Outbox (lưu bền) ---
+    def _load_outbox(self):
+        try:
+            with open(self.outbox_path, 'r', encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            print(f"⚠️ Outbox hỏng ({e}), bỏ qua.")
+            return []
+
+    def _persist(self):
+        """Ghi lại toàn bộ alert chưa gửi (atomic). Gọi khi đang giữ self._lock"""
+        tmp_path = f"{self.outbox_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in self._undelivered.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.outbox_path)
+
+    # --- API ---
+    def submit(self, text):
+        """Đưa 1 alert vào hàng đợi. Không chặn luồng gọi."""
+        record = {'id': uuid.uuid4().hex, 'ts': time.time(), 'text': text[:TELEGRAM_MAX_LEN]}
+        with self._lock:
+            self._undelivered[record['id']] = record
+            if len(self._undelivered) > OUTBOX_MAX:
+                while len(self._undelivered) > OUTBOX_MAX:
+                    oldest = next(iter(self._undelivered))
+                    del self._undelivered[oldest]
+                    self.stats['dropped'] += 1
+                self._persist()
+            else:
+                # Trường hợp thường: chỉ ghi nối 1 dòng, không ghi lại cả file
+                with open(self.outbox_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.stats['submitted'] += 1
+        self._queue.put(record)
+        self._idle.clear()
+
+    def pending(self):
+        with self._lock:
+            return len(self._undelivered)
+
+    def flush(self, timeout=None):
+        """Chờ gửi hết mọi alert chưa gửi (tối đa timeout giây). Trả về True nếu đã gửi hết."""
+        return self._idle.wait(timeout)
+
+    def close(self, timeout=30):
+        """Gửi nốt rồi dừng luồng nền. Cái gì chưa gửi được vẫn nằm trong outbox cho lần sau."""
+        self.flush(timeout)
+        self._stop.set()
+        self._thread.join(timeout=5)
+        left = self.pending()
+        if left:
+            print(f"📮 Còn {left} alert chưa gửi, đã lưu ở {self.outbox_path}")
+
+    # --- Luồng nền ---
+    def _collect_batch(self):
+        """Lấy 1 alert (chờ), rồi gom tiếp các alert đến trong COALESCE_WINDOW giây"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + COALESCE_WINDOW
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Bỏ các alert đã bị đẩy khỏi outbox do quá OUTBOX_MAX
+        with self._lock:
+            return [r for r in batch if r['id'] in self._undelivered]
+
+    @staticmethod
+    def _build_digests(batch):
+        """Chia batch thành các tin digest không vượt TELEGRAM_MAX_LEN ký tự"""
+        digests, current, size = [], [], 0
+        for record in batch:
+            extra = len(record['text']) + (len(DIGEST_SEPARATOR) if current else 0)
+            if current and size + extra > TELEGRAM_MAX_LEN - 64:
+                digests.append(current)
+                current, size = [], 0
+                extra = len(record['text'])
+            current.append(record)
+            size += extra
+        if current:
+            digests.append(current)
+        return digests
+
+    @staticmethod
+    def _render(records):
+        if len(records) == 1:
+            return records[0]['text']
+        header = f"📦 *{len(records)} ALERTS*"
+        return header + DIGEST_SEPARATOR + DIGEST_SEPARATOR.join(r['text'] for r in records)
+
+    def _wait_rate_limit(self):
+        now = time.monotonic()
+        self._sent_times = [t for t in self._sent_times if now - t < 60]
+        wait = 0.0
+        if self._sent_times:
+            wait = max(wait, CHAT_MIN_INTERVAL - (now - self._sent_times[-1]))
+        if len(self._sent_times) >= CHAT_MAX_PER_MINUTE:
+            wait = max(wait, 60 - (now - self._sent_times[0]))
+        if wait > 0:
+            time.sleep(wait)
+
+    def _dead_letter(self, records):
+        """Lỗi không gửi lại được: bỏ alert khỏi outbox, ghi nối vào file dead letter để xem lại bằng tay"""
+        with self._lock:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                for r in records:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            for r in records:
+                self._undelivered.pop(r['id'], None)
+            self._persist()
+        self.stats['rejected'] += len(records)
+        print(f"❌ Telegram từ chối {len(records)} alert, đã chuyển sang {self.dead_letter_path}")
+
+    def _deliver(self, records):
+        """
+        Gửi 1 digest. Trả về 'sent' nếu gửi được; 'failed' nếu lỗi tạm thời (alert vẫn nằm lại trong outbox);
+        'rejected' nếu lỗi không gửi lại được (vd: 4xx kể cả khi đã gửi lại dạng text thường, thiếu token)
+        """
+        text = self._render(records)
+        parse_mode = "Markdown"
+        attempt = 0
+        while not self._stop.is_set():
+            self._wait_rate_limit()
+            ok, retry_after, retryable = self.send_func(text, parse_mode=parse_mode)
+            self._sent_times.append(time.monotonic())
+            if ok:
+                return 'sent'
+            if retry_after:
+                # 429: chờ đúng thời gian Telegram yêu cầu, không tính vào số lần thử
+                self.stats['retries'] += 1
+                time.sleep(float(retry_after))
+                continue
+            if not retryable:
+                if parse_mode:
+                    # Lỗi 400 thường do Markdown hỏng -> gửi lại dạng text thường
+                    parse_mode = None
+                    continue
+                return 'rejected'
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                return 'failed'
+            self.stats['retries'] += 1
+            time.sleep(min(60, 2 ** attempt))
+        return 'failed'
+
+    def _defer(self, records):
+        """Gửi thất bại: alert vẫn nằm trong outbox, đưa lại vào hàng đợi sau backoff tăng dần (có trần)"""
+        self._deferred.extend(records)
+        self._failures += 1
+        backoff = min(REQUEUE_MAX_BACKOFF, REQUEUE_BACKOFF * 2 ** (self._failures - 1))
+        self._requeue_at = time.monotonic() + backoff
+        print(f"⚠️ Không gửi được {len(records)} alert, thử lại sau {backoff:.0f}s ({self.pending()} đang chờ).")
+
+    def _requeue_deferred(self):
+        if not self._deferred or time.monotonic() < self._requeue_at:
+            return
+        with self._lock:
+            # Bỏ các alert đã bị đẩy khỏi outbox do quá OUTBOX_MAX
+            records = [r for r in self._deferred if r['id'] in self._undelivered]
+        self._deferred = []
+        for r in records:
+            self._queue.put(r)
+
+    def _mark_idle(self):
+        # Chỉ coi là rảnh khi không còn alert nào chưa gửi (kể cả alert đang chờ gửi lại)
+        if self._queue.empty() and not self._deferred and self.pending() == 0:
+            self._idle.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._requeue_deferred()
+            batch = self._collect_batch()
+            if not batch:
+                self._mark_idle()
+                continue
+            for records in self._build_digests(batch):
+                status = self._deliver(records)
+                if status == 'sent':
+                    with self._lock:
+                        for r in records:
+                            self._undelivered.pop(r['id'], None)
+                        self._persist()
+                    self.stats['delivered'] += len(records)
+                    self.stats['messages'] += 1
+                    self._failures = 0
+                elif status == 'rejected':
+                    self._dead_letter(records)
+                elif not self._stop.is_set():
+                    self._defer(records)
+            self._mark_idle()
+
+_DISPATCHER = None
+_DISPATCHER_LOCK = threading.Lock()
+
+def get_dispatcher():
+    """Dispatcher dùng chung của tiến trình (tạo lần đầu khi cần)"""
+    global _DISPATCHER
+    with _DISPATCHER_LOCK:
+        if _DISPATCHER is None:
+            _DISPATCHER = AlertDispatcher()
+        return _DISPATCHER
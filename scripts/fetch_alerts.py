@@ -9,10 +9,29 @@ sys.stdout.reconfigure(encoding='utf-8')
 # Tắt cảnh báo chứng chỉ SSL tự ký 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Dùng chung cấu hình với AI engine (thư mục state, đường dẫn dữ liệu)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PROJECT_ROOT, "ai-engine-v3"))
+from config import STATE_DIR, DATA_PATH, SPOOL_PATH
+from spool import ARROW_ENABLED, write_spool
+from schema import flatten_alerts
+
 # --- CẤU HÌNH ---
 INDEXER_URL = "https://192.168.44.138:9200"
 USERNAME = "admin"
 PASSWORD = "admin"  
+INDEX_PATTERN = "wazuh-alerts-*"
+
+# --- CẤU HÌNH FETCH TĂNG DẦN (CURSOR) ---
+PAGE_SIZE = 1000                 # Số alert mỗi trang search_after
+PIT_KEEP_ALIVE = "1m"            # Thời gian giữ Point-in-Time giữa 2 trang
+INITIAL_LOOKBACK = "now-5m"      # Lần chạy đầu (chưa có cursor) lấy lùi 5 phút
+CURSOR_PATH = STATE_DIR / 'fetch_cursor.json'
+# Sắp xếp tăng dần theo thời gian, _id để phân định các alert trùng timestamp
+CURSOR_SORT = [
+    {"timestamp": {"order": "asc"}},
+    {"_id": {"order": "asc"}}
+]
 # -----------------------------------------------------------
 
 def fetch_latest_alerts(limit=1000):
@@ -76,6 +95,121 @@ def fetch_latest_alerts(limit=1000):
         print(f"❌ Lỗi nghiêm trọng: {e}")
         return []
 
+def load_cursor(path=CURSOR_PATH):
+    """Đọc high-water-mark (timestamp + _id của alert cuối cùng đã lấy). Chưa có thì trả về None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cursor = json.load(f)
+        return cursor if cursor.get('sort') else None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ Cursor hỏng ({e}), lấy lại từ {INITIAL_LOOKBACK}.")
+        return None
+
+def save_cursor(cursor, path=CURSOR_PATH):
+    """Ghi cursor kiểu atomic (file tạm + replace) để không bao giờ để lại file ghi dở"""
+    if not cursor: return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cursor, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _open_pit(session):
+    """Mở Point-in-Time để các trang search_after nhìn cùng một snapshot. Indexer cũ không hỗ trợ thì trả về None"""
+    try:
+        response = session.post(
+            f"{INDEXER_URL}/{INDEX_PATTERN}/_search/point_in_time",
+            params={"keep_alive": PIT_KEEP_ALIVE},
+            timeout=10
+        )
+        if response.status_code == 200:
+            return response.json().get('pit_id')
+    except Exception as e:
+        print(f"⚠️ Không mở được PIT ({e}), dùng search_after thường.")
+    return None
+
+def _close_pit(session, pit_id):
+    try:
+        session.delete(f"{INDEXER_URL}/_search/point_in_time", json={"pit_id": [pit_id]}, timeout=10)
+    except Exception:
+        pass  # PIT tự hết hạn sau keep_alive
+
+def fetch_new_alerts(cursor=None, page_size=PAGE_SIZE):
+    """
+    Lấy ĐÚNG các alert mới kể từ cursor, phân trang bằng search_after (+ PIT nếu có).
+    Không giới hạn số lượng: burst bao nhiêu cũng lấy hết, mỗi trang page_size alert.
+    Trả về: (logs, new_cursor). Cursor chỉ nên được lưu (save_cursor) sau khi xử lý xong logs.
+    """
+    print(f"🔌 Đang kết nối tới {INDEXER_URL} (cursor: {cursor['timestamp'] if cursor else INITIAL_LOOKBACK})...")
+
+    session = requests.Session()
+    session.auth = (USERNAME, PASSWORD)
+    session.verify = False
+
+    if cursor:
+        # Lọc theo epoch millis của cursor để indexer bỏ qua các shard/segment cũ
+        time_range = {"gte": cursor['sort'][0], "format": "epoch_millis"}
+        search_after = cursor['sort']
+    else:
+        time_range = {"gte": INITIAL_LOOKBACK, "lt": "now"}
+        search_after = None
+
+    query = {"bool": {"filter": [{"range": {"timestamp": time_range}}]}}
+    logs = []
+    new_cursor = cursor
+    pit_id = _open_pit(session)
+
+    try:
+        while True:
+            payload = {
+                "size": page_size,
+                "query": query,
+                "sort": CURSOR_SORT,
+                "track_total_hits": False
+            }
+            if search_after:
+                payload["search_after"] = search_after
+            if pit_id:
+                payload["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+                url = f"{INDEXER_URL}/_search"
+            else:
+                url = f"{INDEXER_URL}/{INDEX_PATTERN}/_search"
+
+            response = session.post(url, json=payload, timeout=30)
+            if response.status_code != 200:
+                # Giữ lại các trang đã lấy được: cursor chỉ tiến tới alert cuối cùng đã nhận
+                print(f"❌ Lỗi kết nối: {response.status_code}")
+                print(response.text)
+                break
+
+            data = response.json()
+            pit_id = data.get('pit_id', pit_id)
+            hits = data['hits']['hits']
+            if not hits:
+                break
+
+            logs.extend(hit['_source'] for hit in hits)
+            last = hits[-1]
+            search_after = last['sort']
+            new_cursor = {
+                'sort': search_after,
+                'timestamp': last['_source'].get('timestamp'),
+                '_id': last['_id']
+            }
+
+            if len(hits) < page_size:
+                break
+    except Exception as e:
+        print(f"❌ Lỗi nghiêm trọng: {e}")
+    finally:
+        if pit_id:
+            _close_pit(session, pit_id)
+        session.close()
+
+    print(f"✅ Thành công! Đã lấy được {len(logs)} cảnh báo MỚI.")
+    return logs, new_cursor
+
 def save_to_json(data, filename="wazuh_alerts.json"):
     """Lưu dữ liệu ra file JSON"""
     if not data: return
@@ -90,16 +224,50 @@ def save_to_csv(data, filename="wazuh_alerts.csv"):
     df = pd.json_normalize(data)
     df.to_csv(filename, index=False)
     print(f"💾 Đã lưu CSV vào: {filename}")
+    # Trả về DataFrame để chế độ daemon dùng tiếp luôn, khỏi đọc lại file
+    return df
+
+def save_to_spool(data, filename=SPOOL_PATH, csv_export=None, full=False, include_raw=False):
+    """
+    Lưu ra spool nhị phân dạng cột (Feather/Arrow IPC) cho inference/train/report đọc lại không cần parse.
+    csv_export: đường dẫn CSV nếu muốn xuất thêm bản CSV (để xem bằng Excel).
+    full: True = bung toàn bộ trường bằng json_normalize (chậm, tốn RAM).
+          False = chỉ lấy các trường engine dùng (schema.ALERT_FIELDS).
+    include_raw: giữ thêm JSON gốc đầy đủ trong cột '_raw'.
+    Thiếu pyarrow thì tự quay về ghi CSV như cũ.
+    """
+    if not data: return
+    df = pd.json_normalize(data) if full else flatten_alerts(data, include_raw=include_raw)
+    if ARROW_ENABLED:
+        write_spool(df, filename)
+        print(f"💾 Đã lưu spool vào: {filename}")
+    else:
+        print("⚠️ Chưa cài pyarrow, ghi CSV thay cho spool.")
+        csv_export = csv_export or DATA_PATH
+    if csv_export:
+        df.to_csv(csv_export, index=False)
+        print(f"💾 Đã lưu CSV vào: {csv_export}")
+    return df
 
 # --- CHẠY CHƯƠNG TRÌNH ---
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reset-cursor', action='store_true', help=f'Bỏ cursor cũ, lấy lại từ {INITIAL_LOOKBACK}')
+    parser.add_argument('--csv', action='store_true', help=f'Xuất thêm CSV ra {DATA_PATH}')
+    parser.add_argument('--full', action='store_true', help='Bung toàn bộ trường (json_normalize) thay vì chỉ các trường engine dùng')
+    parser.add_argument('--raw', action='store_true', help="Giữ JSON gốc của từng alert trong cột '_raw'")
+    args = parser.parse_args()
+
     print("--- BẮT ĐẦU THU THẬP DỮ LIỆU ---")
-    logs = fetch_latest_alerts()
-    PROJECT_ROOT = "D:/SIEM-PROJECT"
+    cursor = None if args.reset_cursor else load_cursor()
+    logs, new_cursor = fetch_new_alerts(cursor)
     if logs:
         # Lưu file ra thư mục gốc của dự án (..) để dễ thấy
-        csv_path = os.path.join(PROJECT_ROOT, "wazuh_data.csv")
-        save_to_csv(logs, csv_path)
-        print(f"\n🎉 Xong! Đã cập nhật dữ liệu mới vào: {csv_path}")
+        save_to_spool(logs, SPOOL_PATH, csv_export=DATA_PATH if args.csv else None,
+                      full=args.full, include_raw=args.raw)
+        # Chỉ tiến cursor khi dữ liệu đã được ghi ra đĩa
+        save_cursor(new_cursor)
+        print(f"\n🎉 Xong! Đã cập nhật dữ liệu mới vào: {SPOOL_PATH if ARROW_ENABLED else DATA_PATH}")
     else:
-        print("\n⚠️ Không có log mới trong 5 phút qua. Hệ thống đang chờ...")
\ No newline at end of file
+        print("\n⚠️ Không có log mới kể từ lần lấy trước. Hệ thống đang chờ...")
@@ -12,34 +12,52 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+# Ghi đè để test với HTTP server giả lập
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 
-def send_alert(message):
+def post_message(message, parse_mode="Markdown"):
     """
-    Gửi tin nhắn cảnh báo đến Telegram.
+    Gửi 1 tin nhắn và trả về chi tiết để bộ dispatcher biết có nên gửi lại không.
+    Trả về: (ok, retry_after, retryable)
+      - retry_after: số giây Telegram yêu cầu chờ khi bị 429 (None nếu không có)
+      - retryable: lỗi tạm thời (429, 5xx, mất mạng) -> nên gửi lại
     """
     if not BOT_TOKEN or not CHAT_ID:
         print("⚠️  Lỗi: Chưa cấu hình TELEGRAM_BOT_TOKEN hoặc TELEGRAM_CHAT_ID trong .env")
-        return False
+        return False, None, False
 
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/sendMessage"
     payload = {
         "chat_id": CHAT_ID,
         "text": message,
-        "parse_mode": "Markdown" # Hoặc 'HTML' nếu muốn format đẹp
     }
+    if parse_mode:
+        payload["parse_mode"] = parse_mode # Hoặc 'HTML' nếu muốn format đẹp
 
     try:
         response = requests.post(url, json=payload, timeout=10)
         if response.status_code == 200:
             # print("✅ Đã gửi Telegram thành công!") 
             # (Comment lại để đỡ rác log khi chạy thực tế)
-            return True
-        else:
-            print(f"❌ Lỗi gửi Telegram: {response.status_code} - {response.text}")
-            return False
+            return True, None, False
+        print(f"❌ Lỗi gửi Telegram: {response.status_code} - {response.text}")
+        if response.status_code == 429:
+            try:
+                retry_after = response.json().get('parameters', {}).get('retry_after')
+            except ValueError:
+                retry_after = None
+            return False, retry_after, True
+        return False, None, response.status_code >= 500
     except Exception as e:
         print(f"❌ Lỗi kết nối Telegram: {e}")
-        return False
+        return False, None, True
+
+def send_alert(message):
+    """
+    Gửi tin nhắn cảnh báo đến Telegram.
+    """
+    ok, _, _ = post_message(message)
+    return ok
 
 # --- PHẦN TEST ĐỘC LẬP ---
 # Khi chạy trực tiếp file này, nó sẽ gửi tin nhắn test.